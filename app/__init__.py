@@ -13,20 +13,30 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
 
     # Initialize Flask extensions here
-    from app.database import db
+    from app.database import db, configure_database, init_engines
     from app.marshmallow import marshmallow
+    from app.cache import tree_cache
+    from app.events import comment_events
+    from app.passwords import password_hasher
+    from app.metrics import request_metrics
+    from app.query_log import query_log
     
     from app.models.users import User
     from app.models.comments import Comment
+    from app.models.comment_changes import CommentChange
     
+    configure_database(app.config)
     db.init_app(app)
+    init_engines(app)
+    request_metrics.init_app(app)
+    query_log.init_app(app)
     marshmallow.init_app(app)
+    tree_cache.init_app(app)
+    comment_events.init_app(app)
+    password_hasher.init_app(app)
     migrate = Migrate(app, db)
     
     jwt = JWTManager(app)
-
-    with app.app_context():
-        db.create_all()
     
     # Register blueprints here
     from app.blueprints.users_blueprint import users_blueprint
@@ -34,6 +44,11 @@ def create_app(config_class=Config):
     
     app.register_blueprint(users_blueprint, url_prefix="/users")
     app.register_blueprint(comments_blueprint, url_prefix="/comments")
+
+    # Register CLI commands here
+    from app.cli import comments_cli
+
+    app.cli.add_command(comments_cli)
     
     # Initialize Swagger
     from app.docs import initialize_swagger
@@ -0,0 +1,524 @@
+import asyncio
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qsl
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+from app import create_app
+from app.database import REPLICA, apply_sqlite_pragmas, db, engine_options, sqlite_pragmas
+from app.metrics import instrument_engine
+from app.query_log import query_log
+from app.marshmallow import ValidationError
+from app.utils.changes import get_comment_changes, get_comments_state, latest_change
+from app.utils.comment_utils import (
+    ancestors_validators, build_tree, comment_exists, comment_tree_query, comments_validators, get_comment_ancestors,
+    get_comment_subtree, get_comments_page, validators_etag,
+)
+from app.utils.conditional import matches_validators
+from app.utils.serializers import dumps
+from app.blueprints.comments_blueprint import (
+    PAGINATION_ARGS, ancestors_args_schema, changes_args_schema, load_tree_args, render_cached_comments,
+)
+from app.schemas.comment_schema import COMMENT_LIST_FIELDS
+from config import Config
+
+# Async DBAPI drivers of the database backends
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+NOT_FOUND = {"error": "Comment does not exist"}
+
+
+def async_database_uri(uri):
+    """It switches a database URI to the async driver of its backend
+
+    Args:
+        uri (str): Database URI, e.g. SQLALCHEMY_DATABASE_URI
+
+    Raises:
+        ValueError: Backend without a supported async driver
+
+    Returns:
+        _type_: Database URL
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database backend: {backend}")
+
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class Request:
+    """It holds the parts of an ASGI HTTP request the read endpoints use"""
+
+    def __init__(self, scope):
+        self.path = scope["path"]
+        self.query_string = scope["query_string"].decode("latin-1")
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        self.if_none_match = parse_etags(headers.get("if-none-match"))
+        self.if_modified_since = parse_date(headers.get("if-modified-since"))
+
+
+class Response:
+    """It holds the status, encoded JSON payload and extra headers of a response. A body
+    already encoded is passed as is
+    """
+
+    def __init__(self, payload=None, status=200, body=None):
+        self.status = status
+        self.body = body if body is not None else b"" if payload is None else dumps(payload)
+        self.headers = []
+
+    def set_validators(self, etag, last_modified):
+        self.headers.append((b"etag", quote_etag(etag).encode()))
+
+        if last_modified is not None:
+            self.headers.append((b"last-modified", http_date(last_modified).encode()))
+
+
+class ThreadedWsgiInstance:
+    """It runs one request of a WSGI app on a thread of a pool, so one open event stream
+    never holds up the other requests. Every response message is handed back to the event
+    loop, and the response iterable is closed once sent, or as soon as the client
+    disconnects, so a stream frees its thread
+
+    Args:
+        wsgi_application (_type_): WSGI app
+        executor (ThreadPoolExecutor): Threads of the WSGI app
+    """
+
+    def __init__(self, wsgi_application, executor):
+        self.wsgi_application = wsgi_application
+        self.executor = executor
+        self.disconnected = threading.Event()
+        self.response_start = None
+        self.response_started = False
+
+    async def __call__(self, scope, receive, send):
+        self.scope = scope
+
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+
+                if message["type"] == "http.disconnect":
+                    return
+
+                body.write(message.get("body", b""))
+
+                if not message.get("more_body"):
+                    break
+
+            body.seek(0)
+            loop = asyncio.get_running_loop()
+            self.sync_send = lambda message: asyncio.run_coroutine_threadsafe(send(message), loop).result()
+            watcher = asyncio.ensure_future(self.watch_disconnect(receive))
+
+            try:
+                await loop.run_in_executor(self.executor, self.run_wsgi, body)
+            finally:
+                watcher.cancel()
+
+    async def watch_disconnect(self, receive):
+        # the body is read, so the next message can only tell the client went away
+        if (await receive())["type"] == "http.disconnect":
+            self.disconnected.set()
+
+    def build_environ(self, body):
+        """It builds the WSGI environ of the request, see PEP 3333 and the ASGI HTTP spec
+
+        Args:
+            body (_type_): Request body file
+
+        Returns:
+            _type_: WSGI environ as dictionary
+        """
+        scope = self.scope
+        script_name = scope.get("root_path", "").encode().decode("latin1")
+        path_info = scope["path"].encode().decode("latin1")
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": script_name,
+            "PATH_INFO": path_info[len(script_name):] if path_info.startswith(script_name) else path_info,
+            "QUERY_STRING": scope["query_string"].decode("latin1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+
+        if scope.get("client"):
+            environ["REMOTE_ADDR"] = scope["client"][0]
+
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin1").upper().replace("-", "_")
+            key = name if name in ("CONTENT_LENGTH", "CONTENT_TYPE") else f"HTTP_{name}"
+            value = value.decode("latin1")
+            # repeated headers are joined, as a WSGI server does
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+        return environ
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is not None and self.response_started:
+            raise exc_info[1].with_traceback(exc_info[2])
+
+        self.response_start = {
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers],
+        }
+
+    def run_wsgi(self, body):
+        iterable = self.wsgi_application(self.build_environ(body), self.start_response)
+
+        try:
+            for output in iterable:
+                if self.disconnected.is_set():
+                    return
+
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+
+                self.sync_send({"type": "http.response.body", "body": output, "more_body": True})
+        finally:
+            # ends the streamed responses and runs their teardown
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+
+        self.sync_send({"type": "http.response.body"})
+
+
+class CommentsASGI:
+    """It serves the comment read endpoints (list, tree, replies, ancestors and changes)
+    on an async SQLAlchemy engine, so a slow read waits on the database without holding a
+    thread and one process serves many concurrent readers. The responses are the same as
+    the Flask views', built by the same readers, see read. Any other request, and the
+    streamed lists, go to the Flask app, run on a pool of ASGI_THREADS threads
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.executor = ThreadPoolExecutor(self.config.get("ASGI_THREADS", 100), thread_name_prefix="wsgi")
+        # every query here is a read, so the replica serves them when there is one
+        uri = self.config.get("ASYNC_DATABASE_URI") or async_database_uri(
+            self.config.get("DATABASE_REPLICA_URI") or self.config["SQLALCHEMY_DATABASE_URI"]
+        )
+        self.engine = create_async_engine(uri, **engine_options(self.config, uri))
+        apply_sqlite_pragmas(self.engine.sync_engine, sqlite_pragmas(self.config))
+        self.sessions = async_sessionmaker(self.engine)
+        # request metrics of the Flask app, None when disabled
+        self.metrics = flask_app.extensions["request_metrics"]
+
+        if self.metrics is not None:
+            instrument_engine(self.engine.sync_engine)
+
+        # N+1 and slow query settings of the Flask app, None when disabled
+        self.query_log = flask_app.extensions["query_log"]
+        # the full list is served from the comments list cache of the Flask app when enabled
+        self.cache_enabled = flask_app.extensions["comments_cache"].backend is not None
+
+        self.routes = [
+            (re.compile(r"/comments/list"), self.get_comments),
+            (re.compile(r"/comments/(\d+)/replies"), self.get_comment_replies),
+            (re.compile(r"/comments/(\d+)/tree"), self.get_comment_tree),
+            (re.compile(r"/comments/(\d+)/ancestors"), self.get_comment_ancestors_chain),
+            (re.compile(r"/comments/changes"), self.get_comment_changes_feed),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        route = self.route(scope)
+
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+
+        handler, path_args = route
+        request = Request(scope)
+
+        if handler == self.get_comments and "stream" in request.args:
+            return await self.wsgi(scope, receive, send)
+
+        timings = self.metrics.start() if self.metrics is not None else None
+
+        statements = query_log.start(f"GET {request.path}", self.query_log) if self.query_log is not None else None
+
+        try:
+            response = await handler(request, *path_args)
+        finally:
+            if statements is not None:
+                query_log.finish(statements)
+
+        # the Flask app allows every origin
+        headers = [(b"content-length", str(len(response.body)).encode()), (b"access-control-allow-origin", b"*")]
+
+        if response.body:
+            headers.append((b"content-type", b"application/json"))
+
+        if timings is not None and self.metrics.server_timing:
+            headers.append((b"server-timing", timings.server_timing().encode()))
+
+        await send({"type": "http.response.start", "status": response.status, "headers": headers + response.headers})
+        await send({"type": "http.response.body", "body": response.body})
+
+        if timings is not None:
+            # the handlers are named after the Flask views they stand in for
+            self.metrics.finish(timings, f"comments.{handler.__name__}", "GET", response.status)
+
+    async def wsgi(self, scope, receive, send):
+        if scope["type"] != "http":
+            # the Flask app serves neither websockets nor any other protocol
+            return
+
+        await ThreadedWsgiInstance(self.flask_app, self.executor)(scope, receive, send)
+
+    def route(self, scope):
+        """It finds the async handler of a request
+
+        Args:
+            scope (dict): ASGI connection scope
+
+        Returns:
+            _type_: Handler and its integer path arguments, or None for the Flask app
+        """
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return None
+
+        for pattern, handler in self.routes:
+            match = pattern.fullmatch(scope["path"].rstrip("/"))
+
+            if match:
+                return handler, [int(arg) for arg in match.groups()]
+
+        return None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def conditional(self, request, validators, render):
+        """It answers a conditional request like conditional_get: 304 Not Modified if the
+        client's copy is current, else the rendered response with the validators
+
+        Args:
+            request (Request): Current request
+            validators (_type_): Tuple of ETag and Last-Modified, or None to skip
+            render (_type_): Coroutine function building the response
+
+        Returns:
+            _type_: Response
+        """
+        if validators is None:
+            return await render()
+
+        etag, last_modified = validators
+
+        if matches_validators(request.if_none_match, request.if_modified_since, etag, last_modified):
+            response = Response(status=304)
+        else:
+            response = await render()
+
+            if response.status != 200:
+                return response
+
+        response.set_validators(etag, last_modified)
+
+        return response
+
+    async def read(self, session, reader, *args, **kwargs):
+        """It runs a sync reader of comment_utils or changes, the same the Flask views call,
+        on an async session. The reader's queries are awaited on the event loop, so there is
+        one implementation of every read for both paths
+
+        Args:
+            session (AsyncSession): Session of the request
+            reader (_type_): Function taking a session keyword argument
+
+        Returns:
+            _type_: Result of the reader
+        """
+        return await session.run_sync(lambda sync_session: reader(*args, session=sync_session, **kwargs))
+
+    def render_cached_comments(self, list_state):
+        """It encodes the full list through the comments list cache, like the Flask view.
+        Called on a worker thread: the threads missing from the cache are read with the
+        Flask app's session, on the replica when there is one
+
+        Args:
+            list_state (tuple): State of the comment table read for the ETag
+
+        Returns:
+            _type_: Encoded JSON as bytes
+        """
+        with self.flask_app.app_context():
+            db.session.info[REPLICA] = True
+
+            return render_cached_comments(list_state)
+
+    async def get_comments(self, request):
+        async with self.sessions() as session:
+            list_state, last_modified = await self.read(
+                session, get_comments_state, self.config["COMMENTS_CHANGES_SETTLE_SECONDS"]
+            )
+
+            async def render():
+                if not PAGINATION_ARGS.intersection(request.args):
+                    # building and encoding the whole list is CPU bound, so it runs off the event loop
+                    if self.cache_enabled:
+                        return Response(body=await asyncio.to_thread(self.render_cached_comments, list_state))
+
+                    rows = (await session.execute(comment_tree_query())).all()
+                    return Response(body=await asyncio.to_thread(
+                        lambda: dumps({"comments": build_tree(rows, fields=COMMENT_LIST_FIELDS)})
+                    ))
+
+                try:
+                    args = load_tree_args(request.args, self.config)
+                except ValidationError as err:
+                    return Response({"errors": err.messages}, 400)
+
+                return Response(await self.read(session, get_comments_page, **args))
+
+            validators = validators_etag(list_state, request.query_string), last_modified
+
+            return await self.conditional(request, validators, render)
+
+    async def get_comment_replies(self, request, pk):
+        async with self.sessions() as session:
+            async def render():
+                try:
+                    args = load_tree_args(request.args, self.config)
+                except ValidationError as err:
+                    return Response({"errors": err.messages}, 400)
+
+                if not await self.read(session, comment_exists, pk):
+                    return Response(NOT_FOUND, 404)
+
+                return Response(await self.read(session, get_comments_page, parent_id=pk, **args))
+
+            validators = await self.read(session, comments_validators, pk, request.query_string)
+
+            return await self.conditional(request, validators, render)
+
+    async def get_comment_tree(self, request, pk):
+        async with self.sessions() as session:
+            async def render():
+                try:
+                    args = load_tree_args(request.args, self.config)
+                except ValidationError as err:
+                    return Response({"errors": err.messages}, 400)
+
+                comment = await self.read(session, get_comment_subtree, pk, **args)
+
+                if comment is None:
+                    return Response(NOT_FOUND, 404)
+
+                return Response({"comment": comment})
+
+            validators = await self.read(session, comments_validators, pk, request.query_string)
+
+            return await self.conditional(request, validators, render)
+
+    async def get_comment_ancestors_chain(self, request, pk):
+        async with self.sessions() as session:
+            async def render():
+                try:
+                    args = ancestors_args_schema.load(request.args)
+                except ValidationError as err:
+                    return Response({"errors": err.messages}, 400)
+
+                ancestors = await self.read(session, get_comment_ancestors, pk, args.get("max_depth"))
+
+                if ancestors is None:
+                    return Response(NOT_FOUND, 404)
+
+                return Response(ancestors)
+
+            validators = await self.read(session, ancestors_validators, pk, request.query_string)
+
+            return await self.conditional(request, validators, render)
+
+    async def get_comment_changes_feed(self, request):
+        """It serves the change feed like the Flask view. A long-poll (wait) checks the change
+        log every COMMENTS_EVENTS_POLL_INTERVAL seconds without holding a connection in between
+
+        Args:
+            request (Request): Current request
+
+        Returns:
+            _type_: Response
+        """
+        try:
+            args = changes_args_schema.load(request.args)
+        except ValidationError as err:
+            return Response({"errors": err.messages}, 400)
+
+        if "since" not in args:
+            async with self.sessions() as session:
+                seq, _ = await self.read(session, latest_change)
+
+            return Response({"changes": [], "next_since": seq, "has_more": False})
+
+        limit = min(args.get("limit", self.config["COMMENTS_PAGE_SIZE"]), self.config["COMMENTS_MAX_PAGE_SIZE"])
+        settle_seconds = self.config["COMMENTS_CHANGES_SETTLE_SECONDS"]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(args.get("wait") or 0, self.config["COMMENTS_EVENTS_MAX_WAIT"])
+
+        while True:
+            async with self.sessions() as session:
+                changes = await self.read(session, get_comment_changes, args["since"], limit, settle_seconds)
+
+            remaining = deadline - loop.time()
+
+            if changes["changes"] or remaining <= 0:
+                return Response(changes)
+
+            await asyncio.sleep(min(self.config["COMMENTS_EVENTS_POLL_INTERVAL"], remaining))
+
+
+def create_asgi_app(config_class=Config):
+    """It creates the ASGI application: the async comment reads in front of the Flask app.
+    Serve it with an ASGI server, e.g. `uvicorn --factory app.asgi:create_asgi_app`
+
+    Args:
+        config_class (_type_, optional): Config of the Flask app. Defaults to Config.
+
+    Returns:
+        _type_: ASGI application
+    """
+    return CommentsASGI(create_app(config_class))
@@ -1,16 +1,57 @@
-from flask import request, jsonify, Blueprint
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import request, jsonify, Blueprint, current_app, g, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
 
-from app.database import db
+from app.database import db, use_replica
 from app.marshmallow import ValidationError
 from app.models.users import User
-from app.models.comments import Comment
-from app.utils.comment_utils import get_comments_tree
-from app.schemas.comment_schema import CommentSchema
+from app.models.comments import Comment, DeletedParentError
+from app.cache import tree_cache
+from app.events import comment_events
+from app.utils.comment_utils import (
+    get_comments_tree, get_comments_page, get_comment_subtree, get_comment_ancestors, iter_comments_trees,
+    render_comments_threads, get_threads_state, ancestors_validators, comment_exists, comments_validators,
+    validators_etag,
+)
+from app.utils.bulk import create_comments_bulk
+from app.utils.deletion import delete_comment_mode
+from app.utils.changes import get_comment_changes, get_comments_state, latest_change
+from app.utils.conditional import conditional_get
+from app.utils.serializers import json_response, parse_ndjson, streaming_response, STREAM_MIMETYPES
+from app.schemas.comment_schema import (
+    CommentSchema, CommentTreeArgsSchema, CommentAncestorsArgsSchema, CommentChangesArgsSchema, CommentEventsArgsSchema,
+    CommentDeleteArgsSchema, COMMENT_LIST_FIELDS,
+)
 
 comments_blueprint = Blueprint("comments", __name__)
 comment_schema = CommentSchema()
-comments_schema = CommentSchema(many=True)
+tree_args_schema = CommentTreeArgsSchema()
+ancestors_args_schema = CommentAncestorsArgsSchema()
+changes_args_schema = CommentChangesArgsSchema()
+events_args_schema = CommentEventsArgsSchema()
+delete_args_schema = CommentDeleteArgsSchema()
+
+PAGINATION_ARGS = {"cursor", "limit", "max_depth", "max_children", "sort"}
+
+
+def load_tree_args(query_args, config):
+    """It validates the pagination query parameters of the tree endpoints and
+    clamps the page size to the configured maximum
+
+    Args:
+        query_args (_type_): Query parameters, e.g. request.args
+        config (_type_): App config
+
+    Raises:
+        ValidationError: Query parameters are invalid
+
+    Returns:
+        _type_: Keyword arguments for get_comments_page
+    """
+    args = tree_args_schema.load(query_args)
+    args["limit"] = min(args.get("limit", config["COMMENTS_PAGE_SIZE"]), config["COMMENTS_MAX_PAGE_SIZE"])
+
+    return args
 
 
 @comments_blueprint.route('/create', methods=["POST"])
@@ -29,46 +70,296 @@ def create_comment():
 
     text = request_data["text"]
     user_id = request_data["user_id"]
-    parent_id = request_data.get("parent_id")
+    parent_id = request_data.get("parent_id") or None
 
-    current_user_id = get_jwt_identity()
-    user = db.session.query(User).filter_by(id=user_id).first()
-    parent_comment = None
-    
-    if not user:
-        return jsonify({"error": "User doesn't exist"}), 400
+    if not user_id == get_jwt_identity():
+        # error path only: tell an unknown user apart from another existing user
+        if not db.session.query(User.id).filter_by(id=user_id).first():
+            return jsonify({"error": "User doesn't exist"}), 400
 
-    if not user_id == current_user_id:
         return jsonify({"error": "User id doesn't belongs to current user"}), 400
-    
-    if parent_id:
-        parent_comment = db.session.query(Comment).filter_by(id=parent_id).first()
-        
-        if not parent_comment:
+
+    # the token of a user is only issued after a login, so the user isn't looked up again.
+    # The username claim spares the snapshot lookup on insert (older tokens don't carry it)
+    comment = Comment(text=text, user_id=user_id, username=get_jwt().get("username"), parent_id=parent_id)
+    db.session.add(comment)
+
+    try:
+        db.session.commit()
+    except DeletedParentError:
+        db.session.rollback()
+        return jsonify({"error": "Can't reply to a deleted comment"}), 400
+    except IntegrityError:
+        # the foreign keys refused the comment, the parent (or the user) is gone
+        db.session.rollback()
+
+        if parent_id is not None and not db.session.query(Comment.id).filter_by(id=parent_id).first():
             return jsonify({"error": "Parent comment doesn't exist"}), 400
 
-    if parent_comment:
-        comment = Comment(text=text, user=user, parent_id=parent_comment.id)
+        return jsonify({"error": "User doesn't exist"}), 400
+
+    return jsonify({"success": "Comment created successfully"}), 201
+
+
+@comments_blueprint.route('/bulk', methods=["POST"])
+@jwt_required()
+def create_comments():
+    """It creates many comments of the current user from a JSON array or an NDJSON stream,
+    validated and inserted in chunked transactions. A comment may set a temp_id that later
+    comments of the same request reference with parent_temp_id to reply to it
+
+    Returns:
+        _type_: Number of created comments, their ids in input order and per comment errors as json
+    """
+    current_user_id = get_jwt_identity()
+    # like /comments/create, the username claim spares the user lookup and the foreign keys
+    # refuse the comments of a deleted user. Older tokens don't carry it
+    username = get_jwt().get("username")
+
+    if username is None:
+        username = db.session.query(User.username).filter_by(id=current_user_id).scalar()
+
+        if username is None:
+            return jsonify({"error": "User doesn't exist"}), 400
+
+    if request.mimetype == STREAM_MIMETYPES["ndjson"]:
+        items = parse_ndjson(request.stream)
     else:
-        comment = Comment(text=text, user=user)
+        items = request.get_json(silent=True)
 
-    db.session.add(comment)
-    db.session.commit()
+        if not isinstance(items, list):
+            return jsonify({"errors": {"_schema": ["Expected a JSON array or an NDJSON stream of comments."]}}), 400
 
-    return jsonify({"success": "Comment created successfully"}), 201
+    result = create_comments_bulk(items, current_user_id, username, current_app.config["COMMENTS_BULK_CHUNK_SIZE"])
+
+    if not result["errors"]:
+        status = 201
+    elif result["created"]:
+        status = 207
+    else:
+        status = 400
+
+    return json_response(result, status)
+
+
+def list_validators():
+    # the state also keys the cached list, so the view reads it from g
+    g.comments_state, last_modified = get_comments_state(current_app.config["COMMENTS_CHANGES_SETTLE_SECONDS"])
+
+    return validators_etag(g.comments_state, request.query_string.decode()), last_modified
+
+
+def replies_validators(pk):
+    return comments_validators(pk, variant=request.query_string.decode())
+
+
+def chain_validators(pk):
+    return ancestors_validators(pk, variant=request.query_string.decode())
+
+
+def render_cached_comments(list_state):
+    """It encodes all the comment trees through the comments list cache
+
+    Args:
+        list_state (tuple): State of the comment table read before, see comments_state
+
+    Returns:
+        _type_: Encoded JSON as bytes
+    """
+    return tree_cache.render_list(
+        list_state,
+        get_threads_state,
+        lambda root_ids: dict(render_comments_threads(root_ids, fields=COMMENT_LIST_FIELDS)),
+    )
 
 
 @comments_blueprint.route('/list')
+@use_replica
+@conditional_get(list_validators)
 def get_comments():
-    """It returns all the comments in a tree based heirarchy level
+    """It returns all the comments in a tree based heirarchy level. When any of the
+    cursor, limit, max_depth, max_children or sort query parameters is given, it returns
+    one keyset page of root comments with depth limited subtrees instead. With the
+    stream query parameter set to json or ndjson, the trees are streamed one root
+    comment at a time
 
     Returns:
         _type_: Comments list as json
     """
-    comments = get_comments_tree()
-    serialized_comments = comments_schema.dump(comments)
-    
-    return jsonify({"comments": serialized_comments}), 200
+    stream_format = request.args.get("stream")
+
+    if stream_format is not None:
+        if stream_format not in STREAM_MIMETYPES:
+            return jsonify({"errors": {"stream": [f"Must be one of: {', '.join(STREAM_MIMETYPES)}."]}}), 400
+
+        return streaming_response(iter_comments_trees(fields=COMMENT_LIST_FIELDS), stream_format)
+
+    if PAGINATION_ARGS.intersection(request.args):
+        try:
+            args = load_tree_args(request.args, current_app.config)
+        except ValidationError as err:
+            return jsonify({"errors": err.messages}), 400
+
+        return json_response(get_comments_page(**args))
+
+    if tree_cache.enabled:
+        return current_app.response_class(render_cached_comments(g.comments_state), mimetype="application/json")
+
+    # the tree is built directly in the output format of CommentSchema, so it is
+    # encoded without a second walk through marshmallow
+    comments = get_comments_tree(fields=COMMENT_LIST_FIELDS)
+
+    return json_response({"comments": comments})
+
+
+@comments_blueprint.route('/<int:pk>/replies')
+@use_replica
+@conditional_get(replies_validators)
+def get_comment_replies(pk):
+    """It returns one keyset page of the direct replies of a comment with their
+    depth limited subtrees, to lazily expand a branch truncated by the list endpoint
+
+    Args:
+        pk (int): Primary key of the parent comment.
+
+    Returns:
+        _type_: Replies list and next page cursor as json
+    """
+    try:
+        args = load_tree_args(request.args, current_app.config)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
+    if not comment_exists(pk):
+        return jsonify({"error": "Comment does not exist"}), 404
+
+    return json_response(get_comments_page(parent_id=pk, **args))
+
+
+@comments_blueprint.route('/<int:pk>/tree')
+@use_replica
+@conditional_get(replies_validators)
+def get_comment_tree(pk):
+    """It returns one comment with a keyset page of its direct replies and their depth
+    limited subtrees, so a client viewing one discussion doesn't download all of them
+
+    Args:
+        pk (int): Primary key of the comment.
+
+    Returns:
+        _type_: Comment with nested replies as json
+    """
+    try:
+        args = load_tree_args(request.args, current_app.config)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
+    comment = get_comment_subtree(pk, **args)
+
+    if comment is None:
+        return jsonify({"error": "Comment does not exist"}), 404
+
+    return json_response({"comment": comment})
+
+
+@comments_blueprint.route('/<int:pk>/ancestors')
+@use_replica
+@conditional_get(chain_validators)
+def get_comment_ancestors_chain(pk):
+    """It returns the ancestors of a comment from its root comment down to its parent,
+    the breadcrumb shown above a comment opened on its own
+
+    Args:
+        pk (int): Primary key of the comment.
+
+    Returns:
+        _type_: Ancestors list and whether farther ancestors were left out as json
+    """
+    try:
+        args = ancestors_args_schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
+    ancestors = get_comment_ancestors(pk, args.get("max_depth"))
+
+    if ancestors is None:
+        return jsonify({"error": "Comment does not exist"}), 404
+
+    return json_response(ancestors)
+
+
+@comments_blueprint.route('/changes')
+@use_replica
+def get_comment_changes_feed():
+    """It returns the comments created, updated or deleted after the since cursor, in
+    commit order, so clients patch their local tree instead of downloading it again.
+    Without since, it only returns the current cursor to start polling from. With wait,
+    the request is held for up to wait seconds until a change arrives (long-poll)
+
+    Returns:
+        _type_: Changes list, next cursor and whether more changes are ready as json
+    """
+    try:
+        args = changes_args_schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
+    if "since" not in args:
+        seq, _ = latest_change()
+        return json_response({"changes": [], "next_since": seq, "has_more": False})
+
+    if args.get("wait"):
+        comment_events.wait_for_changes(
+            args["since"], min(args["wait"], current_app.config["COMMENTS_EVENTS_MAX_WAIT"])
+        )
+
+    limit = min(
+        args.get("limit", current_app.config["COMMENTS_PAGE_SIZE"]),
+        current_app.config["COMMENTS_MAX_PAGE_SIZE"],
+    )
+    changes = get_comment_changes(
+        args["since"], limit, current_app.config["COMMENTS_CHANGES_SETTLE_SECONDS"]
+    )
+
+    return json_response(changes)
+
+
+@comments_blueprint.route('/events')
+def get_comment_events():
+    """It streams the comment changes as server-sent events, so clients are pushed new
+    comments instead of polling. The stream resumes after the Last-Event-ID header sent
+    by a reconnecting EventSource, or after the since query parameter, and ends after
+    timeout seconds to let the client reconnect
+
+    Returns:
+        _type_: Server-sent events stream
+    """
+    try:
+        args = events_args_schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
+    last_event_id = request.headers.get("Last-Event-ID")
+
+    if last_event_id is not None:
+        if not last_event_id.isdigit():
+            return jsonify({"errors": {"Last-Event-ID": ["Not a valid integer."]}}), 400
+
+        args["since"] = int(last_event_id)
+
+    timeout = min(
+        args.get("timeout", current_app.config["COMMENTS_EVENTS_STREAM_TIMEOUT"]),
+        current_app.config["COMMENTS_EVENTS_STREAM_TIMEOUT"],
+    )
+    events = comment_events.stream(
+        args.get("since"), timeout, current_app.config["COMMENTS_EVENTS_KEEPALIVE"]
+    )
+
+    return current_app.response_class(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @comments_blueprint.route('/delete/<int:pk>', methods=["DELETE"])
@@ -76,6 +367,10 @@ def get_comments():
 def delete_comment(pk):
     """
     Deletes a comment after validating that it belongs to the current user.
+    The mode query parameter selects "soft", which keeps the replies under a
+    "[deleted]" placeholder, or "cascade", which removes the whole subtree and
+    is refused when the subtree holds replies of other users.
+    By default a comment with replies is soft deleted and a leaf is removed.
 
     Args:
         pk (int): Primary key of the comment to delete.
@@ -83,6 +378,11 @@ def delete_comment(pk):
     Returns:
         JSON response indicating success or failure.
     """
+    try:
+        args = delete_args_schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
     current_user_id = get_jwt_identity()
     comment = db.session.query(Comment).filter_by(id=pk).first()
 
@@ -92,7 +392,7 @@ def delete_comment(pk):
     if comment.user_id != current_user_id:
         return jsonify({"error": "You are not authorized to delete this comment"}), 403
 
-    db.session.delete(comment)
-    db.session.commit()
+    if not delete_comment_mode(comment, args.get("mode"), current_user_id):
+        return jsonify({"error": "You are not authorized to delete the replies of other users"}), 403
 
     return jsonify({"success": "Comment deleted successfully"}), 200
@@ -1,17 +1,29 @@
 from flask import request, jsonify, Blueprint
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
 
 from app.models.users import User
-from app.database import db
+from app.database import db, use_replica
 from app.marshmallow import ValidationError
+from app.passwords import password_hasher, PasswordHasherBusy
 from app.schemas.user_schema import UserSchema
 
 users_blueprint = Blueprint("users", __name__)
 user_schema = UserSchema()
 
 
+@users_blueprint.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(err):
+    """It asks the client to retry when the password hashing pool is full
+
+    Returns:
+        _type_: Error message as json
+    """
+    return jsonify({"error": "Too many requests, try again later"}), 503, {"Retry-After": "1"}
+
+
 @users_blueprint.route("/login", methods=["POST"])
+@use_replica
 def login_user():
     """It validates the user credentials i.e (username and password or email and password),
     checks if any user exists against the following credentials and add user to the session.
@@ -35,11 +47,18 @@ def login_user():
     if not user:
         return jsonify({"error": "No user found"}), 400
 
-    if not check_password_hash(user.password, password):
+    if not password_hasher.verify(user.password, password):
         return jsonify({"error": "Incorrect password"}), 400
 
-    access_token = create_access_token(identity=user.id)
-    refresh_token = create_refresh_token(identity=user.id)
+    if password_hasher.needs_rehash(user.password):
+        # the hash method or cost changed since the password was set
+        user.password = password_hasher.hash(password)
+        db.session.commit()
+
+    # the username rides along in the tokens, so comment writes don't look the user up
+    claims = {"username": user.username}
+    access_token = create_access_token(identity=user.id, additional_claims=claims)
+    refresh_token = create_refresh_token(identity=user.id, additional_claims=claims)
 
     user_details = {
         "id": user.id,
@@ -67,14 +86,24 @@ def signup_user():
     except ValidationError as err:
         return jsonify({"errors": err.messages}), 400
 
-    if User.query.filter_by(username=data["username"]).first() or \
-       User.query.filter_by(email=data["email"]).first():
+    # one lookup to skip hashing for taken credentials, the unique constraints still
+    # decide between concurrent signups
+    taken = db.session.query(User.id).filter(
+        (User.username == data["username"]) | (User.email == data["email"])
+    ).first()
+
+    if taken:
         return jsonify({"error": "Username or email already exists"}), 400
 
-    hashed_password = generate_password_hash(data["password"])
+    hashed_password = password_hasher.hash(data["password"])
     new_user = User(username=data["username"], email=data["email"], password=hashed_password)
     db.session.add(new_user)
-    db.session.commit()
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Username or email already exists"}), 400
 
     return jsonify({"success": "User created successfully"})
     
@@ -88,5 +117,7 @@ def refresh_token():
         _type_: access_token
     """
     identity = get_jwt_identity()
-    access_token = create_access_token(identity=identity)
+    username = get_jwt().get("username")
+    claims = {"username": username} if username is not None else None
+    access_token = create_access_token(identity=identity, additional_claims=claims)
     return jsonify(access_token=access_token)
@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class LRUCacheBackend:
+    """It keeps cached values in process memory and evicts the least recently used
+    entries above maxsize
+
+    Args:
+        maxsize (int): Maximum number of cached values
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        with self.lock:
+            found = []
+            for key in keys:
+                value = self.values.get(key)
+                if value is not None:
+                    self.values.move_to_end(key)
+                found.append(value)
+            return found
+
+    def set_many(self, mapping):
+        with self.lock:
+            for key, value in mapping.items():
+                self.values[key] = value
+                self.values.move_to_end(key)
+            while len(self.values) > self.maxsize:
+                self.values.popitem(last=False)
+
+
+class RedisCacheBackend:
+    """It keeps cached values in a Redis compatible server shared by every worker.
+    Stale entries are never deleted, they are left to the server's maxmemory eviction
+    policy (allkeys-lru)
+
+    Args:
+        client (_type_): Redis client exposing mget and mset
+        prefix (str, optional): Prefix of every key. Defaults to "comments:".
+    """
+
+    def __init__(self, client, prefix="comments:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, prefix="comments:"):
+        try:
+            import redis
+        except ImportError as err:
+            raise RuntimeError("The redis package is required for the redis comments cache") from err
+
+        return cls(redis.Redis.from_url(url), prefix)
+
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set_many(self, mapping):
+        self.client.mset({self.prefix + key: value for key, value in mapping.items()})
+
+
+class CacheState:
+    """It holds the backend and the hit/miss counters of the cache of one app"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def count(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+
+class CommentTreeCache:
+    """It caches the encoded JSON of every root comment thread and of the assembled list.
+    The keys are read from the change log in the database: a thread by the count and
+    latest seq of its changes, the list by the state of the whole comment table. A write
+    committed by any worker or command changes the keys everywhere, so an entry is never
+    served past a change, and a reply deep in one thread doesn't evict the other threads
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """It creates the backend selected by COMMENTS_CACHE_BACKEND: "lru", "redis" or "none"
+
+        Args:
+            app (_type_): Flask app
+        """
+        backend_name = app.config.get("COMMENTS_CACHE_BACKEND", "lru")
+
+        if backend_name == "lru":
+            backend = LRUCacheBackend(app.config.get("COMMENTS_CACHE_SIZE", 1024))
+        elif backend_name == "redis":
+            backend = RedisCacheBackend.from_url(
+                app.config["COMMENTS_CACHE_REDIS_URL"],
+                app.config.get("COMMENTS_CACHE_PREFIX", "comments:"),
+            )
+        elif backend_name == "none":
+            backend = None
+        else:
+            raise ValueError(f"Unknown comments cache backend: {backend_name}")
+
+        app.extensions["comments_cache"] = CacheState(backend)
+
+    @property
+    def state(self):
+        return current_app.extensions["comments_cache"]
+
+    @property
+    def enabled(self):
+        return self.state.backend is not None
+
+    def stats(self):
+        """It returns the hit and miss counters of the cache
+
+        Returns:
+            _type_: Hits and misses as dict
+        """
+        state = self.state
+        return {"hits": state.hits, "misses": state.misses}
+
+    def render_list(self, list_state, thread_states, render_threads):
+        """It assembles the encoded {"comments": [...]} list from the cached threads,
+        rendering only the threads whose state changed since they were cached. The states
+        are always read before rendering, so a commit landing in between leaves the new
+        bytes under the old state rather than the old bytes under the new one. States and
+        threads are read through the same session, so bytes rendered from a lagging read
+        replica are stored under the replica's own lagging state
+
+        Args:
+            list_state (tuple): State of the comment table, see comments_state
+            thread_states (_type_): Callable returning (root id, state tuple) pairs of every
+                thread in list order
+            render_threads (_type_): Callable taking root ids and returning a
+                root id -> encoded thread dict
+
+        Returns:
+            _type_: Encoded JSON as bytes
+        """
+        state = self.state
+        backend = state.backend
+        list_key = "list:" + ":".join(map(str, list_state))
+        body = backend.get_many([list_key])[0]
+
+        if body is not None:
+            state.count(1, 0)
+            return body
+
+        root_ids, keys = [], []
+        for root_id, thread_state in thread_states():
+            root_ids.append(root_id)
+            keys.append(f"thread:{root_id}:" + ":".join(map(str, thread_state)))
+
+        threads = backend.get_many(keys)
+        missing = [root_id for root_id, thread in zip(root_ids, threads) if thread is None]
+        entries = {}
+
+        if missing:
+            rendered = render_threads(missing)
+            entries = {
+                key: rendered[root_id]
+                for key, root_id, thread in zip(keys, root_ids, threads)
+                if thread is None and root_id in rendered
+            }
+            threads = [
+                rendered.get(root_id) if thread is None else thread
+                for root_id, thread in zip(root_ids, threads)
+            ]
+
+        body = self.join([thread for thread in threads if thread is not None])
+        entries[list_key] = body
+        backend.set_many(entries)
+        state.count(len(root_ids) - len(missing), len(missing) + 1)
+
+        return body
+
+    @staticmethod
+    def join(threads):
+        return b'{"comments":[' + b",".join(threads) + b"]}"
+
+
+tree_cache = CommentTreeCache()
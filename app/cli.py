@@ -0,0 +1,539 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+
+import click
+import orjson
+from flask.cli import AppGroup
+from flask_migrate import stamp
+from sqlalchemy import inspect, insert, literal, select, text
+
+from app.database import db
+from app.events import comment_events
+from app.models.comments import Comment, PATH_SEPARATOR, format_path_segment, path_root_id_expression
+from app.models.comment_changes import CommentChange, CREATED, count_thread_changes
+from app.models.users import User
+from app.utils.bulk import chunked
+from app.utils.hierarchy import path_ids, recount_comments
+
+comments_cli = AppGroup("comments", help="Export, import and maintain the comment and user tables.")
+
+# Exported columns of each table. The hierarchy path, depth and username snapshot of the
+# comments are derived, see DERIVED_SQL
+TABLES = {
+    "user": (User.__table__, ("id", "username", "email", "password")),
+    "comment": (Comment.__table__, ("id", "text", "posted_at", "updated_at", "deleted_at", "user_id", "parent_id")),
+}
+FORMATS = ("ndjson", "csv")
+
+# Imported comments come after their parent, so their path and depth are computed in the
+# INSERT itself from the parent row, looked up by primary key, instead of rewriting every
+# row afterwards. {segment} is the zero padded id of the comment
+DERIVED_SQL = {
+    "path": f"coalesce((SELECT path || '{PATH_SEPARATOR}' || {{segment}} FROM comment WHERE id = {{parent_id}}), "
+            "CASE WHEN {parent_id} IS NULL THEN {segment} END)",
+    "depth": "coalesce((SELECT depth + 1 FROM comment WHERE id = {parent_id}), "
+             "CASE WHEN {parent_id} IS NULL THEN 0 END)",
+    "username": '(SELECT username FROM "user" WHERE id = {user_id})',
+    # not null, ImportCounters moves it to the latest reply after the import
+    "last_activity_at": "{posted_at}",
+}
+
+
+class IdSet:
+    """It tracks a set of non negative ids as a bitmap with one bit per id up to the highest
+    one, i.e. 125KB per million ids where a set of ints takes about 60 bytes per id
+    """
+
+    def __init__(self):
+        self.bits = bytearray()
+
+    def add(self, value):
+        index = value >> 3
+
+        if index >= len(self.bits):
+            # grow geometrically so adding increasing ids stays amortized O(1)
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits))))
+
+        self.bits[index] |= 1 << (value & 7)
+
+    def __contains__(self, value):
+        index = value >> 3
+        return index < len(self.bits) and bool(self.bits[index] >> (value & 7) & 1)
+
+    def __iter__(self):
+        """It yields the ids in increasing order"""
+        for index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        yield index << 3 | bit
+
+
+class ImportCounters:
+    """It computes the reply_count, descendant_count and last_activity_at increments of the
+    comments an import adds replies to, so no counter is recomputed from the table. The
+    imported comments are read in topological order, so walking them backwards sees every
+    comment after all of its replies and sums each subtree into its parent in one pass.
+    Existing comments the import replies to pass their increments on to their ancestors,
+    read from their path. Holds about 100 bytes per imported comment
+    """
+
+    def __init__(self):
+        # (id, parent id, posted_at) of the imported comments in topological order
+        self.rows = []
+
+    def count(self, rows):
+        for row in rows:
+            self.rows.append((row["id"], row["parent_id"], row["posted_at"]))
+            yield row
+
+    def increments(self, connection, batch_size):
+        """It computes the counter increments of every comment with imported descendants
+
+        Args:
+            connection (_type_): Connection of the import
+            batch_size (int): Comments per path lookup
+
+        Returns:
+            _type_: Comment id -> [replies, descendants, latest posting time] to add
+        """
+        added = {}
+        done = {}
+
+        for comment_id, parent_id, posted_at in reversed(self.rows):
+            # all the replies of the comment were summed into its entry already
+            own = added.pop(comment_id, None)
+            if own is not None:
+                done[comment_id] = own
+
+            if parent_id is None:
+                continue
+
+            descendants, latest = (1, posted_at) if own is None else (own[1] + 1, later(own[2], posted_at))
+            parent = added.setdefault(parent_id, [0, 0, None])
+            parent[0] += 1
+            parent[1] += descendants
+            parent[2] = later(parent[2], latest)
+
+        # the comments left are existing ones, their ancestors are read from their path
+        existing = {comment_id: tuple(own) for comment_id, own in added.items()}
+        table = Comment.__table__
+        for ids in chunked(sorted(existing), batch_size):
+            for comment_id, path in connection.execute(select(table.c.id, table.c.path).where(table.c.id.in_(ids))):
+                if path is None:
+                    continue
+
+                _, descendants, latest = existing[comment_id]
+                for ancestor_id in path_ids(path)[:-1]:
+                    ancestor = added.setdefault(ancestor_id, [0, 0, None])
+                    ancestor[1] += descendants
+                    ancestor[2] = later(ancestor[2], latest)
+
+        done.update(added)
+        return done
+
+    def apply(self, connection, batch_size):
+        """It adds the counter increments with one executemany UPDATE by primary key.
+        Existing comments outside the hierarchy index don't pass them on to their
+        ancestors until `flask comments recount`
+
+        Args:
+            connection (_type_): Connection of the import
+            batch_size (int): Comments per statement
+        """
+        statement = update_counters_sql()
+        params = (
+            {"comment_id": comment_id, "replies": replies, "descendants": descendants, "activity_at": latest}
+            for comment_id, (replies, descendants, latest) in self.increments(connection, batch_size).items()
+        )
+        for chunk in chunked(params, batch_size):
+            connection.exec_driver_sql(statement, chunk)
+
+
+def later(first, second):
+    """It returns the later of two posting times, either of which may be None"""
+    if first is None or (second is not None and second > first):
+        return second
+
+    return first
+
+
+def resolve_format(file_format, filename):
+    if file_format:
+        return file_format
+
+    return "csv" if filename.endswith(".csv") else "ndjson"
+
+
+def parse_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def sqlite_datetime(processor):
+    """It builds a converter from ISO 8601 timestamps to SQLAlchemy's SQLite DATETIME
+    storage text. Naive timestamps, as written by the export, are validated and rewritten
+    as text, several times faster than formatting a datetime object
+
+    Args:
+        processor (_type_): Bind processor of the SQLite DATETIME type
+
+    Returns:
+        _type_: Value -> parameter function
+    """
+    def convert(value):
+        if isinstance(value, str) and len(value) in (19, 26):
+            datetime.fromisoformat(value)
+            return f"{value[:10]} {value[11:19]}{value[19:] or '.000000'}"
+
+        return processor(parse_datetime(value))
+
+    return convert
+
+
+def column_converter(column_type, dialect):
+    """It builds the function converting a decoded value of a column to its driver
+    parameter, reading None and empty CSV values as NULL, or None when the decoded
+    value can be passed through
+
+    Args:
+        column_type (_type_): SQLAlchemy type of the column
+        dialect (_type_): Database dialect
+
+    Returns:
+        _type_: Value -> parameter function or None
+    """
+    python_type = column_type.python_type
+    processor = column_type.dialect_impl(dialect).bind_processor(dialect)
+
+    if python_type is datetime and dialect.name == "sqlite":
+        parse, processor = sqlite_datetime(processor), None
+    elif python_type is datetime:
+        parse = parse_datetime
+    elif python_type is int:
+        parse = int
+    else:
+        return processor
+
+    def convert(value):
+        if value is None or value == "":
+            return None
+
+        value = parse(value)
+        return value if processor is None else processor(value)
+
+    return convert
+
+
+def row_parser(table, columns):
+    """It builds a function converting a decoded NDJSON or CSV record to the driver
+    parameters of an insert, with the column conversions and bind processing done once
+    here, so the inserts skip SQLAlchemy's per row parameter processing
+
+    Args:
+        table (_type_): Table the records are imported into
+        columns (tuple): Imported column names
+
+    Returns:
+        _type_: Record -> insert parameters function
+    """
+    dialect = db.engine.dialect
+    passed, converted = [], []
+    for name in columns:
+        convert = column_converter(table.c[name].type, dialect)
+
+        if convert is None:
+            passed.append(name)
+        else:
+            converted.append((name, convert))
+
+    def parse(record):
+        row = {name: record.get(name) for name in passed}
+        for name, convert in converted:
+            row[name] = convert(record.get(name))
+        return row
+
+    return parse
+
+
+def insert_sql(table, columns, computed=None):
+    """It renders the INSERT statement of the import in the driver's named paramstyle
+
+    Args:
+        table (_type_): Table the rows are inserted into
+        columns (tuple): Column names, inserted from the parameters of the same name
+        computed (dict, optional): Column name -> SQL expression whose {name} fields are
+            replaced by parameters. Defaults to None.
+
+    Returns:
+        _type_: SQL string
+    """
+    dialect = db.engine.dialect
+    placeholder = "%({})s" if dialect.paramstyle == "pyformat" else ":{}"
+    quote = dialect.identifier_preparer.quote
+    params = {name: placeholder.format(name) for name in (*columns, "segment")}
+    values = {name: params[name] for name in columns}
+
+    for name, expression in (computed or {}).items():
+        values[name] = expression.format(**params)
+
+    return (
+        f"INSERT INTO {quote(table.name)} ({', '.join(quote(name) for name in values)}) "
+        f"VALUES ({', '.join(values.values())})"
+    )
+
+
+def update_counters_sql():
+    """It renders the UPDATE adding counter increments to a comment in the driver's named
+    paramstyle, taking the posting times as converted by row_parser"""
+    placeholder = "%({})s" if db.engine.dialect.paramstyle == "pyformat" else ":{}"
+    replies, descendants, activity_at, comment_id = (
+        placeholder.format(name) for name in ("replies", "descendants", "activity_at", "comment_id")
+    )
+
+    return (
+        f"UPDATE comment SET reply_count = reply_count + {replies}, "
+        f"descendant_count = descendant_count + {descendants}, "
+        f"last_activity_at = CASE WHEN last_activity_at < {activity_at} THEN {activity_at} "
+        f"ELSE last_activity_at END WHERE id = {comment_id}"
+    )
+
+
+def read_records(stream, file_format):
+    """It decodes an NDJSON or CSV file one record at a time
+
+    Args:
+        stream (_type_): Binary file
+        file_format (str): "ndjson" or "csv"
+
+    Yields:
+        _type_: Record as dict
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+        return
+
+    for line in stream:
+        if line.strip():
+            yield orjson.loads(line)
+
+
+def write_records(stream, file_format, columns, rows):
+    """It encodes rows as NDJSON or CSV one chunk at a time
+
+    Args:
+        stream (_type_): Binary file
+        file_format (str): "ndjson" or "csv"
+        columns (tuple): Column names, in row order
+        rows (_type_): Iterable of row tuples
+
+    Returns:
+        _type_: Number of written rows
+    """
+    count = 0
+
+    if file_format == "csv":
+        output = io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+        writer = csv.writer(output)
+        writer.writerow(columns)
+        for chunk in chunked(rows, 10000):
+            writer.writerows(
+                [value.isoformat() if isinstance(value, datetime) else value for value in row]
+                for row in chunk
+            )
+            count += len(chunk)
+        output.detach()
+        return count
+
+    for chunk in chunked(rows, 10000):
+        stream.write(b"".join(orjson.dumps(dict(zip(columns, row))) + b"\n" for row in chunk))
+        count += len(chunk)
+
+    return count
+
+
+def topological_order(rows, known, orphans):
+    """It reorders comment rows so that every comment follows its parent. Comments read
+    before their parent are held until the parent arrives, so memory only grows with the
+    number of comments read out of order
+
+    Args:
+        rows (_type_): Iterable of comment rows
+        known (IdSet): Ids of the comments already inserted, updated in place
+        orphans (list): Receives the rows whose parent never arrived
+
+    Yields:
+        _type_: Comment row whose parent was yielded or already exists
+    """
+    waiting = defaultdict(list)
+
+    for row in rows:
+        parent_id = row["parent_id"]
+
+        if parent_id is not None and parent_id not in known:
+            waiting[parent_id].append(row)
+            continue
+
+        ready = [row]
+        while ready:
+            row = ready.pop()
+            known.add(row["id"])
+            yield row
+            ready.extend(waiting.pop(row["id"], ()))
+
+    for rows in waiting.values():
+        orphans.extend(rows)
+
+
+def reset_id_sequence(table):
+    """It moves the id sequence of a PostgreSQL table past the imported ids. SQLite picks
+    the next id from the table itself"""
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"coalesce(max(id), 1)) FROM \"{table.name}\""
+        ))
+
+
+def with_path_segments(rows):
+    for row in rows:
+        row["segment"] = format_path_segment(row["id"])
+        yield row
+
+
+def with_ids_tracked(rows, ids):
+    for row in rows:
+        ids.add(row["id"])
+        yield row
+
+
+def log_imported_comments(comment_ids, batch_size):
+    """It logs the imported comments as created with one set-based statement per batch of
+    ids, so the change feed and event subscribers pick them up. The comments are picked
+    by id: an imported id may already appear in the change log, e.g. as a tombstone
+
+    Args:
+        comment_ids (IdSet): Ids of the imported comments
+        batch_size (int): Ids per statement
+    """
+    change = CommentChange.__table__
+    for ids in chunked(comment_ids, batch_size):
+        db.session.execute(insert(change).from_select(
+            ["comment_id", "parent_id", "root_id", "op"],
+            select(Comment.id, Comment.parent_id, path_root_id_expression(Comment.path), literal(CREATED))
+            .where(Comment.id.in_(ids))
+            .order_by(Comment.id),
+        ))
+        count_thread_changes(db.session.connection(), path_root_id_expression(Comment.path), Comment.id.in_(ids))
+
+
+@comments_cli.command("export")
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.option("-o", "--output", type=click.File("wb"), default="-", help="Output file, stdout by default.")
+@click.option("--format", "file_format", type=click.Choice(FORMATS), help="Defaults to csv for .csv files, else ndjson.")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows fetched per round trip.")
+def export_command(table, output, file_format, batch_size):
+    """Stream the rows of TABLE as NDJSON or CSV, ordered by id."""
+    model_table, columns = TABLES[table]
+    file_format = resolve_format(file_format, output.name)
+
+    # yield_per streams the rows from a server-side cursor where the driver has one
+    rows = db.session.execute(
+        select(*(model_table.c[name] for name in columns))
+        .order_by(model_table.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+    count = write_records(output, file_format, columns, (tuple(row) for row in rows))
+
+    click.echo(f"Exported {count} {table} rows", err=True)
+
+
+@comments_cli.command("import")
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.argument("source", type=click.File("rb"))
+@click.option("--format", "file_format", type=click.Choice(FORMATS), help="Defaults to csv for .csv files, else ndjson.")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows inserted per statement.")
+@click.option(
+    "--defer-indexes/--keep-indexes", default=True, show_default=True,
+    help="Drop the non unique indexes of TABLE during the import and build them once at the end. "
+         "Readers of the table are blocked until the import commits.",
+)
+def import_command(table, source, file_format, batch_size, defer_indexes):
+    """Insert the NDJSON or CSV rows of SOURCE into TABLE, keeping their ids, in one
+    transaction. Import the users before their comments. Comments may come in any order:
+    each one is inserted after its parent."""
+    model_table, columns = TABLES[table]
+    parse = row_parser(model_table, columns)
+    rows = (parse(record) for record in read_records(source, resolve_format(file_format, source.name)))
+    orphans = []
+    computed = None
+
+    if table == "comment":
+        known = IdSet()
+        for comment_id in db.session.execute(select(Comment.id).execution_options(yield_per=batch_size)).scalars():
+            known.add(comment_id)
+        counters = ImportCounters()
+        imported = IdSet()
+        rows = with_path_segments(counters.count(with_ids_tracked(topological_order(rows, known, orphans), imported)))
+        computed = DERIVED_SQL
+
+    connection = db.session.connection()
+    deferred = [index for index in model_table.indexes if not index.unique] if defer_indexes else []
+    for index in deferred:
+        index.drop(connection)
+
+    statement = insert_sql(model_table, columns, computed)
+    count = 0
+    for chunk in chunked(rows, batch_size):
+        connection.exec_driver_sql(statement, chunk)
+        count += len(chunk)
+
+    # building an index over the loaded table is much cheaper than updating it per row
+    for index in deferred:
+        index.create(connection)
+
+    reset_id_sequence(model_table)
+
+    if table == "comment":
+        log_imported_comments(imported, batch_size)
+        counters.apply(connection, batch_size)
+
+    db.session.commit()
+
+    if table == "comment":
+        # bulk inserts bypass the session events
+        comment_events.publish()
+
+    click.echo(f"Imported {count} {table} rows", err=True)
+
+    if orphans:
+        click.echo(
+            f"Skipped {len(orphans)} comments whose parent doesn't exist, "
+            f"e.g. {orphans[0]['id']} replying to {orphans[0]['parent_id']}",
+            err=True,
+        )
+
+
+@comments_cli.command("init-db")
+def init_db_command():
+    """Create the tables of an empty database and stamp it with the latest migration, so
+    later schema changes are applied with `flask db upgrade`."""
+    if inspect(db.engine).get_table_names():
+        click.echo("The database already has tables, apply migrations with `flask db upgrade`", err=True)
+        return
+
+    db.create_all()
+    stamp()
+
+    click.echo("Created the tables", err=True)
+
+
+@comments_cli.command("recount")
+def recount_command():
+    """Recompute the reply_count, descendant_count and last_activity_at counters of every
+    comment with one set-based UPDATE, e.g. to repair drift after manual edits."""
+    recount_comments(db.session)
+    db.session.commit()
+
+    click.echo("Recounted the comment counters", err=True)
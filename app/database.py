@@ -1,3 +1,167 @@
+import sqlite3
+from functools import partial, wraps
+
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+# bind key of the read replica, see use_replica
+REPLICA = "replica"
+
+
+class RoutingSession(Session):
+    """It sends the queries of a session marked by use_replica to the replica bind, if one
+    is configured, and everything else to the primary database. Once the session flushes,
+    the rest of it stays on the primary, so a request reads its own writes
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or (clause is not None and clause.is_dml):
+            self.info.pop(REPLICA, None)
+        elif bind is None and self.info.get(REPLICA):
+            replica = self._db.engines.get(REPLICA)
+
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def use_replica(view):
+    """It makes the queries of a read-only view go to the replica bind (DATABASE_REPLICA_URI)
+    Without a replica they go to the primary database as usual
+
+    Args:
+        view (_type_): View function
+
+    Returns:
+        _type_: Decorated view
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        db.session.info[REPLICA] = True
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(config, uri):
+    """It builds the engine options of a database from the pool settings of the config.
+    In-memory SQLite uses a single static connection, so it gets no pool sizing
+
+    Args:
+        config (_type_): App config
+        uri (str): Database URI
+
+    Returns:
+        _type_: Keyword arguments of create_engine
+    """
+    options = {
+        "pool_pre_ping": config["DATABASE_POOL_PRE_PING"],
+        "pool_recycle": config["DATABASE_POOL_RECYCLE"],
+        # compiled statements cached per engine
+        "query_cache_size": config["DATABASE_STATEMENT_CACHE_SIZE"],
+    }
+
+    if not is_memory_sqlite(make_url(uri)):
+        options["pool_size"] = config["DATABASE_POOL_SIZE"]
+        options["max_overflow"] = config["DATABASE_MAX_OVERFLOW"]
+
+    return options
+
+
+def configure_database(config):
+    """It fills SQLALCHEMY_ENGINE_OPTIONS from the pool settings, keeping any option set
+    explicitly, and adds the replica bind when DATABASE_REPLICA_URI is set
+
+    Args:
+        config (_type_): App config, before db.init_app
+    """
+    explicit_options = config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options(config, config["SQLALCHEMY_DATABASE_URI"]), **explicit_options,
+    }
+
+    if config.get("DATABASE_REPLICA_URI"):
+        uri = config["DATABASE_REPLICA_URI"]
+        config["SQLALCHEMY_BINDS"] = {
+            **(config.get("SQLALCHEMY_BINDS") or {}),
+            REPLICA: {**engine_options(config, uri), **explicit_options, "url": uri},
+        }
+
+
+def sqlite_pragmas(config):
+    """It collects the configured SQLite pragmas, e.g. WAL mode so that readers don't wait
+    for a committing writer
+
+    Args:
+        config (_type_): App config
+
+    Returns:
+        _type_: Dict of pragma name and value
+    """
+    pragmas = {
+        "journal_mode": config["SQLITE_JOURNAL_MODE"],
+        "synchronous": config["SQLITE_SYNCHRONOUS"],
+        "busy_timeout": config["SQLITE_BUSY_TIMEOUT"],
+        "mmap_size": config["SQLITE_MMAP_SIZE"],
+    }
+
+    return {name: value for name, value in pragmas.items() if value not in (None, "")}
+
+
+def set_sqlite_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+
+    cursor.close()
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """It sets the pragmas on every new connection of a SQLite engine
+
+    Args:
+        engine (_type_): Engine, or the sync_engine of an async engine
+        pragmas (dict): Pragmas, see sqlite_pragmas
+    """
+    if engine.dialect.name == "sqlite" and pragmas:
+        event.listen(engine, "connect", partial(set_sqlite_pragmas, pragmas))
+
+
+def init_engines(app):
+    """It applies the SQLite pragmas of the config to the engines of the app
+
+    Args:
+        app (_type_): Flask app, after db.init_app
+    """
+    pragmas = sqlite_pragmas(app.config)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, pragmas)
+
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """It turns on foreign key enforcement, which SQLite leaves off on every new
+    connection, so a reply to a missing comment is refused by the database
 
-db = SQLAlchemy()
+    Args:
+        dbapi_connection (_type_): New DBAPI connection
+        connection_record (_type_): Pool record of the connection
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
@@ -1,17 +1,53 @@
 import json
+from functools import cached_property
 
-from flask import Blueprint
-from flasgger import Swagger
+from flask import Blueprint, Flask
 
 
 docs_bp = Blueprint("/docs", __name__)
 
+# URL prefixes of the Flasgger views: the UI, the spec, the UI assets and the OAuth redirect
+DOCS_PATHS = ("/apidocs", "/apispec_1.json", "/flasgger_static/", "/oauth2-redirect.html")
+
+
+class LazySwagger:
+    """It serves the Swagger documentation from a separate Flask app that is built on the
+    first documentation request, so booting the API neither imports Flasgger nor reads
+    schema.json. The spec is the template alone, as no view documents itself in YAML,
+    so the docs app needs none of the API routes
+    """
+
+    def __init__(self, wsgi_app, schema_file, swagger_config=None):
+        self.wsgi_app = wsgi_app
+        self.schema_file = schema_file
+        self.swagger_config = swagger_config
+
+    @cached_property
+    def docs_app(self):
+        from flasgger import Swagger
+
+        docs_app = Flask(__name__)
+
+        if self.swagger_config is not None:
+            docs_app.config["SWAGGER"] = self.swagger_config
+
+        with open(self.schema_file) as f:
+            Swagger(docs_app, template=json.load(f))
+
+        return docs_app
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO", "").startswith(DOCS_PATHS):
+            return self.docs_app(environ, start_response)
+
+        return self.wsgi_app(environ, start_response)
+
+
 def initialize_swagger(app):
     """
     Function to initialize Swagger documentation with the app instance.
-    This function uses Flasgger's Swagger class.
+    The Flasgger app behind /apidocs is built on its first request, and
+    API_DOCS_ENABLED = False leaves the documentation out.
     """
-    with open("schema.json", "r+") as f:
-        schemas = json.load(f)
-        
-        Swagger(app, template=schemas)
+    if app.config.get("API_DOCS_ENABLED", True):
+        app.wsgi_app = LazySwagger(app.wsgi_app, app.config["API_DOCS_SCHEMA"], app.config.get("SWAGGER"))
@@ -0,0 +1,357 @@
+import threading
+import time
+from bisect import bisect_right
+from itertools import chain
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from app.database import db
+from app.models.comments import Comment
+from app.utils.changes import (
+    comment_changes_query, get_comment_changes, latest_change, serialize_change, settled_rows
+)
+from app.utils.serializers import dumps
+
+# Seconds between two reads of the change log while it has a hole that may still be filled
+BLOCKED_RETRY_SECONDS = 1.0
+
+
+class MemoryBroker:
+    """It wakes the subscribers of one worker process when the same process commits a
+    comment change. Changes committed by other processes are only pushed once a local
+    commit wakes the subscribers, so it fits a single worker deployment
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def publish(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        """It blocks until something is published after version, or until timeout
+
+        Args:
+            version (int): Version seen by the caller
+            timeout (float): Maximum number of seconds to wait
+
+        Returns:
+            _type_: Current version, unchanged on timeout
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class PollingBroker(MemoryBroker):
+    """It also wakes the subscribers when the latest seq of the comment change log moves,
+    checking it at most once per interval for the whole process, so the changes committed
+    by any worker or process sharing the database are pushed within interval seconds
+
+    Args:
+        interval (float, optional): Seconds between two checks of the change log. Defaults to 1.0.
+    """
+
+    def __init__(self, interval=1.0):
+        super().__init__()
+        self.interval = interval
+        self.latest_seq = None
+        self.checked_at = 0.0
+        self.check_lock = threading.Lock()
+
+    def wait(self, version, timeout):
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            current = super().wait(version, max(min(self.interval, remaining), 0))
+
+            if current != version or remaining <= 0:
+                return current
+
+            self.check()
+
+    def check(self):
+        # one waiting subscriber checks for the whole process, the others keep waiting
+        if not self.check_lock.acquire(blocking=False):
+            return
+
+        try:
+            if time.monotonic() - self.checked_at < self.interval:
+                return
+
+            seq, _ = latest_change()
+            db.session.close()
+            self.checked_at = time.monotonic()
+
+            if seq != self.latest_seq:
+                self.latest_seq = seq
+                self.publish()
+        finally:
+            self.check_lock.release()
+
+
+def format_event(change):
+    """It encodes a comment change as a server-sent event whose id is the change seq,
+    so a reconnecting EventSource resumes after it with the Last-Event-ID header
+
+    Args:
+        change (dict): Change serialized by serialize_change
+
+    Returns:
+        _type_: Encoded event as bytes
+    """
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (change["seq"], change["op"].encode(), dumps(change))
+
+
+class CommentEventHub:
+    """It keeps the latest comment changes of one app, each encoded once as a server-sent
+    event and shared by every subscriber of the process. The subscriber that wakes first
+    reads the new changes from the change log for all of them, so a commit costs one query
+    whatever the number of open streams
+
+    Args:
+        broker (_type_): MemoryBroker or PollingBroker waking the subscribers
+        buffer_size (int, optional): Number of buffered changes. Defaults to 1000.
+        settle_seconds (int, optional): Age after which a hole in the seqs is skipped. Defaults to 5.
+    """
+
+    def __init__(self, broker, buffer_size=1000, settle_seconds=5):
+        self.broker = broker
+        self.buffer_size = buffer_size
+        self.settle_seconds = settle_seconds
+        self.seqs = []
+        self.events = []
+        # the buffer holds every settled change after floor, up to head
+        self.floor = None
+        self.head = None
+        self.blocked = False
+        self.version = -1
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def refresh(self, version):
+        """It reads the changes committed after head into the buffer, unless the buffer was
+        already refreshed for this broker version and isn't waiting for a hole to settle
+
+        Args:
+            version (int): Broker version seen by the caller
+        """
+        with self.refresh_lock:
+            retry_blocked = self.blocked and time.monotonic() - self.refreshed_at >= BLOCKED_RETRY_SECONDS
+
+            if self.version >= version and not retry_blocked:
+                return
+
+            if self.head is None:
+                # start with the latest changes buffered for reconnecting clients
+                self.floor = self.head = max(latest_change()[0] - self.buffer_size, 0)
+
+            while True:
+                rows = db.session.execute(comment_changes_query(self.head, self.buffer_size)).all()
+                settled = settled_rows(rows, self.head, self.settle_seconds)
+                self.append(settled)
+                self.blocked = len(settled) < len(rows)
+
+                if self.blocked or len(rows) < self.buffer_size:
+                    break
+
+            self.version = version
+            self.refreshed_at = time.monotonic()
+
+    def append(self, rows):
+        events = [format_event(serialize_change(row)) for row in rows]
+
+        with self.lock:
+            self.seqs.extend(row.seq for row in rows)
+            self.events.extend(events)
+
+            if rows:
+                self.head = rows[-1].seq
+
+            overflow = len(self.seqs) - self.buffer_size
+            if overflow > 0:
+                self.floor = self.seqs[overflow - 1]
+                del self.seqs[:overflow]
+                del self.events[:overflow]
+
+    def read(self, cursor):
+        """It returns the buffered events after a seq
+
+        Args:
+            cursor (int): Seq of the last change the subscriber has received
+
+        Returns:
+            _type_: Pairs of seq and encoded event as list, or None when the
+                changes after cursor aren't buffered anymore
+        """
+        with self.lock:
+            if self.floor is None or cursor < self.floor:
+                return None
+
+            start = bisect_right(self.seqs, cursor)
+            return list(zip(self.seqs[start:], self.events[start:]))
+
+
+class CommentEvents:
+    """It pushes the committed comment changes to subscribers, as a server-sent events
+    stream or by holding long-poll requests until a change arrives. The broker selected by
+    COMMENTS_EVENTS_BACKEND wakes the subscribers: "memory" fans out the commits of the
+    current process, "poll" also watches the shared change log for other workers
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """It creates the event hub of the app with the configured broker
+
+        Args:
+            app (_type_): Flask app
+        """
+        backend_name = app.config.get("COMMENTS_EVENTS_BACKEND", "memory")
+
+        if backend_name == "memory":
+            broker = MemoryBroker()
+        elif backend_name == "poll":
+            broker = PollingBroker(app.config.get("COMMENTS_EVENTS_POLL_INTERVAL", 1.0))
+        else:
+            raise ValueError(f"Unknown comment events backend: {backend_name}")
+
+        app.extensions["comment_events"] = CommentEventHub(
+            broker,
+            app.config.get("COMMENTS_EVENTS_BUFFER_SIZE", 1000),
+            app.config.get("COMMENTS_CHANGES_SETTLE_SECONDS", 5),
+        )
+
+    @property
+    def hub(self):
+        return current_app.extensions["comment_events"]
+
+    def publish(self):
+        """It wakes the subscribers after comment changes were committed"""
+        self.hub.broker.publish()
+
+    def next_events(self, cursor, version):
+        """It returns the events after a seq, from the shared buffer or, for a subscriber
+        lagging behind the buffer, from the change log
+
+        Args:
+            cursor (int): Seq of the last change the subscriber has received
+            version (int): Broker version seen by the subscriber
+
+        Returns:
+            _type_: Pairs of seq and encoded event as list
+        """
+        hub = self.hub
+        hub.refresh(version)
+        events = hub.read(cursor)
+
+        if events is None:
+            changes = get_comment_changes(cursor, hub.buffer_size, hub.settle_seconds)["changes"]
+            events = [(change["seq"], format_event(change)) for change in changes]
+
+        return events
+
+    def wait(self, version, timeout):
+        hub = self.hub
+
+        if hub.blocked:
+            timeout = min(timeout, BLOCKED_RETRY_SECONDS)
+
+        # give the connection back to the pool while the subscriber sleeps
+        db.session.close()
+
+        return hub.broker.wait(version, timeout)
+
+    def wait_for_changes(self, since, timeout):
+        """It blocks a long-poll request until changes after since are committed
+
+        Args:
+            since (int): Seq of the last change the client has seen
+            timeout (float): Maximum number of seconds to wait
+
+        Returns:
+            _type_: True if changes are ready, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        version = self.hub.broker.version
+
+        while True:
+            if self.next_events(since, version):
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            version = self.wait(version, remaining)
+
+    def stream(self, since=None, timeout=None, keepalive=15):
+        """It streams the comment changes after since as server-sent events, with a comment
+        line every keepalive seconds of silence so proxies keep the connection open
+
+        Args:
+            since (int, optional): Seq of the last change the client has seen. Defaults to None
+                to only stream the changes committed from now on.
+            timeout (float, optional): Seconds after which the stream ends and the client
+                reconnects with Last-Event-ID. Defaults to None for no limit.
+            keepalive (float, optional): Seconds between two keepalive lines. Defaults to 15.
+
+        Yields:
+            _type_: Encoded events as bytes
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        version = self.hub.broker.version
+        self.hub.refresh(version)
+        cursor = self.hub.head if since is None else since
+
+        # reconnect after one second once the stream ends
+        yield b"retry: 1000\n\n"
+        sent_at = time.monotonic()
+
+        while True:
+            events = self.next_events(cursor, version)
+
+            if events:
+                yield b"".join(message for _, message in events)
+                cursor = events[-1][0]
+                sent_at = time.monotonic()
+                continue
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+
+            if now - sent_at >= keepalive:
+                yield b": keepalive\n\n"
+                sent_at = now
+
+            wait_until = sent_at + keepalive if deadline is None else min(sent_at + keepalive, deadline)
+            version = self.wait(version, max(wait_until - now, 0))
+
+
+comment_events = CommentEvents()
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_comment_events(session, flush_context):
+    if any(isinstance(obj, Comment) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info["comment_events_pending"] = True
+
+
+@event.listens_for(db.session, "after_commit")
+def publish_comment_events(session):
+    if session.info.pop("comment_events_pending", False) and has_app_context():
+        comment_events.publish()
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def discard_comment_events(session, previous_transaction):
+    session.info.pop("comment_events_pending", None)
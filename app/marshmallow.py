@@ -2,5 +2,5 @@ from flask_marshmallow import Marshmallow
 
 marshmallow = Marshmallow()
 
-from marshmallow import validates, ValidationError, fields
+from marshmallow import Schema, validates, validates_schema, validate, ValidationError, fields, EXCLUDE
 from marshmallow_sqlalchemy import SQLAlchemyAutoSchema
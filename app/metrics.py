@@ -0,0 +1,275 @@
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+
+from app.database import db
+
+# Stages of a request measured apart: SQL execution, tree building and JSON encoding
+STAGES = ("sql", "tree", "serialize")
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# timings of the request being served, None when it isn't instrumented
+current_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """It accumulates the query count and the time spent in each stage of one request"""
+
+    __slots__ = ("started", "queries", "sql", "tree", "serialize")
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.sql = self.tree = self.serialize = 0.0
+
+    def server_timing(self):
+        """It formats the timings as a Server-Timing header value, in milliseconds
+
+        Returns:
+            _type_: Header value
+        """
+        total = perf_counter() - self.started
+
+        return (
+            f'sql;dur={self.sql * 1000:.2f};desc="{self.queries} queries", '
+            f"tree;dur={self.tree * 1000:.2f}, serialize;dur={self.serialize * 1000:.2f}, "
+            f"total;dur={total * 1000:.2f}"
+        )
+
+
+def timed(stage):
+    """It adds the run time of a function to a stage of the current request's timings.
+    Outside an instrumented request it only costs a context variable lookup
+
+    Args:
+        stage (str): One of STAGES
+
+    Returns:
+        _type_: Function decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            timings = current_timings.get()
+
+            if timings is None:
+                return function(*args, **kwargs)
+
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                setattr(timings, stage, getattr(timings, stage) + perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_timings.get() is not None:
+        context.metrics_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings.get()
+    started = getattr(context, "metrics_started", None)
+
+    if timings is not None and started is not None:
+        timings.queries += 1
+        timings.sql += perf_counter() - started
+
+
+def instrument_engine(engine):
+    """It counts and times the statements an engine executes for the current request
+
+    Args:
+        engine (_type_): Engine, or the sync_engine of an async engine
+    """
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class Histogram:
+    """It counts observed values in cumulative buckets, the Prometheus histogram model"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def format_labels(**labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+class MetricsState:
+    """It holds the request metrics of one app, aggregated per endpoint in this process"""
+
+    def __init__(self, buckets, server_timing):
+        self.buckets = tuple(buckets)
+        self.server_timing = server_timing
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.requests = {}
+        self.queries = {}
+        self.stage_seconds = {}
+
+    def start(self):
+        timings = RequestTimings()
+        current_timings.set(timings)
+
+        return timings
+
+    def finish(self, timings, endpoint, method, status):
+        """It records a finished request and stops collecting its timings
+
+        Args:
+            timings (RequestTimings): Timings returned by start
+            endpoint (str): Endpoint name, e.g. comments.get_comments
+            method (str): HTTP method
+            status (int): Response status code
+        """
+        duration = perf_counter() - timings.started
+        current_timings.set(None)
+
+        with self.lock:
+            histogram = self.durations.get((endpoint, method))
+            if histogram is None:
+                histogram = self.durations[(endpoint, method)] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+            self.requests[(endpoint, method, status)] = self.requests.get((endpoint, method, status), 0) + 1
+            self.queries[endpoint] = self.queries.get(endpoint, 0) + timings.queries
+            for stage in STAGES:
+                key = (endpoint, stage)
+                self.stage_seconds[key] = self.stage_seconds.get(key, 0.0) + getattr(timings, stage)
+
+    def render(self):
+        """It writes the metrics in the Prometheus text exposition format
+
+        Returns:
+            _type_: Metrics as text
+        """
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by endpoint.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+
+        with self.lock:
+            for (endpoint, method), histogram in sorted(self.durations.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), histogram.counts):
+                    cumulative += count
+                    labels = format_labels(endpoint=endpoint, method=method, le=bound)
+                    lines.append(f"http_request_duration_seconds_bucket{{{labels}}} {cumulative}")
+                labels = format_labels(endpoint=endpoint, method=method)
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+            lines += ["# HELP http_requests_total Requests by endpoint and status.", "# TYPE http_requests_total counter"]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                labels = format_labels(endpoint=endpoint, method=method, status=status)
+                lines.append(f"http_requests_total{{{labels}}} {count}")
+
+            lines += ["# HELP db_queries_total SQL statements executed by endpoint.", "# TYPE db_queries_total counter"]
+            for endpoint, count in sorted(self.queries.items()):
+                lines.append(f"db_queries_total{{{format_labels(endpoint=endpoint)}}} {count}")
+
+            lines += [
+                "# HELP request_stage_seconds_total Time spent in SQL, tree building and serialization by endpoint.",
+                "# TYPE request_stage_seconds_total counter",
+            ]
+            for (endpoint, stage), seconds in sorted(self.stage_seconds.items()):
+                lines.append(f"request_stage_seconds_total{{{format_labels(endpoint=endpoint, stage=stage)}}} {seconds}")
+
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """It instruments the requests of an app when METRICS_ENABLED or SERVER_TIMING_ENABLED
+    is set: the statements of its engines are counted and timed, as are build_tree and the
+    JSON encoding. SERVER_TIMING_ENABLED sends the numbers back in a Server-Timing header,
+    METRICS_ENABLED aggregates them into latency histograms served at METRICS_PATH. When
+    both are off nothing is registered, so requests run exactly as before
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """It registers the request hooks, the engine listeners and the metrics endpoint
+
+        Args:
+            app (_type_): Flask app, after db.init_app
+        """
+        enabled = app.config.get("METRICS_ENABLED", False)
+        server_timing = app.config.get("SERVER_TIMING_ENABLED", False)
+
+        if not (enabled or server_timing):
+            app.extensions["request_metrics"] = None
+            return
+
+        app.extensions["request_metrics"] = MetricsState(
+            app.config.get("METRICS_BUCKETS", DEFAULT_BUCKETS), server_timing
+        )
+
+        with app.app_context():
+            for engine in db.engines.values():
+                instrument_engine(engine)
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+        if enabled:
+            app.add_url_rule(app.config.get("METRICS_PATH", "/metrics"), "metrics", self.metrics_view)
+
+    @property
+    def state(self):
+        return current_app.extensions["request_metrics"]
+
+    def before_request(self):
+        request.environ["metrics.timings"] = self.state.start()
+
+    def after_request(self, response):
+        state, timings = self.state, request.environ.get("metrics.timings")
+
+        if timings is not None:
+            request.environ["metrics.status"] = response.status_code
+
+            if state.server_timing:
+                response.headers["Server-Timing"] = timings.server_timing()
+
+        return response
+
+    def teardown_request(self, exc=None):
+        # runs once a streamed response is fully sent, so its latency covers the stream
+        timings = request.environ.pop("metrics.timings", None)
+
+        if timings is not None:
+            status = request.environ.get("metrics.status", 500)
+            self.state.finish(timings, request.endpoint or "unmatched", request.method, status)
+
+    def metrics_view(self):
+        """It serves the request metrics of this process in the Prometheus text format
+
+        Returns:
+            _type_: Metrics as text
+        """
+        return Response(self.state.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,140 @@
+from datetime import datetime, timezone
+from sqlalchemy import Integer, event, func, inspect, literal, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import db
+from app.models.comments import Comment, path_root_id, path_root_id_expression
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# Comment columns whose change is published as an "updated" change
+TRACKED_COLUMNS = ("text", "user_id", "parent_id", "deleted_at")
+
+# CommentThread row counting the changes outside any known thread
+UNATTRIBUTED_ROOT_ID = 0
+
+
+class CommentChange(db.Model):
+    """It creates a CommentChange table, the append-only change log of the Comment table.
+    Every insert, update and delete of a comment appends a row with a monotonic seq, so
+    deleted comments leave a tombstone and clients can fetch the changes after a seq.
+    root_id names the root comment of the changed comment's thread, counted in CommentThread.
+    It is null when the path of the comment wasn't known
+
+    Args:
+        db (_type_): Database object
+
+    Returns:
+        _type_: Formatted string of seq, operation and comment id as instance representation
+    """
+    __tablename__ = "comment_change"
+    __table_args__ = (
+        # never hand out a seq twice, even one whose row was deleted
+        {"sqlite_autoincrement": True},
+    )
+
+    seq: Mapped[int] = mapped_column(primary_key=True)
+    comment_id: Mapped[int] = mapped_column(index=True)
+    parent_id: Mapped[int | None] = mapped_column(nullable=True)
+    root_id: Mapped[int | None] = mapped_column(nullable=True)
+    op: Mapped[str] = mapped_column(nullable=False)
+    changed_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f"{self.seq} {self.op} {self.comment_id}"
+
+
+class CommentThread(db.Model):
+    """It creates a CommentThread table counting the changes of every comment thread, the
+    changes outside any known thread under UNATTRIBUTED_ROOT_ID. A count is incremented in
+    the transaction appending the changes, so it moves with every committed change, also
+    when a transaction holding a lower seq commits after a higher one, and the state of
+    every thread is read with one row per thread whatever the length of the change log
+
+    Args:
+        db (_type_): Database object
+
+    Returns:
+        _type_: Formatted string of root id and change count as instance representation
+    """
+    __tablename__ = "comment_thread"
+
+    root_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    changes: Mapped[int] = mapped_column(nullable=False)
+
+    def __repr__(self):
+        return f"{self.root_id} {self.changes}"
+
+
+def count_thread_changes(connection, root_id, *criteria):
+    """It adds appended changes to the counts of their threads with one upsert
+
+    Args:
+        connection (_type_): Connection of the transaction appending the changes
+        root_id (_type_): Root comment id of the changes, null outside any known thread
+        criteria (_type_): Filters of the comments changed, none for a single change
+    """
+    table = CommentThread.__table__
+    root_id = func.coalesce(root_id, UNATTRIBUTED_ROOT_ID)
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(table).from_select(
+        ["root_id", "changes"],
+        # the WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+        select(root_id, func.count()).where(true(), *criteria).group_by(root_id),
+    )
+
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.root_id], set_={"changes": table.c.changes + statement.excluded.changes}
+    ))
+
+
+def change_root_id(target):
+    """It returns the root comment id of a flushed comment, from its loaded path or else
+    from its row, which is null once the row is deleted
+
+    Args:
+        target (Comment): Flushed comment
+
+    Returns:
+        _type_: SQL expression of the root comment id
+    """
+    path = inspect(target).dict.get("path")
+
+    if path:
+        return literal(path_root_id(path), Integer)
+
+    table = Comment.__table__
+
+    return select(path_root_id_expression(table.c.path)).where(table.c.id == target.id).scalar_subquery()
+
+
+def record_change(connection, op, target):
+    root_id = change_root_id(target)
+    connection.execute(
+        CommentChange.__table__.insert().values(
+            comment_id=target.id, parent_id=target.parent_id, root_id=root_id, op=op
+        )
+    )
+    count_thread_changes(connection, root_id)
+
+
+@event.listens_for(Comment, "after_insert")
+def record_created(mapper, connection, target):
+    record_change(connection, CREATED, target)
+
+
+@event.listens_for(Comment, "after_update")
+def record_updated(mapper, connection, target):
+    state = inspect(target)
+
+    # after_update also runs for comments flushed without any column change
+    if any(state.attrs[column].history.has_changes() for column in TRACKED_COLUMNS):
+        record_change(connection, UPDATED, target)
+
+
+@event.listens_for(Comment, "after_delete")
+def record_deleted(mapper, connection, target):
+    record_change(connection, DELETED, target)
@@ -1,13 +1,33 @@
 from datetime import datetime, timezone
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Integer, String, case, cast, event, func, or_, select
 from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app.database import db
+from app.models.users import User
+
+# Width of the zero padded comment ids joined by '/' in Comment.path, so that
+# sorting paths as strings sorts comments depth first in id order
+PATH_SEGMENT_WIDTH = 10
+PATH_SEPARATOR = "/"
+
+# Fields shown instead of the author and text of a soft deleted comment
+DELETED_PLACEHOLDER = {"text": "[deleted]", "user_id": None, "username": None}
+
+
+class DeletedParentError(Exception):
+    """Raised when a reply is posted under a soft deleted comment"""
 
 
 class Comment(db.Model):
     """It creates a Comment table with fields id, text, posted_at, user_id as foreign key of User 
-    and parent_id as foriegn key of Comment model to represent the parent of each comment instance
+    and parent_id as foriegn key of Comment model to represent the parent of each comment instance.
+    The path and depth fields form a materialized path hierarchy index that is filled on insert:
+    path joins the zero padded ids of the root comment down to the comment itself with '/'.
+    A soft deleted comment keeps its place in the tree with its text erased and deleted_at set.
+    reply_count, descendant_count and last_activity_at (latest posting time in the subtree)
+    are counters maintained on insert and delete, see update_ancestor_counters. username is
+    a snapshot of the author's username taken on insert, so reads never join the user table
 
     Args:
         db (_type_): Database object
@@ -15,16 +35,212 @@ class Comment(db.Model):
     Returns:
         _type_: Formatted string of id and text as instance representation
     """
+    __table_args__ = (
+        # serves root listing (parent_id IS NULL ORDER BY posted_at, id), reply loading
+        # by parent_id and the keyset cursors of both
+        db.Index("ix_comment_parent_id_posted_at_id", "parent_id", "posted_at", "id"),
+        # serve the other sort modes of root comments and replies, scanned backwards
+        db.Index("ix_comment_parent_id_last_activity_at_id", "parent_id", "last_activity_at", "id"),
+        db.Index("ix_comment_parent_id_reply_count_id", "parent_id", "reply_count", "id"),
+        # never reuse the id of a deleted comment, the change log keeps referring to it
+        {"sqlite_autoincrement": True},
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     text: Mapped[str] = mapped_column(nullable=False)
     posted_at: Mapped[datetime] = mapped_column(default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime | None] = mapped_column(
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        nullable=True,
+    )
     
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     user = db.relationship("User", backref="comments", foreign_keys=[user_id])
+    username: Mapped[str | None] = mapped_column(nullable=True)
 
     parent_id: Mapped[int | None] = mapped_column(ForeignKey("comment.id"), nullable=True)
     parent = db.relationship("Comment", remote_side=[id], backref="replies")
+
+    # "C" collation keeps the byte order PATH_SEPARATOR < digits on PostgreSQL, which the
+    # subtree range scans rely on
+    path: Mapped[str | None] = mapped_column(
+        String().with_variant(String(collation="C"), "postgresql"), index=True, nullable=True
+    )
+    depth: Mapped[int | None] = mapped_column(nullable=True)
+    deleted_at: Mapped[datetime | None] = mapped_column(nullable=True)
+
+    reply_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    descendant_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    # posting time of the comment itself on insert, by the ORM or a Core insert alike, so
+    # the activity sort and its cursors never meet a NULL
+    last_activity_at: Mapped[datetime] = mapped_column(
+        default=lambda context: context.get_current_parameters()["posted_at"]
+    )
     
     def __repr__(self):
         return f"{self.id} {self.text}"
-    
\ No newline at end of file
+
+
+def format_path_segment(comment_id):
+    """It zero pads a comment id to a fixed width path segment
+
+    Args:
+        comment_id (int): Comment id
+
+    Returns:
+        _type_: Path segment as string
+    """
+    return str(comment_id).zfill(PATH_SEGMENT_WIDTH)
+
+
+def path_root_id(path):
+    """It reads the id of the root comment of a thread from a materialized path
+
+    Args:
+        path (str): Materialized path or None
+
+    Returns:
+        _type_: Root comment id, or None without a path
+    """
+    if not path:
+        return None
+
+    return int(path[:PATH_SEGMENT_WIDTH])
+
+
+def path_root_id_expression(path):
+    """It builds the SQL expression of the root comment id of a materialized path column,
+    null without a path
+
+    Args:
+        path (_type_): Path column
+
+    Returns:
+        _type_: SQL expression
+    """
+    return cast(func.substr(path, 1, PATH_SEGMENT_WIDTH), Integer)
+
+
+@event.listens_for(Comment, "after_insert")
+def set_hierarchy_path(mapper, connection, target):
+    """It fills path and depth of a newly inserted comment from its parent row in the
+    same flush, with a single UPDATE whose parent lookup runs inside the database, and
+    snapshots the author's username unless it was given. It then counts the comment in
+    the counters of its ancestors
+
+    Args:
+        mapper (_type_): Comment mapper
+        connection (_type_): Connection of the flush
+        target (Comment): Inserted comment
+
+    Raises:
+        DeletedParentError: The parent comment is soft deleted, read by the same UPDATE
+    """
+    table = Comment.__table__
+    segment = format_path_segment(target.id)
+    returning = [table.c.path, table.c.depth, table.c.username]
+
+    if target.parent_id is None:
+        values = {"path": segment, "depth": 0}
+    else:
+        parent = table.alias("parent")
+        parent_deleted_at = select(parent.c.deleted_at).where(parent.c.id == target.parent_id).scalar_subquery()
+        returning.append(parent_deleted_at.label("parent_deleted_at"))
+        values = {
+            "path": select(parent.c.path + PATH_SEPARATOR + segment)
+            .where(parent.c.id == target.parent_id)
+            .scalar_subquery(),
+            "depth": select(parent.c.depth + 1)
+            .where(parent.c.id == target.parent_id)
+            .scalar_subquery(),
+        }
+
+    if target.username is None:
+        user = User.__table__
+        values["username"] = select(user.c.username).where(user.c.id == target.user_id).scalar_subquery()
+
+    row = connection.execute(
+        table.update()
+        .where(table.c.id == target.id)
+        .values(**values)
+        .returning(*returning)
+    ).one()
+
+    if target.parent_id is not None and row.parent_deleted_at is not None:
+        raise DeletedParentError(f"Comment {target.parent_id} is deleted")
+
+    set_committed_value(target, "path", row.path)
+    set_committed_value(target, "depth", row.depth)
+    set_committed_value(target, "username", row.username)
+
+    update_ancestor_counters(connection, target.parent_id, row.path, 1, target.posted_at)
+
+
+def ancestor_ids_query(parent_id):
+    """It constructs a recursive CTE query of the ids of a comment and its ancestors
+    following parent_id, for comments outside the hierarchy index (path not filled)
+
+    Args:
+        parent_id (int): Id of the comment to start from
+
+    Returns:
+        _type_: Select statement of comment ids
+    """
+    table = Comment.__table__
+    tree = select(table.c.id, table.c.parent_id).where(table.c.id == parent_id).cte("ancestors", recursive=True)
+    parent = table.alias("parent")
+    tree = tree.union_all(select(parent.c.id, parent.c.parent_id).where(parent.c.id == tree.c.parent_id))
+
+    return select(tree.c.id)
+
+
+def later_activity(activity_at):
+    """It builds the SQL expression of the later of last_activity_at and activity_at
+
+    Args:
+        activity_at (_type_): Posting time, as datetime or bound parameter
+
+    Returns:
+        _type_: SQL expression
+    """
+    column = Comment.__table__.c.last_activity_at
+
+    return case((or_(column.is_(None), column < activity_at), activity_at), else_=column)
+
+
+def update_ancestor_counters(connection, parent_id, path, delta, activity_at=None):
+    """It applies the insert or delete of a subtree to the counters of its ancestors with
+    a single UPDATE by primary key: the parent gains or loses one reply, every ancestor
+    gains or loses delta descendants and, on insert, moves its last activity forward.
+    Deletes don't move last_activity_at back, `flask comments recount` recomputes it
+
+    Args:
+        connection (_type_): Connection of the transaction
+        parent_id (int): Id of the parent of the subtree, None for a root comment
+        path (str): Materialized path of the subtree root, None if not filled
+        delta (int): Number of inserted (positive) or deleted (negative) comments
+        activity_at (datetime, optional): Latest posting time of the inserted comments.
+            Defaults to None.
+    """
+    if parent_id is None:
+        return
+
+    table = Comment.__table__
+
+    if path is None:
+        condition = table.c.id.in_(ancestor_ids_query(parent_id))
+    else:
+        condition = table.c.id.in_([int(segment) for segment in path.split(PATH_SEPARATOR)[:-1]])
+
+    # counters aren't edits, keep updated_at from its onupdate
+    values = {
+        "reply_count": table.c.reply_count + case((table.c.id == parent_id, 1 if delta > 0 else -1), else_=0),
+        "descendant_count": table.c.descendant_count + delta,
+        "updated_at": table.c.updated_at,
+    }
+
+    if activity_at is not None:
+        values["last_activity_at"] = later_activity(activity_at)
+
+    connection.execute(table.update().where(condition).values(**values))
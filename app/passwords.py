@@ -0,0 +1,151 @@
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
+from flask import current_app
+from flask_bcrypt import Bcrypt
+from werkzeug.security import check_password_hash, generate_password_hash
+
+BCRYPT = "bcrypt"
+# bcrypt hashes start with $2a$, $2b$ or $2y$ followed by the cost, e.g. $2b$12$...
+BCRYPT_PREFIX = "$2"
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many passwords are waiting to be hashed"""
+
+
+class HasherState:
+    """It holds the hashing parameters and the thread pool of the password hasher of one app"""
+
+    def __init__(self, method, bcrypt, bcrypt_rounds, workers, max_pending):
+        self.method = method
+        self.bcrypt = bcrypt
+        self.bcrypt_rounds = bcrypt_rounds
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        # the threads of every app's pool end with the app, or at exit at the latest
+        weakref.finalize(self, self.executor.shutdown, wait=False)
+        # running plus queued hashes, so a burst is refused instead of piling up
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+
+    @cached_property
+    def method_prefix(self):
+        # the prefix werkzeug writes for the configured method with its default
+        # parameters filled in, e.g. "scrypt" is stored as "scrypt:32768:8:1"
+        return generate_password_hash("", self.method).split("$", 1)[0]
+
+    def hash(self, password):
+        if self.method == BCRYPT:
+            return self.bcrypt.generate_password_hash(password).decode()
+
+        return generate_password_hash(password, self.method)
+
+    def verify(self, password_hash, password):
+        if password_hash.startswith(BCRYPT_PREFIX):
+            return self.bcrypt.check_password_hash(password_hash, password)
+
+        return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        if self.method != BCRYPT:
+            return password_hash.split("$", 1)[0] != self.method_prefix
+
+        if not password_hash.startswith(BCRYPT_PREFIX):
+            return True
+
+        return int(password_hash.split("$")[2]) != self.bcrypt_rounds
+
+
+class PasswordHasher:
+    """It hashes and verifies passwords with the algorithm and cost set in the config, on a
+    bounded thread pool: at most PASSWORD_HASH_WORKERS hashes run at once, so a signup or
+    login burst can't take the CPU from the other requests, and at most
+    PASSWORD_HASH_MAX_PENDING more wait for a worker before new ones are refused
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """It reads the hashing parameters: PASSWORD_HASH_METHOD is "bcrypt", whose cost is
+        BCRYPT_LOG_ROUNDS, or a werkzeug method such as "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+
+        Args:
+            app (_type_): Flask app
+        """
+        workers = app.config.get("PASSWORD_HASH_WORKERS") or 1
+
+        app.extensions["password_hasher"] = HasherState(
+            app.config.get("PASSWORD_HASH_METHOD", "scrypt"),
+            Bcrypt(app),
+            app.config.get("BCRYPT_LOG_ROUNDS", 12),
+            workers,
+            app.config.get("PASSWORD_HASH_MAX_PENDING", 32),
+        )
+
+    @property
+    def state(self):
+        return current_app.extensions["password_hasher"]
+
+    def run(self, function, *args):
+        """It runs a hashing function on the thread pool and waits for its result
+
+        Args:
+            function (_type_): Bound method of the hasher state
+            *args: Arguments of the function
+
+        Raises:
+            PasswordHasherBusy: The pool and its queue are full
+
+        Returns:
+            _type_: Result of the function
+        """
+        state = self.state
+
+        if not state.slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many passwords are being hashed")
+
+        try:
+            return state.executor.submit(function, *args).result()
+        finally:
+            state.slots.release()
+
+    def hash(self, password):
+        """It hashes a password with the configured algorithm and cost
+
+        Args:
+            password (str): Plain text password
+
+        Returns:
+            _type_: Password hash as string
+        """
+        return self.run(self.state.hash, password)
+
+    def verify(self, password_hash, password):
+        """It checks a password against a hash made by any of the supported algorithms
+
+        Args:
+            password_hash (str): Stored password hash
+            password (str): Plain text password
+
+        Returns:
+            _type_: True if the password matches
+        """
+        return self.run(self.state.verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """It tells whether a hash was made with another algorithm or cost than the configured
+        ones, so it is replaced on the next successful login
+
+        Args:
+            password_hash (str): Stored password hash
+
+        Returns:
+            _type_: True if the hash is outdated
+        """
+        return self.state.needs_rehash(password_hash)
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,254 @@
+import os
+import re
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# frames of this project, minus any virtualenv inside it, make up the logged stacks
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Literals and bind parameters of any dialect, and the expanded parameter lists of IN
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+BIND_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|:\w+")
+PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+# statement log of the request or block being run, None when nothing is logged
+current_statements = ContextVar("statement_log", default=None)
+
+
+def normalize_statement(statement):
+    """It reduces a SQL statement to its shape, so the executions of one query with
+    different values are grouped together, e.g. "... WHERE id IN (?, ?)" and
+    "... WHERE id = 7" become "... WHERE id IN (?)" and "... WHERE id = ?"
+
+    Args:
+        statement (str): SQL statement as sent to the database
+
+    Returns:
+        _type_: Normalized statement
+    """
+    statement = STRING_LITERAL.sub("?", statement)
+    statement = BIND_PARAMETER.sub("?", statement)
+    statement = NUMBER_LITERAL.sub("?", statement)
+    statement = PARAMETER_LIST.sub("(?)", statement)
+
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+def project_stack():
+    """It formats the frames of the current stack that belong to this project, leaving out
+    the library frames between the calling code and the database driver
+
+    Returns:
+        _type_: Formatted stack, innermost call last
+    """
+    frames = [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(PROJECT_ROOT) and "site-packages" not in frame.filename
+        and frame.filename != __file__
+    ]
+
+    return "".join(traceback.format_list(frames))
+
+
+class StatementLog:
+    """It counts the statements executed in one request or block, grouped by normalized
+    statement. With a logger it warns, with the stack of the offending call, once a
+    statement runs more than repeat_threshold times (a likely N+1 query) and whenever one
+    takes longer than slow_seconds. A nested log also counts into its parent
+
+    Args:
+        label (str, optional): Request description used in the warnings
+        logger (_type_, optional): Logger of the warnings. Defaults to None, no warnings.
+        repeat_threshold (int, optional): Executions of one statement allowed before warning
+        slow_seconds (float, optional): Duration of a slow statement
+        parent (StatementLog, optional): Enclosing log
+    """
+
+    def __init__(self, label=None, logger=None, repeat_threshold=None, slow_seconds=None, parent=None):
+        self.label = label
+        self.logger = logger
+        self.repeat_threshold = repeat_threshold
+        self.slow_seconds = slow_seconds
+        self.parent = parent
+        self.count = 0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        normalized = normalize_statement(statement)
+        log = self
+
+        while log is not None:
+            log.count += 1
+            log.statements[normalized] += 1
+            log.check(normalized, statement, duration)
+            log = log.parent
+
+    def check(self, normalized, statement, duration):
+        if self.logger is None:
+            return
+
+        if self.repeat_threshold is not None and self.statements[normalized] == self.repeat_threshold + 1:
+            self.logger.warning(
+                "Possible N+1 query in %s, statement run more than %d times: %s\n%s",
+                self.label, self.repeat_threshold, normalized, project_stack(),
+            )
+
+        if self.slow_seconds is not None and duration >= self.slow_seconds:
+            self.logger.warning(
+                "Slow query in %s, %.1f ms: %s\n%s", self.label, duration * 1000, statement, project_stack(),
+            )
+
+    def repeated(self, max_repeats):
+        """It lists the statements run more than max_repeats times
+
+        Args:
+            max_repeats (int): Allowed executions of one statement
+
+        Returns:
+            _type_: List of (normalized statement, count)
+        """
+        return [(statement, count) for statement, count in self.statements.most_common() if count > max_repeats]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_statements.get() is not None:
+        context.statement_log_started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = current_statements.get()
+    started = getattr(context, "statement_log_started", None)
+
+    if log is not None and started is not None:
+        log.record(statement, perf_counter() - started)
+
+
+def install():
+    """It starts logging the statements of every engine, sync or async, for the requests or
+    blocks that open a statement log. Until then no listener runs at all
+    """
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+@contextmanager
+def statement_log(**kwargs):
+    """It logs the statements executed in a block, see StatementLog
+
+    Yields:
+        _type_: StatementLog
+    """
+    install()
+    log = StatementLog(parent=current_statements.get(), **kwargs)
+    current_statements.set(log)
+
+    try:
+        yield log
+    finally:
+        current_statements.set(log.parent)
+
+
+@contextmanager
+def assert_max_queries(max_queries, max_repeats=None):
+    """It fails a test when a block runs more than max_queries statements, or any statement
+    more than max_repeats times, e.g. a query per comment where one query per page is due
+
+        with assert_max_queries(3, max_repeats=1):
+            client.get("/comments/list?limit=20")
+
+    Args:
+        max_queries (int): Allowed statements
+        max_repeats (int, optional): Allowed executions of one normalized statement
+
+    Raises:
+        AssertionError: The block ran more statements than allowed
+
+    Yields:
+        _type_: StatementLog of the block
+    """
+    with statement_log() as log:
+        yield log
+
+    problems = []
+
+    if log.count > max_queries:
+        problems.append(f"{log.count} queries executed, {max_queries} allowed")
+
+    if max_repeats is not None:
+        for statement, count in log.repeated(max_repeats):
+            problems.append(f"{count} executions of a statement, {max_repeats} allowed: {statement}")
+
+    if problems:
+        executed = "\n".join(f"{count} x {statement}" for statement, count in log.statements.most_common())
+        raise AssertionError("\n".join(problems) + "\nExecuted:\n" + executed)
+
+
+class QueryLog:
+    """It watches the statements of every request when QUERY_LOG_ENABLED is set and logs a
+    warning with a stack when one request runs the same statement more than
+    QUERY_LOG_REPEAT_THRESHOLD times, or a statement takes longer than
+    QUERY_LOG_SLOW_SECONDS. Off by default, when nothing is registered
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get("QUERY_LOG_ENABLED", False):
+            app.extensions["query_log"] = None
+            return
+
+        app.extensions["query_log"] = {
+            "logger": app.logger,
+            "repeat_threshold": app.config.get("QUERY_LOG_REPEAT_THRESHOLD", 10),
+            "slow_seconds": app.config.get("QUERY_LOG_SLOW_SECONDS", 0.5),
+        }
+        install()
+
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    @property
+    def state(self):
+        return current_app.extensions["query_log"]
+
+    def start(self, label, state):
+        """It opens the statement log of a request
+
+        Args:
+            label (str): Request description, e.g. "GET /comments/list"
+            state (dict): Settings of the app, see init_app
+
+        Returns:
+            _type_: StatementLog
+        """
+        log = StatementLog(label, parent=current_statements.get(), **state)
+        current_statements.set(log)
+
+        return log
+
+    def finish(self, log):
+        current_statements.set(log.parent)
+
+    def before_request(self):
+        request.environ["query_log"] = self.start(f"{request.method} {request.path}", self.state)
+
+    def teardown_request(self, exc=None):
+        log = request.environ.pop("query_log", None)
+
+        if log is not None:
+            self.finish(log)
+
+
+query_log = QueryLog()
@@ -1,11 +1,21 @@
-from app.marshmallow import SQLAlchemyAutoSchema, validates, ValidationError, fields
+from app.marshmallow import (
+    SQLAlchemyAutoSchema, Schema, validates, validates_schema, validate, ValidationError, fields, EXCLUDE
+)
 from app.models.comments import Comment
+from app.utils.comment_utils import decode_cursor, DEFAULT_SORT, SORT_MODES
+from app.utils.deletion import DELETE_MODES
+
+# Fields CommentSchema(many=True) keeps from the tree nodes of /comments/list, besides
+# the nested replies. The list endpoint writes exactly these fields without marshmallow
+COMMENT_LIST_FIELDS = ("id", "text", "user_id")
 
 
 class CommentSchema(SQLAlchemyAutoSchema):
     class Meta:
         model = Comment
         include_fk = True
+        # snapshot taken on insert, not part of the comment payload
+        exclude = ("username",)
     
     replies = fields.Nested('self', many=True)
 
@@ -21,3 +31,63 @@ class CommentSchema(SQLAlchemyAutoSchema):
         """
         if not 3 <= len(value) <= 200:
             raise ValidationError("Comment text must be between 3 to 200 characters.")
+
+
+class CommentTreeArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    cursor = fields.String()
+    limit = fields.Integer(validate=validate.Range(min=1))
+    max_depth = fields.Integer(validate=validate.Range(min=0))
+    max_children = fields.Integer(validate=validate.Range(min=1))
+    sort = fields.String(validate=validate.OneOf(SORT_MODES))
+
+    @validates_schema
+    def validate_cursor(self, data, **kwargs):
+        """It validates that the cursor was issued by a previous page of the same sort mode
+
+        Args:
+            data (_type_): Deserialized query parameters
+
+        Raises:
+            ValidationError: Cursor can't be decoded
+        """
+        if "cursor" not in data:
+            return
+
+        try:
+            decode_cursor(data["cursor"], data.get("sort", DEFAULT_SORT))
+        except ValueError:
+            raise ValidationError("Invalid cursor.", "cursor")
+
+
+class CommentAncestorsArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    max_depth = fields.Integer(validate=validate.Range(min=0))
+
+
+class CommentChangesArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    since = fields.Integer(validate=validate.Range(min=0))
+    limit = fields.Integer(validate=validate.Range(min=1))
+    wait = fields.Float(validate=validate.Range(min=0))
+
+
+class CommentEventsArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    since = fields.Integer(validate=validate.Range(min=0))
+    timeout = fields.Float(validate=validate.Range(min=0))
+
+
+class CommentDeleteArgsSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    mode = fields.String(validate=validate.OneOf(DELETE_MODES))
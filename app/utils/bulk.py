@@ -0,0 +1,295 @@
+from itertools import islice
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import db
+from app.events import comment_events
+from app.marshmallow import ValidationError
+from app.models.comments import (
+    Comment, PATH_SEPARATOR, format_path_segment, later_activity, path_root_id, path_root_id_expression,
+    update_ancestor_counters
+)
+from app.models.comment_changes import CommentChange, CREATED, count_thread_changes
+from app.schemas.comment_schema import CommentSchema
+
+# Client side keys linking the comments of one bulk request, removed before validation
+TEMP_KEYS = ("temp_id", "parent_temp_id")
+
+bulk_comment_schema = CommentSchema(many=True)
+
+
+def chunked(items, size):
+    """It splits an iterable into lists of at most size items without reading ahead
+
+    Args:
+        items (_type_): Iterable of items
+        size (int): Maximum number of items per chunk
+
+    Yields:
+        _type_: Chunk of items as list
+    """
+    iterator = iter(items)
+
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def create_comments_bulk(items, user_id, username, chunk_size=1000):
+    """It creates many comments of one user in chunked transactions. A comment may set a
+    temp_id and be referenced by a later comment of the request with parent_temp_id, even
+    across chunks. Invalid comments are reported and skipped, as are the replies of a
+    comment that wasn't created
+
+    Args:
+        items (_type_): Iterable of comment dictionaries, e.g. a streamed NDJSON body
+        user_id (int): Id of the current user, who must own every comment
+        username (str): Username of the current user, snapshot on every comment
+        chunk_size (int, optional): Number of comments per transaction. Defaults to 1000.
+
+    Returns:
+        _type_: Number of created comments, their ids in input order (None for the failed
+            ones) and the errors of the failed comments
+    """
+    # temp_id -> created comment as (id, path, depth), or None if it failed
+    temp_ids = {}
+    ids = []
+    errors = []
+
+    for chunk in chunked(items, chunk_size):
+        records = create_comments_chunk(chunk, user_id, username, temp_ids)
+
+        for index, record in enumerate(records, start=len(ids)):
+            if record["errors"]:
+                error = {"index": index, "errors": record["errors"]}
+                if record["temp_id"] is not None:
+                    error["temp_id"] = record["temp_id"]
+                errors.append(error)
+
+        ids.extend(record.get("id") for record in records)
+
+    return {"created": len(ids) - len(errors), "ids": ids, "errors": errors}
+
+
+def split_temp_keys(item):
+    if not isinstance(item, dict):
+        return item, None, None
+
+    payload = {key: value for key, value in item.items() if key not in TEMP_KEYS}
+
+    return payload, item.get("temp_id"), item.get("parent_temp_id")
+
+
+def create_comments_chunk(items, user_id, username, temp_ids):
+    """It validates one chunk of comments with a single schema load and a single parent
+    lookup, then inserts them in one transaction with one INSERT per reply level of the
+    chunk, one UPDATE filling the hierarchy paths and one INSERT into the change log
+
+    Args:
+        items (list): Comment dictionaries of the chunk
+        user_id (int): Id of the current user
+        username (str): Username of the current user
+        temp_ids (dict): temp_id -> created comment of the previous chunks, updated in place
+
+    Returns:
+        _type_: One record per item with its errors, or the id of the created comment
+    """
+    payloads, records = [], []
+    for item in items:
+        payload, temp_id, parent_temp_id = split_temp_keys(item)
+        payloads.append(payload)
+        records.append({"temp_id": temp_id, "parent_temp_id": parent_temp_id, "errors": {}})
+
+    try:
+        loaded, messages = bulk_comment_schema.load(payloads), {}
+    except ValidationError as err:
+        loaded, messages = err.valid_data, err.messages
+
+    parent_ids = {data.get("parent_id") for data in loaded if isinstance(data, dict)} - {None}
+    rows = db.session.execute(
+        select(Comment.id, Comment.path, Comment.depth, Comment.deleted_at).where(Comment.id.in_(parent_ids))
+    ).all() if parent_ids else []
+    parents = {row.id: (row.id, row.path, row.depth) for row in rows if row.deleted_at is None}
+    deleted_parents = {row.id for row in rows if row.deleted_at is not None}
+
+    pending = []
+    for position, record in enumerate(records):
+        data = loaded[position]
+        record["errors"] = errors = dict(messages.get(position, {}))
+        temp_id, parent_temp_id = record["temp_id"], record["parent_temp_id"]
+
+        if not errors:
+            if data["user_id"] != user_id:
+                errors["user_id"] = ["User id doesn't belongs to current user"]
+
+            parent_id = data.get("parent_id")
+            if parent_id and parent_temp_id is not None:
+                errors["parent_temp_id"] = ["Can't be combined with parent_id."]
+            elif parent_id in deleted_parents:
+                errors["parent_id"] = ["Can't reply to a deleted comment"]
+            elif parent_id:
+                record["parent"] = parents.get(parent_id)
+                if record["parent"] is None:
+                    errors["parent_id"] = ["Parent comment doesn't exist"]
+            elif parent_temp_id is not None:
+                if not isinstance(parent_temp_id, (str, int)) or parent_temp_id not in temp_ids:
+                    errors["parent_temp_id"] = ["Doesn't match the temp_id of an earlier comment."]
+                elif temp_ids[parent_temp_id] is None:
+                    errors["parent_temp_id"] = ["Parent comment wasn't created."]
+                else:
+                    record["parent"] = temp_ids[parent_temp_id]
+            else:
+                record["parent"] = None
+
+        if temp_id is not None:
+            if not isinstance(temp_id, (str, int)) or temp_id in temp_ids:
+                errors["temp_id"] = ["Must be a string or integer unique within the request."]
+            else:
+                # replies in the same chunk point to the record until it gets an id
+                temp_ids[temp_id] = None if errors else record
+
+        if not errors:
+            record["data"] = data
+            pending.append(record)
+
+    if pending:
+        try:
+            insert_records(pending, username)
+            db.session.commit()
+        except IntegrityError:
+            # e.g. a parent deleted since the lookup
+            db.session.rollback()
+            for record in pending:
+                record["errors"] = {"_schema": ["Comment couldn't be saved."]}
+                record.pop("id", None)
+        else:
+            # the core statements bypass the session events
+            comment_events.publish()
+
+    for record in records:
+        temp_id = record["temp_id"]
+        if isinstance(temp_id, (str, int)) and temp_ids.get(temp_id) is record:
+            temp_ids[temp_id] = None if record["errors"] else (record["id"], record["path"], record["depth"])
+
+    return records
+
+
+def parent_of(record):
+    """It returns the parent of a pending record as (id, path, depth), or None for a root
+    comment. A parent created earlier in the same chunk is read from its record"""
+    parent = record["parent"]
+
+    if isinstance(parent, dict):
+        return parent["id"], parent["path"], parent["depth"]
+
+    return parent
+
+
+def insert_records(records, username):
+    """It inserts validated records level by level, so every reply is inserted after its
+    parent got an id, then fills their hierarchy paths, counts them in the counters of
+    their ancestors and logs their creation
+
+    Args:
+        records (list): Pending records in input order
+        username (str): Username of the author, snapshot on every comment
+    """
+    levels = []
+    for record in records:
+        parent = record["parent"]
+        record["level"] = parent["level"] + 1 if isinstance(parent, dict) else 0
+        if record["level"] == len(levels):
+            levels.append([])
+        levels[record["level"]].append(record)
+
+    for level in levels:
+        rows = []
+        for record in level:
+            parent = parent_of(record)
+            rows.append({
+                "text": record["data"]["text"],
+                "user_id": record["data"]["user_id"],
+                "username": username,
+                "parent_id": parent[0] if parent else None,
+            })
+
+        new_rows = db.session.execute(
+            insert(Comment).returning(Comment.id, Comment.posted_at, sort_by_parameter_order=True), rows
+        ).all()
+
+        for record, (comment_id, posted_at) in zip(level, new_rows):
+            parent = parent_of(record)
+            record["id"] = comment_id
+            record["posted_at"] = posted_at
+            record["parent_id"] = parent[0] if parent else None
+
+            if parent is None:
+                record["path"], record["depth"] = format_path_segment(comment_id), 0
+            elif parent[1] is None:
+                # parent outside the hierarchy index, left to rebuild_hierarchy
+                record["path"], record["depth"] = None, None
+            else:
+                record["path"] = parent[1] + PATH_SEPARATOR + format_path_segment(comment_id)
+                record["depth"] = parent[2] + 1
+
+    db.session.execute(update(Comment), [
+        {"id": record["id"], "path": record["path"], "depth": record["depth"]}
+        for record in records
+    ])
+    update_counters(records)
+    db.session.execute(insert(CommentChange), [
+        {
+            "comment_id": record["id"],
+            "parent_id": record["parent_id"],
+            "root_id": path_root_id(record["path"]),
+            "op": CREATED,
+        }
+        for record in sorted(records, key=lambda record: record["id"])
+    ])
+    count_thread_changes(
+        db.session.connection(),
+        path_root_id_expression(Comment.path),
+        Comment.id.in_([record["id"] for record in records]),
+    )
+
+
+def update_counters(records):
+    """It sums the replies, descendants and latest activity the records add to each of
+    their ancestors, records of the same chunk included, and applies them with one
+    executemany UPDATE
+
+    Args:
+        records (list): Inserted records with their paths
+    """
+    counters = {}
+    for record in records:
+        if record["parent_id"] is None:
+            continue
+
+        if record["path"] is None:
+            # parent outside the hierarchy index, its ancestors are found by parent_id
+            update_ancestor_counters(db.session.connection(), record["parent_id"], None, 1, record["posted_at"])
+            continue
+
+        for ancestor_id in map(int, record["path"].split(PATH_SEPARATOR)[:-1]):
+            counter = counters.setdefault(
+                ancestor_id, {"ancestor_id": ancestor_id, "replies": 0, "descendants": 0, "activity_at": None}
+            )
+            counter["replies"] += ancestor_id == record["parent_id"]
+            counter["descendants"] += 1
+            if counter["activity_at"] is None or counter["activity_at"] < record["posted_at"]:
+                counter["activity_at"] = record["posted_at"]
+
+    if counters:
+        table = Comment.__table__
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam("ancestor_id"))
+            .values(
+                reply_count=table.c.reply_count + bindparam("replies"),
+                descendant_count=table.c.descendant_count + bindparam("descendants"),
+                last_activity_at=later_activity(bindparam("activity_at", type_=table.c.last_activity_at.type)),
+                updated_at=table.c.updated_at,
+            ),
+            list(counters.values()),
+        )
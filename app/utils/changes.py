@@ -0,0 +1,294 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, select
+
+from app.database import db
+from app.models.comments import Comment, DELETED_PLACEHOLDER
+from app.models.comment_changes import CommentChange, CommentThread, DELETED, UNATTRIBUTED_ROOT_ID
+
+# Latest changes read to tell how far the change log has settled, see comments_state
+RECENT_CHANGES_WINDOW = 100
+
+
+def as_utc(value):
+    """It marks naive datetimes read back from the database as UTC
+
+    Args:
+        value (datetime): Datetime or None
+
+    Returns:
+        _type_: Timezone aware datetime or None
+    """
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+
+    return value
+
+
+def latest_change_query():
+    """It constructs the query of the seq and time of the latest comment change
+
+    Returns:
+        _type_: Select statement of at most one row
+    """
+    return select(CommentChange.seq, CommentChange.changed_at).order_by(CommentChange.seq.desc()).limit(1)
+
+
+def latest_change_state(row):
+    """It reads the seq and time of the latest change from a row of latest_change_query
+
+    Args:
+        row (_type_): Row or None without changes
+
+    Returns:
+        _type_: Tuple of seq (0 without changes) and changed_at (None without changes)
+    """
+    if row is None:
+        return 0, None
+
+    return row.seq, as_utc(row.changed_at)
+
+
+def latest_change(session=None):
+    """It returns the seq and time of the latest comment change, which together
+    identify the current state of the comment table
+
+    Args:
+        session (_type_, optional): Session running the query. Defaults to None for db.session.
+
+    Returns:
+        _type_: Tuple of seq (0 without changes) and changed_at (None without changes)
+    """
+    return latest_change_state((session or db.session).execute(latest_change_query()).first())
+
+
+def recent_changes_query(limit=RECENT_CHANGES_WINDOW):
+    """It constructs the query of the seq and time of the latest comment changes
+
+    Args:
+        limit (int, optional): Number of changes. Defaults to RECENT_CHANGES_WINDOW.
+
+    Returns:
+        _type_: Select statement of changes ordered by seq, latest first
+    """
+    return select(CommentChange.seq, CommentChange.changed_at).order_by(CommentChange.seq.desc()).limit(limit)
+
+
+def comments_state(rows, settle_seconds):
+    """It derives the state of the comment table from the latest changes: the seq of the
+    latest change and the settled seq, before which no change is still in flight (see
+    settled_rows). The latest seq alone misses a transaction holding a lower seq that
+    commits after a higher one, but that commit fills a hole and moves the settled seq.
+    Last-Modified is left out while a hole is open, as the late commit won't move it either
+
+    Args:
+        rows (list): Rows of recent_changes_query
+        settle_seconds (int): Age after which a hole in the seqs is skipped
+
+    Returns:
+        _type_: Tuple of the (settled seq, latest seq) state and the time of the latest change
+    """
+    if not rows:
+        return (0, 0), None
+
+    # the window is assumed settled below its oldest change
+    rows = rows[::-1]
+    settled = settled_rows(rows[1:], rows[0].seq, settle_seconds)
+    settled_seq = settled[-1].seq if settled else rows[0].seq
+    latest = rows[-1]
+
+    return (settled_seq, latest.seq), as_utc(latest.changed_at) if settled_seq == latest.seq else None
+
+
+def get_comments_state(settle_seconds=5, session=None):
+    """It returns the state of the comment table, see comments_state
+
+    Args:
+        settle_seconds (int, optional): Age after which a hole in the seqs is skipped. Defaults to 5.
+        session (_type_, optional): Session running the query. Defaults to None for db.session.
+
+    Returns:
+        _type_: Tuple of the (settled seq, latest seq) state and the time of the latest change
+    """
+    return comments_state((session or db.session).execute(recent_changes_query()).all(), settle_seconds)
+
+
+def thread_changes_query(root_ids=None):
+    """It constructs the query of the change count of comment threads, one CommentThread
+    row per thread. Changes outside any known thread are counted under UNATTRIBUTED_ROOT_ID
+
+    Args:
+        root_ids (list, optional): Root comment ids of the threads. Defaults to None for all,
+            else the changes outside any known thread are read with them.
+
+    Returns:
+        _type_: Select statement of root_id and changes rows
+    """
+    query = select(CommentThread.root_id, CommentThread.changes)
+
+    if root_ids is not None:
+        query = query.where(CommentThread.root_id.in_([*root_ids, UNATTRIBUTED_ROOT_ID]))
+
+    return query
+
+
+def threads_state(root_ids, rows):
+    """It pairs every root comment id with the state of its thread: the count of its
+    changes, then that of the changes outside any known thread, which may belong to any
+    of them. The count moves with every committed change, also when a transaction
+    holding a lower seq commits after a higher one
+
+    Args:
+        root_ids (list): Root comment ids in list order
+        rows (list): Rows of thread_changes_query
+
+    Returns:
+        _type_: Pairs of root comment id and state tuple as list
+    """
+    changes = {row.root_id: row.changes for row in rows}
+    unattributed = changes.get(UNATTRIBUTED_ROOT_ID, 0)
+
+    return [(root_id, (changes.get(root_id, 0), unattributed)) for root_id in root_ids]
+
+
+def comment_changes_query(since, limit):
+    """It constructs the query of the changes after a seq, joined with the current
+    state of their comments (null once a comment is deleted). A deletion is never joined,
+    nor a row posted after the change, so a comment reusing the id of a deleted one (e.g.
+    an imported id) doesn't lend its content to the older changes
+
+    Args:
+        since (int): Seq of the last change the client has seen
+        limit (int): Maximum number of changes
+
+    Returns:
+        _type_: Select statement of changes ordered by seq
+    """
+    return (
+        select(
+            CommentChange.seq,
+            CommentChange.op,
+            CommentChange.comment_id,
+            CommentChange.parent_id,
+            CommentChange.changed_at,
+            Comment.id.label("current_id"),
+            Comment.parent_id.label("current_parent_id"),
+            Comment.user_id,
+            Comment.username,
+            Comment.text,
+            Comment.posted_at,
+            Comment.deleted_at,
+        )
+        .outerjoin(Comment, and_(
+            Comment.id == CommentChange.comment_id,
+            CommentChange.op != DELETED,
+            Comment.posted_at <= CommentChange.changed_at,
+        ))
+        .where(CommentChange.seq > since)
+        .order_by(CommentChange.seq)
+        .limit(limit)
+    )
+
+
+def serialize_change(row):
+    """It constructs json object for a change with the current state of its comment,
+    shown as a placeholder once soft deleted
+
+    Args:
+        row (_type_): Row of the changes query
+
+    Returns:
+        _type_: Change as dict
+    """
+    comment = None
+
+    if row.current_id is not None:
+        comment = {
+            "id": row.current_id,
+            "parent_id": row.current_parent_id,
+            "user_id": row.user_id,
+            "username": row.username,
+            "text": row.text,
+            "created_at": row.posted_at.isoformat(),
+        }
+
+        if row.deleted_at is not None:
+            comment.update(DELETED_PLACEHOLDER)
+
+    return {
+        "seq": row.seq,
+        "op": row.op,
+        "comment_id": row.comment_id,
+        "parent_id": row.parent_id,
+        "changed_at": as_utc(row.changed_at).isoformat(),
+        "comment": comment,
+    }
+
+
+def settled_rows(rows, since, settle_seconds):
+    """It keeps the leading rows of a changes query that no change still in flight can
+    precede. Seqs are handed out at insert time but transactions may commit out of order,
+    so a hole in the seqs may still be filled: the rows stop before any hole younger than
+    settle_seconds. Older holes come from rolled back transactions and are skipped
+
+    Args:
+        rows (list): Rows of the changes query, ordered by seq
+        since (int): Seq the rows follow
+        settle_seconds (int): Age after which a hole in the seqs is skipped
+
+    Returns:
+        _type_: Settled rows as list
+    """
+    settled_before = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+
+    settled = []
+    cursor = since
+    for row in rows:
+        if row.seq != cursor + 1 and as_utc(row.changed_at) > settled_before:
+            break
+
+        settled.append(row)
+        cursor = row.seq
+
+    return settled
+
+
+def get_comment_changes(since=0, limit=100, settle_seconds=5, session=None):
+    """It returns the comment changes committed after a seq, stopping before any hole
+    in the seqs that may still be filled (see settled_rows), so the next poll resumes
+    from there
+
+    Args:
+        since (int, optional): Seq of the last change the client has seen. Defaults to 0.
+        limit (int, optional): Maximum number of changes. Defaults to 100.
+        settle_seconds (int, optional): Age after which a hole in the seqs is skipped. Defaults to 5.
+        session (_type_, optional): Session running the query. Defaults to None for db.session.
+
+    Returns:
+        _type_: Changes as list, the seq to poll from next and whether more changes are ready
+    """
+    rows = (session or db.session).execute(comment_changes_query(since, limit + 1)).all()
+
+    return changes_page(rows, since, limit, settle_seconds)
+
+
+def changes_page(rows, since, limit, settle_seconds):
+    """It builds the response of get_comment_changes from the rows of a changes query
+    fetched with limit + 1
+
+    Args:
+        rows (list): Rows of the changes query
+        since (int): Seq the rows follow
+        limit (int): Maximum number of changes
+        settle_seconds (int): Age after which a hole in the seqs is skipped
+
+    Returns:
+        _type_: Changes as list, the seq to poll from next and whether more changes are ready
+    """
+    changes = [serialize_change(row) for row in settled_rows(rows[:limit], since, settle_seconds)]
+
+    return {
+        "changes": changes,
+        "next_since": changes[-1]["seq"] if changes else since,
+        "has_more": len(changes) == limit and len(rows) > limit,
+    }
@@ -1,44 +1,649 @@
-from sqlalchemy.orm import selectinload
-from app.models.comments import Comment
+import base64
+import hashlib
+import json
+from datetime import datetime
+from operator import attrgetter
 
+from sqlalchemy import select, literal_column, func, union_all
+from sqlalchemy.orm import aliased
+
+from app.database import db
+from app.metrics import timed
+from app.models.comments import Comment, DELETED_PLACEHOLDER, path_root_id
+from app.utils.changes import thread_changes_query, threads_state
+from app.utils.hierarchy import subtree_condition
+from app.utils.serializers import dumps
+
+
+# Sort modes of the paginated endpoints: name -> (sort column, descending). Every mode
+# orders siblings by (column, id), served by the (parent_id, column, id) index of Comment
+SORT_MODES = {
+    "oldest": ("posted_at", False),
+    "newest": ("posted_at", True),
+    "replies": ("reply_count", True),
+    "activity": ("last_activity_at", True),
+}
+DEFAULT_SORT = "oldest"
+
+
+def sort_order(sort=DEFAULT_SORT, source=Comment):
+    """It builds the ORDER BY clauses of a sort mode, with the id as tie breaker in the
+    same direction so the index is scanned in one direction
+
+    Args:
+        sort (str, optional): Sort mode. Defaults to DEFAULT_SORT.
+        source (_type_, optional): Comment or the columns of a subquery. Defaults to Comment.
+
+    Returns:
+        _type_: Order by clauses as list
+    """
+    name, descending = SORT_MODES[sort]
+    column, comment_id = getattr(source, name), source.id
+
+    if descending:
+        return [column.desc(), comment_id.desc()]
+
+    return [column, comment_id]
+
+
+def encode_cursor(sort_value, comment_id):
+    """It encodes the (sort column, id) keyset position of a comment into an opaque cursor
+
+    Args:
+        sort_value (_type_): Sort column value of the last comment of a page, e.g. posted_at
+        comment_id (int): Id of the last comment of a page
+
+    Returns:
+        _type_: Url safe cursor string
+    """
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+
+    raw = json.dumps([sort_value, comment_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort=DEFAULT_SORT):
+    """It decodes a cursor created by encode_cursor back into its keyset position
+
+    Args:
+        cursor (str): Cursor string
+        sort (str, optional): Sort mode the cursor was issued for. Defaults to DEFAULT_SORT.
+
+    Raises:
+        ValueError: Cursor is malformed
+
+    Returns:
+        _type_: Tuple of sort column value and comment id
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, comment_id = json.loads(raw)
+
+        if SORT_MODES[sort][0] == "reply_count":
+            if not isinstance(sort_value, int):
+                raise TypeError("Reply count cursor must hold an integer")
+            return sort_value, int(comment_id)
+
+        return datetime.fromisoformat(sort_value), int(comment_id)
+    except (TypeError, ValueError) as err:
+        raise ValueError("Invalid cursor") from err
+
+
+def comment_page_query(parent_id=None, cursor=None, limit=None, sort=DEFAULT_SORT):
+    """It constructs a keyset paginated query over the direct replies of a comment,
+    or over the root comments, ordered by the (column, id) of the sort mode
+
+    Args:
+        parent_id (int, optional): Id of the parent comment. Defaults to None for root comments.
+        cursor (str, optional): Cursor of the last comment of the previous page. Defaults to None.
+        limit (int, optional): Maximum number of comments in the page. Defaults to None.
+        sort (str, optional): Sort mode. Defaults to DEFAULT_SORT.
+
+    Returns:
+        _type_: Select statement yielding id and sort column of the page comments
+    """
+    name, descending = SORT_MODES[sort]
+    column = getattr(Comment, name)
+    query = select(Comment.id, column).where(Comment.parent_id == parent_id)
+
+    if not cursor:
+        return query.order_by(*sort_order(sort)).limit(limit)
+
+    value, last_id = decode_cursor(cursor, sort)
+    # the siblings tied with the cursor, then the ones past its value, as two index seeks:
+    # SQLite only seeks on the first column of a (column, id) row value comparison and
+    # would scan every tied sibling, e.g. all the comments without replies
+    branches = [
+        query.where(column == value, Comment.id < last_id if descending else Comment.id > last_id),
+        query.where(column < value if descending else column > value),
+    ]
+    page = union_all(
+        *(select(branch.order_by(*sort_order(sort)).limit(limit).subquery()) for branch in branches)
+    ).subquery("page")
+
+    return select(page.c.id, page.c[name]).order_by(*sort_order(sort, page.c)).limit(limit)
+
+
+def node_query_columns(counters=False):
+    """It lists the comment columns build_tree reads from the rows of a query
+
+    Args:
+        counters (bool, optional): Whether to add the reply_count, descendant_count and
+            last_activity_at counters used by paginated nodes. Defaults to False.
+
+    Returns:
+        _type_: Columns as list
+    """
+    columns = [
+        Comment.id,
+        Comment.parent_id,
+        Comment.user_id,
+        Comment.username,
+        Comment.text,
+        Comment.posted_at,
+        Comment.deleted_at,
+    ]
+
+    if counters:
+        columns += [Comment.reply_count, Comment.descendant_count, Comment.last_activity_at]
+
+    return columns
+
+
+def comment_tree_query(root_ids=None, max_depth=None, counters=False, group_by_root=False, sort=DEFAULT_SORT,
+                       max_children=None):
+    """It constructs a single WITH RECURSIVE query that walks the comment tree downwards,
+    starting either from every root comment or from the given comments. The username of
+    each comment's author is read from its snapshot on the comment row, without a join
+
+    Args:
+        root_ids (list, optional): Ids of the comments whose subtrees should be fetched.
+            Defaults to None, which fetches the subtrees of all root comments.
+        max_depth (int, optional): Number of reply levels to fetch below the starting
+            comments. Defaults to None, which fetches the whole subtrees.
+        counters (bool, optional): Whether to add the reply_count, descendant_count and
+            last_activity_at counters of each comment. Defaults to False.
+        group_by_root (bool, optional): Whether to add the id of the starting comment as
+            root_id and return the rows of each subtree consecutively, in the order of the
+            starting comments. Defaults to False.
+        sort (str, optional): Sort mode of the rows, hence of the replies of every comment.
+            Defaults to DEFAULT_SORT.
+        max_children (int, optional): Maximum number of replies fetched per comment, the
+            first ones in the sort mode. Each level then seeks at most max_children replies
+            per comment on the (parent_id, column, id) index instead of reading them all.
+            Defaults to None for all of them.
+
+    Returns:
+        _type_: Select statement yielding one flat row per comment of the tree
+    """
+    anchor = select(
+        Comment.id,
+        literal_column("0").label("depth"),
+        Comment.id.label("root_id"),
+        Comment.posted_at.label("root_posted_at"),
+    )
+
+    if root_ids is None:
+        anchor = anchor.where(Comment.parent_id.is_(None))
+    else:
+        anchor = anchor.where(Comment.id.in_(root_ids))
+
+    tree = anchor.cte("comment_tree", recursive=True)
+    reply = aliased(Comment, name="reply")
+    recursive_step = select(reply.id, tree.c.depth + 1, tree.c.root_id, tree.c.root_posted_at)
+
+    if max_children is None:
+        recursive_step = recursive_step.where(reply.parent_id == tree.c.id)
+    else:
+        # window functions aren't allowed in the recursive step, a correlated LIMIT is
+        child = aliased(Comment, name="child")
+        first_children = (
+            select(child.id)
+            .where(child.parent_id == tree.c.id)
+            .order_by(*sort_order(sort, child))
+            .limit(max_children)
+        )
+        recursive_step = recursive_step.select_from(tree).join(reply, reply.id.in_(first_children))
+
+    if max_depth is not None:
+        recursive_step = recursive_step.where(tree.c.depth < max_depth)
+
+    tree = tree.union_all(recursive_step)
+
+    columns = node_query_columns(counters)
+    order_by = sort_order(sort)
+
+    if group_by_root:
+        columns.append(tree.c.root_id)
+        order_by = [tree.c.root_posted_at, tree.c.root_id] + order_by
+
+    return (
+        select(*columns)
+        .join(tree, tree.c.id == Comment.id)
+        .order_by(*order_by)
+    )
+
+
+def comment_ancestors_query(comment_id, max_depth=None):
+    """It constructs a single WITH RECURSIVE query that walks up the parent_id chain of a
+    comment, one primary key lookup per level, so it works with or without the path
 
-def build_tree(comment):
-    """It takes the comment object and recursively calls the following function if 
-    there are replies for any comment
     Args:
-        comment (object): Comment object
+        comment_id (int): Id of the comment to start from
+        max_depth (int, optional): Number of ancestor levels to fetch above the comment.
+            Defaults to None, which fetches the chain up to the root comment.
 
     Returns:
-        _type_: Constructed json for each comment
+        _type_: Select statement yielding the comment and its ancestors with their
+            counters, from the farthest ancestor down to the comment
     """
-    return {
-        "id": comment.id,
-        "user_id": comment.user_id,
-        "username": comment.user.username,
-        "text": comment.text,
-        "created_at": comment.posted_at,
-        # recursively calls the function if there are any replies
-        "replies": [build_tree(reply) for reply in comment.replies],
-    }
+    tree = select(
+        Comment.id, Comment.parent_id, literal_column("0").label("depth")
+    ).where(Comment.id == comment_id).cte("ancestors", recursive=True)
+    parent = aliased(Comment, name="parent")
+    recursive_step = select(parent.id, parent.parent_id, tree.c.depth + 1).where(parent.id == tree.c.parent_id)
+
+    if max_depth is not None:
+        recursive_step = recursive_step.where(tree.c.depth < max_depth)
+
+    tree = tree.union_all(recursive_step)
+
+    return (
+        select(*node_query_columns(counters=True))
+        .join(tree, tree.c.id == Comment.id)
+        .order_by(tree.c.depth.desc())
+    )
+
+
+# Node keys of the tree dictionaries and the query columns they are read from
+NODE_COLUMNS = {
+    "id": "id",
+    "user_id": "user_id",
+    "username": "username",
+    "text": "text",
+    "created_at": "posted_at",
+}
 
 
-def get_comments_tree():
-    """It constructs a query to fetch the top level of comments that have
-    no parent comment and constructs json object for each comment
+@timed("tree")
+def build_tree(rows, root_ids=None, max_children=None, paginated=False, fields=None, sort=DEFAULT_SORT):
+    """It takes the flat comment rows of a tree query and links them into nested
+    dictionaries in a single pass using a parent_id -> children map, so no extra
+    query is issued and no recursion is needed whatever the depth of the tree.
+    Soft deleted comments keep their replies and show the deleted placeholder
+
+    Args:
+        rows (list): Rows returned by the comment tree query
+        root_ids (list, optional): Ids of the comments the rows were fetched for.
+            Defaults to None, which treats comments without a parent as roots.
+        max_children (int, optional): Maximum number of replies kept per comment. Defaults to None.
+        paginated (bool, optional): Whether to add the parent_id, counters, has_more and
+            next_cursor markers used by the paginated endpoints. Defaults to False.
+        fields (tuple, optional): NODE_COLUMNS keys to put in each dictionary besides replies,
+            so the output format is written directly. Defaults to None for all of them.
+        sort (str, optional): Sort mode the rows are ordered by, for the next_cursor
+            markers. Defaults to DEFAULT_SORT.
 
     Returns:
-        _type_: Comment objects as list
+        _type_: Constructed json for each root comment, with nested replies
     """
-    
-    # Fetch root comments that have no parent comment, ordered by created_at
-    root_comments = (
-        Comment.query.filter_by(parent_id=None)
-        .order_by(Comment.posted_at)
-        .options(
-            selectinload(Comment.replies),  # Preload replies
-            selectinload(Comment.user)  # Preload user 
+    fields = tuple(fields or NODE_COLUMNS)
+    columns = [NODE_COLUMNS[field] for field in fields]
+    # attrgetter reads all the columns of a row in one C call
+    values = attrgetter(*columns) if len(columns) > 1 else lambda row: (getattr(row, columns[0]),)
+    placeholder = {field: value for field, value in DELETED_PLACEHOLDER.items() if field in fields}
+
+    root_ids = set(root_ids or ())
+    nodes = {}
+    for row in rows:
+        node = dict(zip(fields, values(row)))
+        if row.deleted_at is not None:
+            node.update(placeholder)
+        node["replies"] = []
+        nodes[row.id] = node
+
+    roots = []
+    # rows are ordered by the sort mode, so every replies list keeps that order
+    for row in rows:
+        node = nodes[row.id]
+        parent = nodes.get(row.parent_id)
+
+        if row.id in root_ids or parent is None:
+            roots.append(node)
+        elif max_children is None or len(parent["replies"]) < max_children:
+            parent["replies"].append(node)
+
+    if paginated:
+        sort_values = {row.id: getattr(row, SORT_MODES[sort][0]) for row in rows}
+
+        for row in rows:
+            node = nodes[row.id]
+            replies = node["replies"]
+            has_more = row.reply_count > len(replies)
+
+            node["parent_id"] = row.parent_id
+            node["reply_count"] = row.reply_count
+            node["descendant_count"] = row.descendant_count
+            node["last_activity_at"] = row.last_activity_at.isoformat()
+            node["has_more"] = has_more
+            node["next_cursor"] = (
+                encode_cursor(sort_values[replies[-1]["id"]], replies[-1]["id"])
+                if has_more and replies else None
             )
-        .all()
+
+        for node in nodes.values():
+            node["created_at"] = node["created_at"].isoformat()
+
+    return roots
+
+
+def get_comments_tree(fields=None):
+    """It fetches every comment tree (root comments and all of their replies) with one
+    recursive query and constructs json object for each root comment
+
+    Args:
+        fields (tuple, optional): Node keys to include, see build_tree. Defaults to None.
+
+    Returns:
+        _type_: Comment trees as list
+    """
+    rows = db.session.execute(comment_tree_query()).all()
+
+    return build_tree(rows, fields=fields)
+
+
+def iter_comments_trees(fields=None, root_ids=None, batch_size=1000):
+    """It streams the comment trees one root comment at a time. The rows of the tree
+    query are read in batches from a server-side cursor and each subtree is built as
+    soon as its last row arrives, so memory is bounded by the largest single subtree
+
+    Args:
+        fields (tuple, optional): Node keys to include, see build_tree. Defaults to None.
+        root_ids (list, optional): Ids of the root comments to stream. Defaults to None for all.
+        batch_size (int, optional): Number of rows fetched per batch. Defaults to 1000.
+
+    Yields:
+        _type_: Constructed json of one root comment, with nested replies
+    """
+    query = comment_tree_query(root_ids, group_by_root=True).execution_options(yield_per=batch_size)
+    rows = []
+
+    for row in db.session.execute(query):
+        if rows and row.root_id != rows[0].root_id:
+            yield build_tree(rows, [rows[0].root_id], fields=fields)[0]
+            rows = []
+
+        rows.append(row)
+
+    if rows:
+        yield build_tree(rows, [rows[0].root_id], fields=fields)[0]
+
+
+def get_root_comment_ids():
+    """It returns the ids of the root comments in list order, read from the
+    (parent_id, posted_at, id) index
+
+    Returns:
+        _type_: Root comment ids as list
+    """
+    return db.session.scalars(
+        select(Comment.id).where(Comment.parent_id.is_(None)).order_by(Comment.posted_at, Comment.id)
+    ).all()
+
+
+def get_threads_state():
+    """It returns the state of every comment thread in list order, which keys the
+    comments list cache, see threads_state
+
+    Returns:
+        _type_: Pairs of root comment id and state tuple as list
+    """
+    return threads_state(get_root_comment_ids(), db.session.execute(thread_changes_query()).all())
+
+
+def render_comments_threads(root_ids=None, fields=None):
+    """It encodes every comment tree separately, for the comments list cache
+
+    Args:
+        root_ids (list, optional): Ids of the root comments to render. Defaults to None for all.
+        fields (tuple, optional): Node keys to include, see build_tree. Defaults to None.
+
+    Returns:
+        _type_: Pairs of root comment id and encoded JSON tree as list, in list order
+    """
+    return [(tree["id"], dumps(tree)) for tree in iter_comments_trees(fields, root_ids)]
+
+
+def split_page(rows, limit, sort=DEFAULT_SORT):
+    """It cuts the rows of a page query fetched with limit + 1 to the page, and encodes
+    the cursor of the next page if the extra row is there
+
+    Args:
+        rows (list): Rows of comment_page_query
+        limit (int): Page size
+        sort (str, optional): Sort mode of the query. Defaults to DEFAULT_SORT.
+
+    Returns:
+        _type_: Page rows and the cursor of the next page, or None on the last page
+    """
+    if len(rows) <= limit:
+        return rows, None
+
+    page = rows[:limit]
+
+    return page, encode_cursor(getattr(page[-1], SORT_MODES[sort][0]), page[-1].id)
+
+
+def get_comments_page(parent_id=None, cursor=None, limit=20, max_depth=None, max_children=None, sort=DEFAULT_SORT,
+                      session=None):
+    """It fetches one keyset page of root comments, or of the direct replies of a comment,
+    together with their subtrees cut at max_depth levels and max_children replies per comment,
+    every level ordered by the sort mode. Truncated comments carry has_more and next_cursor
+    so their replies can be fetched lazily with the same sort mode
+
+    Args:
+        parent_id (int, optional): Id of the parent comment. Defaults to None for root comments.
+        cursor (str, optional): Cursor returned with the previous page. Defaults to None.
+        limit (int, optional): Maximum number of comments in the page. Defaults to 20.
+        max_depth (int, optional): Number of reply levels below the page comments. Defaults to None.
+        max_children (int, optional): Maximum number of replies per comment. Defaults to None.
+        sort (str, optional): Sort mode, see SORT_MODES. Defaults to DEFAULT_SORT.
+        session (_type_, optional): Session running the queries. Defaults to None for db.session.
+
+    Returns:
+        _type_: Page comments as list and the cursor of the next page
+    """
+    session = session or db.session
+    page, next_cursor = split_page(
+        session.execute(comment_page_query(parent_id, cursor, limit + 1, sort)).all(), limit, sort
     )
+    comments = []
+
+    if page:
+        root_ids = [row.id for row in page]
+        rows = session.execute(
+            comment_tree_query(root_ids, max_depth=max_depth, counters=True, sort=sort, max_children=max_children)
+        ).all()
+        comments = build_tree(rows, root_ids, max_children=max_children, paginated=True, sort=sort)
+
+    return {"comments": comments, "next_cursor": next_cursor}
+
+
+def get_comment_subtree(comment_id, cursor=None, limit=20, max_depth=None, max_children=None, sort=DEFAULT_SORT,
+                        session=None):
+    """It fetches one comment with a keyset page of its direct replies and their subtrees,
+    so a client viewing one discussion gets that thread only. It issues three queries
+    whatever the size of the database: the comment, the page and the page subtrees
+
+    Args:
+        comment_id (int): Id of the comment
+        cursor (str, optional): next_cursor of the comment from a previous response. Defaults to None.
+        limit (int, optional): Maximum number of direct replies. Defaults to 20.
+        max_depth (int, optional): Number of reply levels below the comment. Defaults to None.
+        max_children (int, optional): Maximum number of replies per reply. Defaults to None.
+        sort (str, optional): Sort mode, see SORT_MODES. Defaults to DEFAULT_SORT.
+        session (_type_, optional): Session running the queries. Defaults to None for db.session.
+
+    Returns:
+        _type_: The comment as a paginated node, or None if it doesn't exist
+    """
+    session = session or db.session
+    rows = session.execute(comment_tree_query([comment_id], max_depth=0, counters=True)).all()
+
+    if not rows:
+        return None
+
+    # without replies, has_more tells whether the comment has any
+    comment = build_tree(rows, [comment_id], paginated=True)[0]
+
+    if max_depth != 0:
+        page = get_comments_page(comment_id, cursor, limit, reply_depth(max_depth), max_children, sort, session)
+        attach_replies_page(comment, page)
 
-    return [build_tree(comment) for comment in root_comments]
+    return comment
+
+
+def reply_depth(max_depth):
+    # levels below the replies of a comment, from the levels below the comment
+    return None if max_depth is None else max_depth - 1
+
+
+def attach_replies_page(comment, page):
+    """It puts a page of replies under a comment node built without replies
+
+    Args:
+        comment (dict): Paginated comment node
+        page (dict): Page returned by get_comments_page
+    """
+    comment["replies"] = page["comments"]
+    comment["has_more"] = page["next_cursor"] is not None
+    comment["next_cursor"] = page["next_cursor"]
+
+
+def get_comment_ancestors(comment_id, max_depth=None, session=None):
+    """It fetches the breadcrumb of a comment, its chain of ancestors from the root
+    comment down to its parent, with one query
+
+    Args:
+        comment_id (int): Id of the comment
+        max_depth (int, optional): Number of nearest ancestors to fetch. Defaults to None for all.
+        session (_type_, optional): Session running the query. Defaults to None for db.session.
+
+    Returns:
+        _type_: Ancestors as paginated nodes without replies and whether farther ancestors
+            were left out, or None if the comment doesn't exist
+    """
+    return ancestors_chain((session or db.session).execute(comment_ancestors_query(comment_id, max_depth)).all())
+
+
+def ancestors_chain(rows):
+    """It builds the response of get_comment_ancestors from the rows of comment_ancestors_query
+
+    Args:
+        rows (list): The comment and its ancestors, farthest first
+
+    Returns:
+        _type_: Ancestors and whether farther ones were left out, or None without rows
+    """
+    if not rows:
+        return None
+
+    # every row is its own root, so no replies are linked
+    ancestors = build_tree(rows[:-1], [row.id for row in rows], paginated=True)
+
+    return {"ancestors": ancestors, "has_more": rows[0].parent_id is not None}
+
+
+def comment_exists(comment_id, session=None):
+    """It tells whether a comment exists
+
+    Args:
+        comment_id (int): Id of the comment
+        session (_type_, optional): Session running the query. Defaults to None for db.session.
+
+    Returns:
+        _type_: True if the comment exists
+    """
+    return (session or db.session).execute(select(Comment.id).where(Comment.id == comment_id)).first() is not None
+
+
+def comments_validators(comment_id, variant="", session=None):
+    """It derives the cache validators of one subtree with two small queries and without
+    building the tree. A subtree is identified by its comment count, highest id and latest
+    update: any insert raises the highest id, any delete lowers the count and any update
+    moves the latest update. All the comments are identified by comments_state instead
+
+    Args:
+        comment_id (int): Id of the subtree root
+        variant (str, optional): Representation variant, e.g. the query string. Defaults to "".
+        session (_type_, optional): Session running the queries. Defaults to None for db.session.
+
+    Returns:
+        _type_: Tuple of strong ETag value and last modification time (None for subtrees),
+            or None if the comment doesn't exist
+    """
+    session = session or db.session
+    path = session.execute(select(Comment.path).where(Comment.id == comment_id)).scalar()
+
+    if path is None:
+        return None
+
+    state = tuple(session.execute(subtree_state_query(path)).one())
+
+    return validators_etag(state, variant), None
+
+
+def ancestors_validators(comment_id, variant="", session=None):
+    """It derives the cache validators of the ancestors of a comment from the change count
+    of its thread, without walking the chain. Every ancestor is in the thread, so an edit
+    of one, or a reply anywhere below one moving its counters, is counted there
+
+    Args:
+        comment_id (int): Id of the comment
+        variant (str, optional): Representation variant, e.g. the query string. Defaults to "".
+        session (_type_, optional): Session running the queries. Defaults to None for db.session.
+
+    Returns:
+        _type_: Tuple of strong ETag value and last modification time (None for ancestors),
+            or None if the comment doesn't exist or its path isn't filled
+    """
+    session = session or db.session
+    path = session.execute(select(Comment.path).where(Comment.id == comment_id)).scalar()
+
+    if path is None:
+        return None
+
+    root_ids = [path_root_id(path)]
+    [(_, state)] = threads_state(root_ids, session.execute(thread_changes_query(root_ids)).all())
+
+    return validators_etag(state, variant), None
+
+
+def subtree_state_query(path):
+    """It constructs the query of the comment count, highest id and latest update of a
+    subtree, which change with any insert, delete or update inside it
+
+    Args:
+        path (str): Materialized path of the subtree root
+
+    Returns:
+        _type_: Select statement of one row
+    """
+    return (
+        select(func.count(Comment.id), func.max(Comment.id), func.max(Comment.updated_at))
+        .where(subtree_condition(path))
+    )
+
+
+def validators_etag(state, variant=""):
+    """It hashes the state of the comments and the representation variant into an ETag
+
+    Args:
+        state (tuple): State read by comments_state or comments_validators
+        variant (str, optional): Representation variant, e.g. the query string. Defaults to "".
+
+    Returns:
+        _type_: Strong ETag value
+    """
+    return hashlib.sha1(f"{variant}|{state}".encode()).hexdigest()
@@ -0,0 +1,82 @@
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+
+def matches_validators(if_none_match, if_modified_since, etag, last_modified):
+    """It evaluates parsed conditional request headers against the current validators.
+    If-None-Match takes precedence over If-Modified-Since, as required by RFC 9110
+
+    Args:
+        if_none_match (ETags): Parsed If-None-Match header, empty when missing
+        if_modified_since (datetime): Parsed If-Modified-Since header or None
+        etag (str): Current strong ETag value
+        last_modified (datetime): Current last modification time or None
+
+    Returns:
+        _type_: True if the client's copy is still current
+    """
+    if if_none_match:
+        return if_none_match.contains(etag)
+
+    if last_modified is not None and if_modified_since is not None:
+        # HTTP dates have a one second resolution
+        return last_modified.replace(microsecond=0) <= if_modified_since
+
+    return False
+
+
+def is_not_modified(etag, last_modified):
+    """It evaluates the conditional headers of the current request, see matches_validators
+
+    Args:
+        etag (str): Current strong ETag value
+        last_modified (datetime): Current last modification time or None
+
+    Returns:
+        _type_: True if the client's copy is still current
+    """
+    return matches_validators(request.if_none_match, request.if_modified_since, etag, last_modified)
+
+
+def conditional_get(compute_validators):
+    """It makes a read view answer conditional requests: the validators are computed
+    before the view runs and a request whose copy is still current is answered with
+    304 Not Modified without calling the view, so nothing is built or serialized
+
+    Args:
+        compute_validators (_type_): Callable taking the view arguments and returning a tuple
+            of ETag and Last-Modified (or None), or None to skip conditional handling,
+            e.g. for a missing resource
+
+    Returns:
+        _type_: View decorator
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            validators = compute_validators(*args, **kwargs)
+
+            if validators is None:
+                return view(*args, **kwargs)
+
+            etag, last_modified = validators
+
+            if is_not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+
+            if last_modified is not None:
+                response.last_modified = last_modified
+
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, exists, insert, literal, or_, select
+
+from app.database import db
+from app.events import comment_events
+from app.models.comments import Comment, path_root_id_expression, update_ancestor_counters
+from app.models.comment_changes import CommentChange, DELETED, count_thread_changes
+from app.utils.hierarchy import subtree_filter
+
+SOFT = "soft"
+CASCADE = "cascade"
+DELETE_MODES = (SOFT, CASCADE)
+
+
+def has_replies(comment_id):
+    """It checks whether a comment has at least one direct reply with one index lookup
+
+    Args:
+        comment_id (int): Id of the comment
+
+    Returns:
+        _type_: True if the comment has replies
+    """
+    return db.session.execute(select(exists().where(Comment.parent_id == comment_id))).scalar()
+
+
+def other_authors_exist(condition, user_id):
+    """It builds the EXISTS condition of a comment of another user among the rows a
+    cascade delete removes
+
+    Args:
+        condition (_type_): Condition matching the subtree, see subtree_filter
+        user_id (int): Id of the user deleting the subtree
+
+    Returns:
+        _type_: SQL condition
+    """
+    other_author = or_(Comment.user_id != user_id, Comment.user_id.is_(None))
+
+    # uncorrelated, the statements it guards select from the comment table too
+    return select(Comment.id).where(condition, other_author).correlate(None).exists()
+
+
+def delete_comment_mode(comment, mode=None, user_id=None):
+    """It deletes a comment with the given mode. Without a mode, a comment with replies is
+    soft deleted so the conversation below it stays readable, and a leaf is removed. A
+    cascade delete on behalf of a user is refused when the subtree holds comments of other
+    users; without a mode the comment is then soft deleted instead
+
+    Args:
+        comment (Comment): Comment to delete
+        mode (str, optional): "soft" or "cascade". Defaults to None.
+        user_id (int, optional): Id of the user deleting the comment. Defaults to None for any subtree.
+
+    Returns:
+        _type_: False if the cascade delete was refused, else True
+    """
+    requested = mode
+
+    if mode is None:
+        mode = SOFT if has_replies(comment.id) else CASCADE
+
+    if mode == CASCADE:
+        if delete_comment_subtree(comment, user_id):
+            return True
+
+        if requested == CASCADE:
+            return False
+
+    soft_delete_comment(comment)
+
+    return True
+
+
+def soft_delete_comment(comment):
+    """It replaces a comment by the deleted placeholder with one UPDATE of its row. The
+    replies keep their parent, so the tree shape doesn't change, and the author is kept
+    for authorization only: readers see DELETED_PLACEHOLDER
+
+    Args:
+        comment (Comment): Comment to delete
+    """
+    comment.text = ""
+    comment.deleted_at = datetime.now(timezone.utc)
+    db.session.commit()
+
+
+def delete_comment_subtree(comment, user_id=None):
+    """It removes a comment and all of its descendants with one set-based DELETE over
+    the path index range of the subtree, or a recursive CTE when the path isn't filled.
+    The tombstones of the change log are written beforehand by one INSERT ... SELECT over
+    the same rows, counted in their thread by one upsert, and the ancestor counters are
+    updated afterwards by one UPDATE, so no comment is loaded whatever the size of the subtree.
+    The check for other authors is part of the tombstones INSERT: SQLite holds the write
+    lock from there until the commit, and PostgreSQL first locks the subtree rows, which
+    blocks new replies to them, so no comment of another user is deleted unchecked
+
+    Args:
+        comment (Comment): Root comment of the subtree to delete
+        user_id (int, optional): Id of the user deleting the subtree. Defaults to None for any subtree.
+
+    Returns:
+        _type_: False if the subtree holds comments of other users and nothing was deleted
+    """
+    comment_id, parent_id, path = comment.id, comment.parent_id, comment.path
+    condition = subtree_filter(comment_id, path)
+    tombstones = select(Comment.id, Comment.parent_id, path_root_id_expression(Comment.path), literal(DELETED))
+
+    if user_id is not None:
+        if db.session.get_bind().dialect.name == "postgresql":
+            db.session.execute(select(Comment.id).where(condition).with_for_update())
+
+        tombstones = tombstones.where(~other_authors_exist(condition, user_id))
+
+    logged = db.session.execute(insert(CommentChange.__table__).from_select(
+        ["comment_id", "parent_id", "root_id", "op"],
+        tombstones.where(condition).order_by(Comment.id),
+    )).rowcount
+
+    if not logged:
+        db.session.rollback()
+        return False
+
+    count_thread_changes(db.session.connection(), path_root_id_expression(Comment.path), condition)
+    # core statement, the ORM would load the replies to null out their parent_id
+    deleted = db.session.execute(delete(Comment.__table__).where(condition)).rowcount
+    update_ancestor_counters(db.session.connection(), parent_id, path, -deleted)
+    db.session.expunge(comment)
+    db.session.commit()
+
+    # the core statements bypass the session events
+    comment_events.publish()
+
+    return True
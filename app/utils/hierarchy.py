@@ -0,0 +1,161 @@
+from sqlalchemy import String, and_, cast, func, literal, literal_column, or_, select, update
+from sqlalchemy.orm import aliased
+
+from app.models.comments import Comment, PATH_SEGMENT_WIDTH, PATH_SEPARATOR
+
+
+def path_segment_expression(column):
+    """It builds a portable SQL expression zero padding an id column to a path segment,
+    equivalent to format_path_segment on both SQLite and PostgreSQL
+
+    Args:
+        column (_type_): Integer id column
+
+    Returns:
+        _type_: SQL string expression
+    """
+    id_text = cast(column, String)
+    return func.substr(literal("0" * PATH_SEGMENT_WIDTH) + id_text, func.length(id_text) + 1)
+
+
+def path_ids(path):
+    """It splits a materialized path into the ids of the comments on it, from the root
+    comment down to the comment owning the path
+
+    Args:
+        path (str): Materialized path
+
+    Returns:
+        _type_: Comment ids as list
+    """
+    return [int(segment) for segment in path.split(PATH_SEPARATOR)]
+
+
+def subtree_condition(path, include_self=True):
+    """It builds the condition matching a comment and its descendants as a range on the
+    path index: descendant paths start with path + '/' and '/' sorts right before '0'
+
+    Args:
+        path (str): Materialized path of the subtree root
+        include_self (bool, optional): Whether to match the subtree root itself. Defaults to True.
+
+    Returns:
+        _type_: SQL condition on Comment.path
+    """
+    descendants = and_(
+        Comment.path > path + PATH_SEPARATOR,
+        Comment.path < path + chr(ord(PATH_SEPARATOR) + 1),
+    )
+
+    if include_self:
+        return or_(Comment.path == path, descendants)
+
+    return descendants
+
+
+def subtree_ids_query(comment_id):
+    """It constructs a recursive CTE query of the ids of a comment and its descendants
+    following parent_id, for comments outside the hierarchy index (path not filled)
+
+    Args:
+        comment_id (int): Id of the subtree root
+
+    Returns:
+        _type_: Select statement of comment ids
+    """
+    tree = select(Comment.id).where(Comment.id == comment_id).cte("subtree", recursive=True)
+    reply = aliased(Comment, name="reply")
+    tree = tree.union_all(select(reply.id).where(reply.parent_id == tree.c.id))
+
+    return select(tree.c.id)
+
+
+def subtree_filter(comment_id, path):
+    """It builds the condition matching a comment and its descendants, a range scan on the
+    path index when the path is known and a recursive CTE otherwise
+
+    Args:
+        comment_id (int): Id of the subtree root
+        path (str): Materialized path of the subtree root, or None
+
+    Returns:
+        _type_: SQL condition on Comment
+    """
+    if path is None:
+        return Comment.id.in_(subtree_ids_query(comment_id))
+
+    return subtree_condition(path)
+
+
+def subtree_query(path):
+    """It constructs a query fetching a comment and all of its descendants in display
+    order (depth first) with one range scan on the path index
+
+    Args:
+        path (str): Materialized path of the subtree root
+
+    Returns:
+        _type_: Select statement of Comment objects
+    """
+    return select(Comment).where(subtree_condition(path)).order_by(Comment.path)
+
+
+def rebuild_hierarchy(session):
+    """It recomputes path and depth of every comment reachable from a root comment
+    with one set-based UPDATE driven by a recursive CTE, e.g. after bulk inserts that
+    bypass the ORM insert event
+
+    Args:
+        session (_type_): Database session
+    """
+    anchor = select(
+        Comment.id,
+        path_segment_expression(Comment.id).label("path"),
+        literal_column("0").label("depth"),
+    ).where(Comment.parent_id.is_(None))
+    tree = anchor.cte("hierarchy", recursive=True)
+
+    reply = Comment.__table__.alias("reply")
+    tree = tree.union_all(
+        select(
+            reply.c.id,
+            tree.c.path + PATH_SEPARATOR + path_segment_expression(reply.c.id),
+            tree.c.depth + 1,
+        ).where(reply.c.parent_id == tree.c.id)
+    )
+
+    session.execute(
+        update(Comment.__table__)
+        .values(path=tree.c.path, depth=tree.c.depth)
+        .where(Comment.__table__.c.id == tree.c.id)
+    )
+
+
+def recount_comments(session):
+    """It recomputes reply_count, descendant_count and last_activity_at of every comment
+    with one set-based UPDATE, repairing any drift of the maintained counters. The
+    descendants are counted with a range scan on the path index per comment, so comments
+    outside the hierarchy index only count their direct replies until rebuild_hierarchy
+
+    Args:
+        session (_type_): Database session
+    """
+    table = Comment.__table__
+    reply = table.alias("reply")
+    member = table.alias("member")
+    # same ranges as subtree_condition, on the path column of the updated row
+    upper_bound = table.c.path + chr(ord(PATH_SEPARATOR) + 1)
+    descendants = and_(member.c.path > table.c.path + PATH_SEPARATOR, member.c.path < upper_bound)
+    in_subtree = and_(member.c.path >= table.c.path, member.c.path < upper_bound)
+
+    session.execute(
+        update(table).values(
+            reply_count=select(func.count(reply.c.id)).where(reply.c.parent_id == table.c.id).scalar_subquery(),
+            descendant_count=select(func.count(member.c.id)).where(descendants).scalar_subquery(),
+            last_activity_at=func.coalesce(
+                select(func.max(member.c.posted_at)).where(in_subtree).scalar_subquery(), table.c.posted_at
+            ),
+            # counters aren't edits
+            updated_at=table.c.updated_at,
+        )
+    )
@@ -0,0 +1,217 @@
+import orjson
+from flask import current_app, stream_with_context
+
+from app.metrics import timed
+
+# Deepest nesting passed to orjson, a dict counting as one level and a list as another.
+# orjson's own limit differs between versions (255 levels already fail on 3.13), so this
+# stays well below it and a subtree orjson still refuses is written by dumps_deep
+ORJSON_MAX_DEPTH = 128
+
+
+@timed("serialize")
+def dumps(payload):
+    """It encodes a payload to compact JSON bytes with sorted keys using orjson, which is
+    several times faster than the json module. Unlike jsonify, non-ASCII text is written as
+    raw UTF-8 instead of \\u escapes and there is no trailing newline: the documents decode
+    to the same values but the bytes differ
+
+    Args:
+        payload (_type_): JSON serializable payload
+
+    Returns:
+        _type_: Encoded JSON as bytes
+    """
+    try:
+        return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        # orjson refuses to nest deeper than its recursion limit, i.e. reply chains longer
+        # than about a hundred comments
+        return dumps_deep(payload)
+
+
+def container_heights(payload):
+    """It measures how deeply every dict and list of a payload nests, without recursion:
+    the containers are listed in depth-first pre-order, so walking the list backwards
+    sees every child before its parent
+
+    Args:
+        payload (_type_): JSON serializable payload
+
+    Returns:
+        _type_: Nesting levels of each container, including itself, keyed by id()
+    """
+    containers = []
+    stack = [payload]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        else:
+            continue
+        containers.append(value)
+
+    heights = {}
+    for container in reversed(containers):
+        children = container.values() if isinstance(container, dict) else container
+        heights[id(container)] = 1 + max((heights.get(id(child), 0) for child in children), default=0)
+
+    return heights
+
+
+def dumps_shallow(value):
+    """It encodes a value with orjson, unless it is a container nested deeper than the
+    installed orjson allows
+
+    Args:
+        value (_type_): JSON serializable value
+
+    Returns:
+        _type_: Encoded JSON as bytes, or None for a container orjson refuses
+    """
+    try:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    except orjson.JSONEncodeError:
+        if isinstance(value, (dict, list, tuple)):
+            return None
+        raise
+
+
+def dumps_deep(payload):
+    """It encodes a payload nested deeper than orjson allows, with an explicit stack in
+    place of recursion, so time and memory stay linear whatever the depth. Only the
+    containers too deep for orjson are written here, key by key; every shallower subtree
+    (in a comment tree, all but the long reply chains) is still encoded by orjson
+
+    Args:
+        payload (_type_): JSON serializable payload
+
+    Returns:
+        _type_: Encoded JSON as bytes, the same as orjson would write
+    """
+    heights = container_heights(payload)
+    chunks = []
+    # pending values, last first; bytes are already encoded JSON, which payloads can't
+    # contain as orjson doesn't serialize bytes
+    stack = [payload]
+
+    while stack:
+        value = stack.pop()
+
+        if isinstance(value, bytes):
+            chunks.append(value)
+            continue
+
+        if heights.get(id(value), 0) <= ORJSON_MAX_DEPTH:
+            encoded = dumps_shallow(value)
+            if encoded is not None:
+                chunks.append(encoded)
+                continue
+
+        if isinstance(value, dict):
+            keys = sorted(value)
+            stack.append(b"}")
+            for index in range(len(keys) - 1, -1, -1):
+                stack.append(value[keys[index]])
+                stack.append((b"," if index else b"{") + orjson.dumps(keys[index]) + b":")
+        else:
+            stack.append(b"]")
+            for index in range(len(value) - 1, -1, -1):
+                stack.append(value[index])
+                stack.append(b"," if index else b"[")
+
+    return b"".join(chunks)
+
+
+def json_response(payload, status=200):
+    """It builds a JSON response from a payload encoded with dumps
+
+    Args:
+        payload (_type_): JSON serializable payload
+        status (int, optional): HTTP status code. Defaults to 200.
+
+    Returns:
+        _type_: Flask response
+    """
+    return current_app.response_class(dumps(payload), status=status, mimetype="application/json")
+
+
+STREAM_MIMETYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def iter_json(key, items):
+    """It encodes items one by one as the array of a single key JSON object
+
+    Args:
+        key (str): Key of the array
+        items (_type_): Iterable of JSON serializable items
+
+    Yields:
+        _type_: Chunks of encoded JSON as bytes
+    """
+    yield b'{' + dumps(key) + b':['
+
+    separator = b""
+    for item in items:
+        yield separator + dumps(item)
+        separator = b","
+
+    yield b"]}"
+
+
+def iter_ndjson(items):
+    """It encodes items one by one as newline delimited JSON
+
+    Args:
+        items (_type_): Iterable of JSON serializable items
+
+    Yields:
+        _type_: One encoded JSON line per item as bytes
+    """
+    for item in items:
+        yield dumps(item) + b"\n"
+
+
+def parse_ndjson(lines):
+    """It decodes newline delimited JSON one line at a time, e.g. from a request stream,
+    skipping blank lines. A line that isn't valid JSON is decoded as None, so it is
+    reported as invalid input by the schema validating the items
+
+    Args:
+        lines (_type_): Iterable of encoded lines
+
+    Yields:
+        _type_: Decoded item of each line
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            yield orjson.loads(line)
+        except orjson.JSONDecodeError:
+            yield None
+
+
+def streaming_response(items, stream_format, key="comments"):
+    """It builds a generator backed response that encodes and sends items while they
+    are produced, keeping the request context alive until the last chunk is sent
+
+    Args:
+        items (_type_): Iterable of JSON serializable items
+        stream_format (str): Either "json" for a {key: [...]} object or "ndjson"
+        key (str, optional): Key of the array in the json format. Defaults to "comments".
+
+    Returns:
+        _type_: Flask streaming response
+    """
+    chunks = iter_json(key, items) if stream_format == "json" else iter_ndjson(items)
+
+    return current_app.response_class(
+        stream_with_context(chunks), mimetype=STREAM_MIMETYPES[stream_format]
+    )
@@ -0,0 +1,182 @@
+"""Seeds a throwaway SQLite database with comments, serves it with the threaded Flask
+server and with the ASGI app under uvicorn, and reports the throughput and latency of
+the comment reads of both with many concurrent keep-alive clients.
+
+Usage:
+    python benchmarks/bench_asgi.py --comments 100000 --clients 500 --duration 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SERVERS = {
+    # what the Dockerfile ran so far
+    "flask run (threads)": [sys.executable, "-m", "flask", "--app", "app", "run", "--with-threads", "--port", "{port}"],
+    "uvicorn (asgi)": [
+        sys.executable, "-m", "uvicorn", "--factory", "app.asgi:create_asgi_app",
+        "--port", "{port}", "--log-level", "warning", "--no-access-log",
+    ],
+}
+
+
+def seed_database(args):
+    """It fills the benchmark database and returns the urls the clients request"""
+    from sqlalchemy import func, select, text
+    from app import create_app
+    from app.database import db
+    from app.models.comments import Comment
+    from app.models.comment_changes import CommentChange
+    from benchmarks.seeding import seed
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        seed(db, args.comments, args.users, args.root_ratio)
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+        root_ids = db.session.scalars(
+            select(Comment.id).where(Comment.parent_id.is_(None)).order_by(Comment.reply_count.desc()).limit(200)
+        ).all()
+        leaf_ids = db.session.scalars(select(Comment.id).order_by(Comment.depth.desc()).limit(200)).all()
+        seq = db.session.execute(select(func.coalesce(func.max(CommentChange.seq), 0))).scalar()
+
+    return (
+        [f"/comments/{root_id}/tree?limit=20&max_depth=2&max_children=5" for root_id in root_ids]
+        + [f"/comments/{leaf_id}/ancestors" for leaf_id in leaf_ids]
+        + ["/comments/list?limit=20&max_depth=1&max_children=3", f"/comments/changes?since={max(seq - 50, 0)}"]
+    )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} didn't start")
+
+
+async def read_response(reader):
+    """It reads one HTTP/1.1 response and returns its status and whether the connection stays open"""
+    status = int((await reader.readline()).split()[1])
+    length, keep_alive = None, True
+
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "connection" and value == "close":
+            keep_alive = False
+
+    if length is None:
+        await reader.read()
+        return status, False
+
+    await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def run_client(port, urls, deadline, rng, latencies, errors):
+    """It requests random urls over a keep-alive connection until the deadline"""
+    connection = None
+
+    while time.monotonic() < deadline:
+        url = rng.choice(urls)
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection("127.0.0.1", port)
+            reader, writer = connection
+            writer.write(f"GET {url} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode())
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+            errors.append("connection")
+            connection = None
+            await asyncio.sleep(0.05)
+            continue
+
+        if status == 200:
+            latencies.append((time.perf_counter() - started) * 1000)
+        else:
+            errors.append(status)
+
+        if not keep_alive:
+            connection[1].close()
+            connection = None
+
+    if connection is not None:
+        connection[1].close()
+
+
+async def load(port, urls, clients, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(
+        run_client(port, urls, deadline, random.Random(index), latencies, errors) for index in range(clients)
+    ))
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--root-ratio", type=float, default=0.2)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="comments-bench-")
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    os.environ.setdefault("COMMENTS_CACHE_BACKEND", "none")
+
+    started = time.perf_counter()
+    urls = seed_database(args)
+    print(f"Seeded {args.comments} comments in {time.perf_counter() - started:.1f}s")
+
+    print(f"\n{args.clients} clients, {args.duration:.0f}s per server")
+    print(f"{'server':<22}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, command in SERVERS.items():
+        port = free_port()
+        server = subprocess.Popen(
+            [part.format(port=port) for part in command], cwd=ROOT,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port)
+            latencies, errors = asyncio.run(load(port, urls, args.clients, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] if latencies else float("nan")
+        median = statistics.median(latencies) if latencies else float("nan")
+        print(f"{name:<22}{len(latencies) / args.duration:>10.1f}{median:>10.1f}{p99:>10.1f}{len(errors):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Seeds a throwaway SQLite database with comments and reports the latency of the
+comment read endpoints without and with the comment indexes.
+
+Usage:
+    python benchmarks/bench_comments.py --comments 100000 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INDEXES = {
+    "ix_comment_parent_id_posted_at_id": "CREATE INDEX ix_comment_parent_id_posted_at_id "
+                                         "ON comment (parent_id, posted_at, id)",
+    "ix_comment_user_id": "CREATE INDEX ix_comment_user_id ON comment (user_id)",
+}
+
+
+def measure(client, url, repeat):
+    """It requests the url repeat times and returns the latencies in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return timings
+
+
+def run_suite(client, urls, repeat):
+    return {name: measure(client, url, repeat) for name, url in urls.items()}
+
+
+def report(title, results):
+    print(f"\n{title}")
+    print(f"{'endpoint':<28}{'median ms':>12}{'min ms':>12}{'max ms':>12}")
+    for name, timings in results.items():
+        print(f"{name:<28}{statistics.median(timings):>12.2f}{min(timings):>12.2f}{max(timings):>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--root-ratio", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="comments-bench-")
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    # measure the database work, not the rendered comments list cache
+    os.environ.setdefault("COMMENTS_CACHE_BACKEND", "none")
+
+    from sqlalchemy import text
+    from app import create_app
+    from app.database import db
+    from app.models.comments import Comment
+    from benchmarks.seeding import seed
+
+    app = create_app()
+    client = app.test_client()
+
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(db, args.comments, args.users, args.root_ratio)
+        print(f"Seeded {args.comments} comments in {time.perf_counter() - started:.1f}s")
+
+        busiest_parent = db.session.execute(text(
+            "SELECT parent_id FROM comment WHERE parent_id IS NOT NULL "
+            "GROUP BY parent_id ORDER BY count(*) DESC LIMIT 1"
+        )).scalar()
+        newest_root = db.session.query(Comment.id).filter_by(parent_id=None) \
+            .order_by(Comment.posted_at.desc()).limit(1).scalar()
+
+    urls = {
+        "/comments/list": "/comments/list",
+        "/comments/list page": "/comments/list?limit=20&max_depth=2&max_children=5",
+        "replies (busiest parent)": f"/comments/{busiest_parent}/replies?limit=20&max_depth=0",
+        "replies (newest root)": f"/comments/{newest_root}/replies?limit=20",
+    }
+
+    with app.app_context():
+        for name in INDEXES:
+            db.session.execute(text(f"DROP INDEX {name}"))
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+    report("Without parent/user indexes", run_suite(client, urls, args.repeat))
+
+    with app.app_context():
+        for statement in INDEXES.values():
+            db.session.execute(text(statement))
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+    report("With parent/user indexes", run_suite(client, urls, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Holds many server-sent events subscribers open against a threaded server and reports
+the fanout latency from the commit of create_comment to the receipt by every client.
+
+Usage:
+    python benchmarks/bench_events.py --subscribers 1000 --comments 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def subscribe(port, received, connected, stop):
+    """It opens one event stream and records the receipt time of every event id"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    # HTTP/1.0 keeps the body unchunked, so events are plain lines until the server closes
+    writer.write(b"GET /comments/events HTTP/1.0\r\nHost: localhost\r\n\r\n")
+    await writer.drain()
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        if line.startswith(b"retry:"):
+            connected.release()
+        elif line.startswith(b"id: "):
+            received.append((int(line[4:]), time.perf_counter()))
+        if stop.is_set():
+            break
+
+    writer.close()
+
+
+async def run_subscribers(port, count, comments, publish):
+    received = [[] for _ in range(count)]
+    connected = asyncio.Semaphore(0)
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(subscribe(port, received[i], connected, stop)) for i in range(count)]
+
+    started = time.perf_counter()
+    for _ in range(count):
+        await connected.acquire()
+    print(f"Opened {count} streams in {time.perf_counter() - started:.1f}s")
+
+    commits = await asyncio.to_thread(publish)
+
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline and any(len(events) < comments for events in received):
+        await asyncio.sleep(0.05)
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return commits, received
+
+
+def report(title, commits, received, comments):
+    latencies = [
+        (receipt - commits[seq]) * 1000
+        for events in received
+        for seq, receipt in events
+        if seq in commits
+    ]
+    # time until the last subscriber received each comment
+    completions = [
+        (max(receipt for events in received for event_seq, receipt in events if event_seq == seq) - committed) * 1000
+        for seq, committed in commits.items()
+        if all(any(event_seq == seq for event_seq, _ in events) for events in received)
+    ]
+    latencies.sort()
+    delivered = len(latencies)
+    expected = len(received) * comments
+
+    print(f"\n{title}")
+    print(f"delivered {delivered}/{expected} events")
+    if latencies:
+        print(f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'fanout ms':>12}")
+        print(
+            f"{statistics.median(latencies):>10.2f}"
+            f"{latencies[int(delivered * 0.95) - 1]:>10.2f}"
+            f"{latencies[int(delivered * 0.99) - 1]:>10.2f}"
+            f"{latencies[-1]:>10.2f}"
+            f"{statistics.median(completions) if completions else float('nan'):>12.2f}"
+        )
+
+
+def bench_backend(backend, args):
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    from app.database import db
+    from app.models.users import User
+    from app.utils.changes import latest_change
+    from config import Config
+
+    class BenchConfig(Config):
+        COMMENTS_EVENTS_BACKEND = backend
+        COMMENTS_EVENTS_POLL_INTERVAL = args.poll_interval
+
+    app = create_app(BenchConfig)
+    client = app.test_client()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username="bench", email="bench@example.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        headers = {"Authorization": f"Bearer {create_access_token(identity=user_id)}"}
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    server.socket.listen(args.subscribers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    commit_times = []
+
+    def record_commit(session):
+        commit_times.append(time.perf_counter())
+
+    def publish():
+        commits = {}
+        with app.app_context():
+            first_seq = latest_change()[0] + 1
+
+        event.listen(db.session, "after_commit", record_commit)
+        try:
+            for number in range(args.comments):
+                response = client.post("/comments/create", headers=headers, json={
+                    "text": f"Benchmark comment {number}", "user_id": user_id,
+                })
+                assert response.status_code == 201, response.data
+                commits[first_seq + number] = commit_times[-1]
+                time.sleep(args.pause)
+        finally:
+            event.remove(db.session, "after_commit", record_commit)
+
+        return commits
+
+    commits, received = asyncio.run(
+        run_subscribers(server.server_port, args.subscribers, args.comments, publish)
+    )
+    server.shutdown()
+
+    report(f"{backend} broker, {args.subscribers} subscribers", commits, received, args.comments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--comments", type=int, default=20)
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds between two comments")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--backend", choices=["memory", "poll"], action="append")
+    args = parser.parse_args()
+
+    # every subscriber needs a client and a server socket
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.subscribers * 2 + 256
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    workdir = tempfile.mkdtemp(prefix="comments-bench-")
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    for backend in args.backend or ["memory", "poll"]:
+        bench_backend(backend, args)
+
+
+if __name__ == "__main__":
+    main()
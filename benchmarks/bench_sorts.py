@@ -0,0 +1,98 @@
+"""Seeds a throwaway SQLite database with comments and reports the latency of one page of
+root comments and of replies per sort mode, at increasing keyset depths.
+
+Usage:
+    python benchmarks/bench_sorts.py --comments 1000000 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEPTHS = (0, 1000, 10000, 100000)
+
+
+def cursor_at(db, parent_id, sort, depth):
+    """It returns the cursor a client paging from the start holds after depth comments,
+    or None when there are fewer siblings"""
+    from app.utils.comment_utils import SORT_MODES, comment_page_query, encode_cursor
+
+    row = db.session.execute(comment_page_query(parent_id, sort=sort).offset(depth - 1).limit(1)).first()
+    if row is None:
+        return None
+
+    return encode_cursor(getattr(row, SORT_MODES[sort][0]), row.id)
+
+
+def measure(client, url, repeat):
+    """It requests the url repeat times and returns the latencies in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--comments", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--root-ratio", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="comments-bench-")
+    os.environ["DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    os.environ.setdefault("COMMENTS_CACHE_BACKEND", "none")
+
+    from sqlalchemy import text
+    from app import create_app
+    from app.database import db
+    from app.utils.comment_utils import SORT_MODES
+    from benchmarks.seeding import seed
+
+    app = create_app()
+    client = app.test_client()
+
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(db, args.comments, args.users, args.root_ratio)
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+        print(f"Seeded {args.comments} comments in {time.perf_counter() - started:.1f}s")
+
+        busiest_parent = db.session.execute(text(
+            "SELECT id FROM comment WHERE parent_id IS NOT NULL ORDER BY reply_count DESC LIMIT 1"
+        )).scalar()
+
+        urls = {}
+        for sort in SORT_MODES:
+            for depth in DEPTHS:
+                url = f"/comments/list?sort={sort}&limit=20&max_depth=1&max_children=3"
+                if depth:
+                    cursor = cursor_at(db, None, sort, depth)
+                    if cursor is None:
+                        continue
+                    url += f"&cursor={cursor}"
+                urls[("roots", sort, depth)] = url
+            urls[("replies", sort, 0)] = f"/comments/{busiest_parent}/replies?sort={sort}&limit=20&max_depth=0"
+
+    print(f"\n{'page':<10}{'sort':<10}{'after':>8}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for (page, sort, depth), url in urls.items():
+        timings = measure(client, url, args.repeat)
+        print(
+            f"{page:<10}{sort:<10}{depth:>8}{statistics.median(timings):>12.2f}"
+            f"{min(timings):>10.2f}{max(timings):>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Measures how long a worker takes to boot: the cold import of the app package and the
+first create_app() in a fresh interpreter, the later create_app() calls of the same
+process (as made by every test), and the first request of the API and of the docs.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in a fresh interpreter per measurement, so every import is cold
+PROBE = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+for _ in range(20):
+    create_app()
+recreated = time.perf_counter()
+client = app.test_client()
+client.get("/comments/changes")
+requested = time.perf_counter()
+client.get("/apispec_1.json")
+documented = time.perf_counter()
+print(json.dumps({
+    "import app": imported - started,
+    "first create_app()": created - imported,
+    "later create_app()": (recreated - created) / 20,
+    "first API request": requested - recreated,
+    "first docs request": documented - requested,
+}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="comments-bench-")
+    env = {
+        **os.environ,
+        "DATABASE_URI": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark"),
+    }
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "app", "comments", "init-db"],
+        cwd=ROOT, env=env, check=True, capture_output=True,
+    )
+
+    timings = {}
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        for name, seconds in json.loads(output).items():
+            timings.setdefault(name, []).append(seconds * 1000)
+
+    print(f"{args.runs} fresh interpreters")
+    print(f"{'step':<22}{'median ms':>12}{'min ms':>10}")
+    for name, values in timings.items():
+        print(f"{name:<22}{statistics.median(values):>12.1f}{min(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
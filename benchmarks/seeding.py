@@ -0,0 +1,54 @@
+"""Shared data generator of the benchmarks: a throwaway database filled with users and a
+random forest of comments, the same for a given size whatever the benchmark."""
+import random
+from datetime import datetime, timedelta
+
+
+def seed(db, total, users, root_ratio, chunk_size=10000):
+    """It inserts users and a random forest of comments where every reply answers an
+    earlier comment. The counters are summed bottom-up in memory, since replies always
+    have a higher id than their parent, and the hierarchy index is built in one statement"""
+    from sqlalchemy import insert
+    from app.models.users import User
+    from app.models.comments import Comment
+    from app.utils.hierarchy import rebuild_hierarchy
+
+    db.session.execute(insert(User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x"}
+        for i in range(1, users + 1)
+    ])
+
+    rng = random.Random(42)
+    started = datetime(2024, 1, 1)
+    parents = [None] * (total + 1)
+    for comment_id in range(2, total + 1):
+        if rng.random() >= root_ratio:
+            parents[comment_id] = rng.randint(max(1, comment_id - 1000), comment_id - 1)
+
+    replies = [0] * (total + 1)
+    descendants = [0] * (total + 1)
+    activity = list(range(total + 1))
+    for comment_id in range(total, 1, -1):
+        parent_id = parents[comment_id]
+        if parent_id is not None:
+            replies[parent_id] += 1
+            descendants[parent_id] += descendants[comment_id] + 1
+            activity[parent_id] = max(activity[parent_id], activity[comment_id])
+
+    for first in range(1, total + 1, chunk_size):
+        db.session.execute(insert(Comment), [
+            {
+                "id": comment_id,
+                "text": f"Comment number {comment_id}",
+                "posted_at": started + timedelta(seconds=comment_id),
+                "user_id": rng.randint(1, users),
+                "parent_id": parents[comment_id],
+                "reply_count": replies[comment_id],
+                "descendant_count": descendants[comment_id],
+                "last_activity_at": started + timedelta(seconds=activity[comment_id]),
+            }
+            for comment_id in range(first, min(first + chunk_size, total + 1))
+        ])
+
+    rebuild_hierarchy(db.session)
+    db.session.commit()
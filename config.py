@@ -9,8 +9,60 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI')\
         or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # read-only views (comment reads, login lookup) query this database when set, see app.database
+    DATABASE_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URI')
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true'
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', 3600))
+    DATABASE_STATEMENT_CACHE_SIZE = int(os.environ.get('DATABASE_STATEMENT_CACHE_SIZE', 500))
+    # WAL lets readers run while a comment is committed; NORMAL only syncs at checkpoints in WAL mode
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    # async driver URI of the same database for app.asgi, derived from SQLALCHEMY_DATABASE_URI if unset
+    ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URI')
+    # threads running the Flask app behind app.asgi, one per request in flight or open event stream
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 100))
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
     JWT_TOKEN_LOCATION = ['headers']
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=int(os.environ.get('JWT_ACCESS_TOKEN_EXPIRES', 1)))
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=int(os.environ.get('JWT_REFRESH_TOKEN_EXPIRES', 60)))
-    
\ No newline at end of file
+    COMMENTS_PAGE_SIZE = int(os.environ.get('COMMENTS_PAGE_SIZE', 20))
+    COMMENTS_MAX_PAGE_SIZE = int(os.environ.get('COMMENTS_MAX_PAGE_SIZE', 100))
+    COMMENTS_BULK_CHUNK_SIZE = int(os.environ.get('COMMENTS_BULK_CHUNK_SIZE', 1000))
+    COMMENTS_CHANGES_SETTLE_SECONDS = int(os.environ.get('COMMENTS_CHANGES_SETTLE_SECONDS', 5))
+    COMMENTS_EVENTS_BACKEND = os.environ.get('COMMENTS_EVENTS_BACKEND', 'memory')
+    COMMENTS_EVENTS_POLL_INTERVAL = float(os.environ.get('COMMENTS_EVENTS_POLL_INTERVAL', 1.0))
+    COMMENTS_EVENTS_BUFFER_SIZE = int(os.environ.get('COMMENTS_EVENTS_BUFFER_SIZE', 1000))
+    COMMENTS_EVENTS_KEEPALIVE = int(os.environ.get('COMMENTS_EVENTS_KEEPALIVE', 15))
+    COMMENTS_EVENTS_STREAM_TIMEOUT = int(os.environ.get('COMMENTS_EVENTS_STREAM_TIMEOUT', 300))
+    COMMENTS_EVENTS_MAX_WAIT = int(os.environ.get('COMMENTS_EVENTS_MAX_WAIT', 30))
+    COMMENTS_CACHE_BACKEND = os.environ.get('COMMENTS_CACHE_BACKEND', 'lru')
+    COMMENTS_CACHE_SIZE = int(os.environ.get('COMMENTS_CACHE_SIZE', 1024))
+    COMMENTS_CACHE_REDIS_URL = os.environ.get('COMMENTS_CACHE_REDIS_URL')
+
+    # per request query count and SQL, tree building and serialization times: aggregated into
+    # latency histograms at METRICS_PATH and/or sent back in a Server-Timing header
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+    # warns with a stack when a request runs one statement more than QUERY_LOG_REPEAT_THRESHOLD
+    # times (N+1 queries) or a statement takes QUERY_LOG_SLOW_SECONDS or longer
+    QUERY_LOG_ENABLED = os.environ.get('QUERY_LOG_ENABLED', 'false').lower() == 'true'
+    QUERY_LOG_REPEAT_THRESHOLD = int(os.environ.get('QUERY_LOG_REPEAT_THRESHOLD', 10))
+    QUERY_LOG_SLOW_SECONDS = float(os.environ.get('QUERY_LOG_SLOW_SECONDS', 0.5))
+
+    # Swagger UI at /apidocs, built on its first request
+    API_DOCS_ENABLED = os.environ.get('API_DOCS_ENABLED', 'true').lower() == 'true'
+    API_DOCS_SCHEMA = os.path.join(basedir, 'schema.json')
+
+    # "bcrypt" or a werkzeug method, e.g. "scrypt:32768:8:1"; outdated hashes are replaced on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # the number of CPUs when unset or empty
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1)
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
@@ -0,0 +1,28 @@
+"""Add comment username snapshot
+
+Revision ID: 0a6c2e8b4d91
+Revises: e3a9d5f7c182
+Create Date: 2026-10-18 16:20:44.902371
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6c2e8b4d91'
+down_revision = 'e3a9d5f7c182'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('username', sa.String(), nullable=True))
+
+    op.execute('UPDATE comment SET username = (SELECT username FROM "user" WHERE "user".id = comment.user_id)')
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_column('username')
@@ -0,0 +1,56 @@
+"""Add comment change log and updated_at
+
+Revision ID: 106de41d2857
+Revises: 2f7eb152d907
+Create Date: 2026-10-18 13:27:52.118094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '106de41d2857'
+down_revision = '2f7eb152d907'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_app's db.create_all() may already have created the new table on boot
+    if not sa.inspect(op.get_bind()).has_table('comment_change'):
+        create_comment_change_table()
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # existing comments enter the change log as created, in id order
+    op.execute("UPDATE comment SET updated_at = posted_at")
+    op.execute(
+        "INSERT INTO comment_change (comment_id, parent_id, op, changed_at) "
+        "SELECT id, parent_id, 'created', posted_at FROM comment ORDER BY id"
+    )
+
+
+def create_comment_change_table():
+    op.create_table('comment_change',
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('comment_id', sa.Integer(), nullable=False),
+        sa.Column('parent_id', sa.Integer(), nullable=True),
+        sa.Column('op', sa.String(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+        sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('comment_change', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_comment_change_comment_id'), ['comment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('comment_change', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comment_change_comment_id'))
+
+    op.drop_table('comment_change')
@@ -0,0 +1,26 @@
+"""Add comment deleted_at
+
+Revision ID: 5c1e9a7d3b20
+Revises: 106de41d2857
+Create Date: 2026-10-18 14:02:11.842517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e9a7d3b20'
+down_revision = '106de41d2857'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
@@ -0,0 +1,45 @@
+"""Never reuse the ids of deleted comments on SQLite
+
+Revision ID: 9b3f6c1e2d48
+Revises: d5e8b3f1a724
+Create Date: 2026-10-18 23:12:40.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3f6c1e2d48'
+down_revision = 'd5e8b3f1a724'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL sequences never hand out an id twice
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    with op.batch_alter_table('comment', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+    # ids deleted before now are only left in the change log
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'comment', 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'comment')"
+    )
+    op.execute(
+        "UPDATE sqlite_sequence SET seq = max(seq, coalesce((SELECT max(comment_id) FROM comment_change), 0)) "
+        "WHERE name = 'comment'"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    with op.batch_alter_table('comment', schema=None, recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
@@ -0,0 +1,55 @@
+"""Add comment hierarchy path and depth
+
+Revision ID: adf45458366a
+Revises: 7dd59167d533
+Create Date: 2026-10-18 10:12:41.530219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'adf45458366a'
+down_revision = '7dd59167d533'
+branch_labels = None
+depends_on = None
+
+
+# Zero pads comment ids to 10 characters on both SQLite and PostgreSQL
+PADDED_ID = "substr('0000000000' || CAST({0} AS VARCHAR), length(CAST({0} AS VARCHAR)) + 1)"
+
+BACKFILL = f"""
+WITH RECURSIVE hierarchy(id, path, depth) AS (
+    SELECT id, {PADDED_ID.format('id')}, 0
+    FROM comment
+    WHERE parent_id IS NULL
+    UNION ALL
+    SELECT reply.id, hierarchy.path || '/' || {PADDED_ID.format('reply.id')}, hierarchy.depth + 1
+    FROM comment AS reply
+    JOIN hierarchy ON reply.parent_id = hierarchy.id
+)
+UPDATE comment SET path = hierarchy.path, depth = hierarchy.depth
+FROM hierarchy
+WHERE comment.id = hierarchy.id
+"""
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'path',
+            sa.String().with_variant(sa.String(collation='C'), 'postgresql'),
+            nullable=True,
+        ))
+        batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_comment_path'), ['path'], unique=False)
+
+    op.execute(BACKFILL)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comment_path'))
+        batch_op.drop_column('depth')
+        batch_op.drop_column('path')
@@ -0,0 +1,46 @@
+"""Add comment reply, descendant and activity counters
+
+Revision ID: b8e4f1c2a673
+Revises: 5c1e9a7d3b20
+Create Date: 2026-10-18 15:12:40.316204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e4f1c2a673'
+down_revision = '5c1e9a7d3b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reply_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('descendant_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_activity_at', sa.DateTime(), nullable=True))
+
+    # same statement as `flask comments recount`, over the path index ranges
+    op.execute(
+        "UPDATE comment SET "
+        "reply_count = (SELECT count(reply.id) FROM comment AS reply WHERE reply.parent_id = comment.id), "
+        "descendant_count = (SELECT count(member.id) FROM comment AS member "
+        "WHERE member.path > comment.path || '/' AND member.path < comment.path || '0'), "
+        "last_activity_at = coalesce((SELECT max(member.posted_at) FROM comment AS member "
+        "WHERE member.path >= comment.path AND member.path < comment.path || '0'), posted_at)"
+    )
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_comment_parent_id_last_activity_at_id', ['parent_id', 'last_activity_at', 'id'], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_parent_id_last_activity_at_id')
+        batch_op.drop_column('last_activity_at')
+        batch_op.drop_column('descendant_count')
+        batch_op.drop_column('reply_count')
@@ -0,0 +1,37 @@
+"""Add comment change root id
+
+Revision ID: c4d7a9e2f615
+Revises: 0a6c2e8b4d91
+Create Date: 2026-10-18 18:42:13.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d7a9e2f615'
+down_revision = '0a6c2e8b4d91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment_change', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('root_id', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_comment_change_root_id_seq', ['root_id', 'seq'], unique=False)
+
+    # changes of deleted comments fall back to their parent's thread, or their own when
+    # they were a root comment
+    op.execute(
+        'UPDATE comment_change SET root_id = coalesce('
+        '(SELECT CAST(substr(comment.path, 1, 10) AS INTEGER) FROM comment WHERE comment.id = comment_change.comment_id), '
+        '(SELECT CAST(substr(comment.path, 1, 10) AS INTEGER) FROM comment WHERE comment.id = comment_change.parent_id), '
+        'CASE WHEN comment_change.parent_id IS NULL THEN comment_change.comment_id END)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('comment_change', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_change_root_id_seq')
+        batch_op.drop_column('root_id')
@@ -0,0 +1,34 @@
+"""Make comment last_activity_at not null
+
+Revision ID: d5e8b3f1a724
+Revises: c4d7a9e2f615
+Create Date: 2026-10-18 21:04:17.582361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e8b3f1a724'
+down_revision = 'c4d7a9e2f615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rows inserted outside the app since the counters were added, same value as `flask comments recount`
+    op.execute(
+        "UPDATE comment SET "
+        "last_activity_at = coalesce((SELECT max(member.posted_at) FROM comment AS member "
+        "WHERE member.path >= comment.path AND member.path < comment.path || '0'), posted_at) "
+        "WHERE last_activity_at IS NULL"
+    )
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.alter_column('last_activity_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.alter_column('last_activity_at', existing_type=sa.DateTime(), nullable=True)
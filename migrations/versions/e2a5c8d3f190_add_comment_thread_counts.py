@@ -0,0 +1,40 @@
+"""Add comment thread change counts
+
+Revision ID: e2a5c8d3f190
+Revises: 9b3f6c1e2d48
+Create Date: 2026-10-18 21:07:41.302917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a5c8d3f190'
+down_revision = '9b3f6c1e2d48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('comment_thread',
+    sa.Column('root_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('changes', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('root_id')
+    )
+
+    # changes outside any known thread are counted under root id 0
+    op.execute(
+        'INSERT INTO comment_thread (root_id, changes) '
+        'SELECT coalesce(root_id, 0), count(*) FROM comment_change GROUP BY coalesce(root_id, 0)'
+    )
+
+    with op.batch_alter_table('comment_change', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_change_root_id_seq')
+
+
+def downgrade():
+    with op.batch_alter_table('comment_change', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_change_root_id_seq', ['root_id', 'seq'], unique=False)
+
+    op.drop_table('comment_thread')
@@ -0,0 +1,214 @@
+import unittest
+import asyncio
+import json
+from app.asgi import create_asgi_app
+from app.cache import tree_cache
+from app.database import db
+from app.models.users import User
+from app.models.comments import Comment
+from flask_jwt_extended import create_access_token
+from config import Config
+
+
+class TestCommentsASGI(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        """Set up the ASGI app, its Flask app and a user with a short thread."""
+        self.asgi = create_asgi_app()
+        self.app = self.asgi.flask_app
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            user = User(username="testuser", email="test@example.com", password="x")
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+            self.access_token = create_access_token(identity=self.user_id)
+
+            root = Comment(text="Root comment", user_id=self.user_id)
+            db.session.add(root)
+            db.session.commit()
+            reply = Comment(text="Reply comment", user_id=self.user_id, parent_id=root.id)
+            db.session.add(reply)
+            db.session.commit()
+            self.root_id, self.reply_id = root.id, reply.id
+
+    async def asyncTearDown(self):
+        """Tear down the database and the async engine."""
+        await self.asgi.engine.dispose()
+
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def scope(self, url, method="GET", headers=None):
+        """Build the ASGI scope of a request."""
+        path, _, query = url.partition("?")
+        return {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "scheme": "http",
+            "http_version": "1.1",
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 50000),
+            "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        }
+
+    async def request(self, url, method="GET", headers=None, body=b""):
+        """Call the ASGI app in process and return the status, headers and body."""
+        scope = self.scope(url, method, headers)
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await self.asgi(scope, receive, send)
+
+        response_headers = {name.decode(): value.decode() for name, value in messages[0]["headers"]}
+        return messages[0]["status"], response_headers, b"".join(m.get("body", b"") for m in messages[1:])
+
+    async def test_reads_match_flask_views(self):
+        """Test that the async reads answer exactly what the Flask views answer."""
+        urls = [
+            "/comments/list",
+            "/comments/list?limit=1&max_depth=0",
+            "/comments/list?sort=bogus",
+            f"/comments/{self.root_id}/replies",
+            f"/comments/{self.root_id}/tree?max_depth=1",
+            f"/comments/{self.reply_id}/ancestors",
+            "/comments/999/tree",
+            "/comments/999/ancestors",
+            "/comments/changes",
+            "/comments/changes?since=0&limit=1",
+        ]
+
+        for url in urls:
+            status, headers, body = await self.request(url)
+            expected = self.client.get(url)
+            self.assertEqual(status, expected.status_code, url)
+            self.assertEqual(json.loads(body), json.loads(expected.data), url)
+            self.assertEqual(headers.get("etag"), expected.headers.get("ETag"), url)
+
+    async def test_not_modified(self):
+        """Test conditional requests on the async reads."""
+        url = f"/comments/{self.root_id}/tree"
+        status, headers, _ = await self.request(url)
+        self.assertEqual(status, 200)
+
+        status, _, body = await self.request(url, headers={"If-None-Match": headers["etag"]})
+        self.assertEqual((status, body), (304, b""))
+
+    async def test_list_is_served_from_the_cache(self):
+        """Test that the async full list shares the Flask app's cache and sees new writes."""
+        _, _, body = await self.request("/comments/list")
+        _, _, cached = await self.request("/comments/list")
+        self.assertEqual(cached, body)
+
+        with self.app.app_context():
+            self.assertEqual(tree_cache.stats(), {"hits": 1, "misses": 2})
+
+        response = self.client.post(
+            "/comments/create",
+            json={"text": "Another reply", "user_id": self.user_id, "parent_id": self.root_id},
+            headers={"Authorization": f"Bearer {self.access_token}"},
+        )
+        self.assertEqual(response.status_code, 201)
+
+        status, headers, body = await self.request("/comments/list")
+        expected = self.client.get("/comments/list")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), json.loads(expected.data))
+        self.assertEqual(headers["etag"], expected.headers["ETag"])
+        self.assertEqual(len(json.loads(body)["comments"][0]["replies"]), 2)
+
+    async def test_other_requests_go_to_flask(self):
+        """Test that writes and streamed lists are served by the Flask app."""
+        payload = json.dumps({"text": "Another root", "user_id": self.user_id}).encode()
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json",
+            "Content-Length": str(len(payload)),
+        }
+
+        status, _, _ = await self.request("/comments/create", method="POST", headers=headers, body=payload)
+        self.assertEqual(status, 201)
+
+        status, headers, body = await self.request("/comments/list?stream=ndjson")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-type"], "application/x-ndjson")
+        self.assertEqual(len(body.splitlines()), 2)
+
+    async def test_open_event_stream_does_not_block_writes(self):
+        """Test that a write completes while an event stream is open on the Flask app."""
+        self.app.config["COMMENTS_EVENTS_KEEPALIVE"] = 0.2
+        requested, disconnected = asyncio.Event(), asyncio.Event()
+        stream_messages = []
+
+        async def receive():
+            if not requested.is_set():
+                requested.set()
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            stream_messages.append(message)
+
+        stream = asyncio.create_task(self.asgi(self.scope("/comments/events?timeout=30"), receive, send))
+        while not stream_messages:
+            await asyncio.sleep(0.01)
+        self.assertEqual(stream_messages[0]["status"], 200)
+
+        payload = json.dumps({"text": "Written while streaming", "user_id": self.user_id}).encode()
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json",
+            "Content-Length": str(len(payload)),
+        }
+        status, _, _ = await asyncio.wait_for(
+            self.request("/comments/create", method="POST", headers=headers, body=payload), 5
+        )
+        self.assertEqual(status, 201)
+
+        # the stream pushes the new comment, then ends as soon as the client goes away
+        while b"Written while streaming" not in b"".join(m.get("body", b"") for m in stream_messages):
+            await asyncio.sleep(0.01)
+        disconnected.set()
+        await asyncio.wait_for(stream, 5)
+
+    async def test_changes_long_poll_returns_after_wait(self):
+        """Test that a long-poll without new changes returns once wait elapses."""
+        self.app.config["COMMENTS_EVENTS_POLL_INTERVAL"] = 0.05
+        status, _, body = await self.request("/comments/changes?since=2&wait=0.2")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {"changes": [], "next_since": 2, "has_more": False})
+
+    async def test_request_metrics(self):
+        """Test that the async reads send Server-Timing and count in the Flask app's metrics."""
+        class MetricsConfig(Config):
+            METRICS_ENABLED = True
+            SERVER_TIMING_ENABLED = True
+
+        await self.asgi.engine.dispose()
+        self.asgi = create_asgi_app(MetricsConfig)
+
+        status, headers, _ = await self.request(f"/comments/{self.root_id}/tree")
+        self.assertEqual(status, 200)
+        self.assertRegex(headers["server-timing"], r'sql;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+        _, _, body = await self.request("/metrics")
+        self.assertIn(
+            b'http_request_duration_seconds_count{endpoint="comments.get_comment_tree",method="GET"} 1', body
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
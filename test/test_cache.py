@@ -0,0 +1,161 @@
+import unittest
+import json
+from sqlalchemy import event
+from app import create_app
+from app.cache import CacheState, RedisCacheBackend, tree_cache
+from app.database import db
+from app.models.users import User
+from app.models.comments import Comment
+from flask_jwt_extended import create_access_token
+from werkzeug.security import generate_password_hash
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of the Redis client used by the cache backend."""
+
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def mset(self, mapping):
+        self.data.update(mapping)
+
+
+class TestCommentTreeCache(unittest.TestCase):
+    def setUp(self):
+        """Set up the Flask test client, the database and two comment threads."""
+        self.app = create_app()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            hashed_password = generate_password_hash("Password@123")
+            self.user = User(username="testuser", email="test@example.com", password=hashed_password)
+            db.session.add(self.user)
+            db.session.commit()
+
+            self.user_id = self.user.id
+            self.access_token = create_access_token(identity=self.user_id)
+            self.threads = []
+            for text in ("First thread", "Second thread"):
+                comment = Comment(text=text, user_id=self.user_id)
+                db.session.add(comment)
+                db.session.commit()
+                self.threads.append(comment.id)
+
+    def tearDown(self):
+        """Tear down the database."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _get_list(self):
+        """Request the comments list and return the decoded body with the number of executed queries."""
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                response = self.client.get("comments/list")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+            stats = tree_cache.stats()
+
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data), len(statements), stats
+
+    def _post_reply(self, parent_id):
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        payload = {"text": "Cached reply", "user_id": self.user_id, "parent_id": parent_id}
+        response = self.client.post("comments/create", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+    def test_list_served_from_cache(self):
+        """Test that a repeated list request is answered without touching the database."""
+        first, first_queries, _ = self._get_list()
+        second, second_queries, stats = self._get_list()
+
+        self.assertEqual(first, second)
+        # only the ETag query, whose state also keys the list, is left once the list is cached
+        self.assertEqual(first_queries, 4)
+        self.assertEqual(second_queries, 1)
+        self.assertEqual(stats, {"hits": 1, "misses": 3})
+
+    def test_reply_invalidates_only_its_thread(self):
+        """Test that a reply re-renders its own thread and keeps the other one cached."""
+        self._get_list()
+        self._post_reply(self.threads[0])
+
+        data, queries, stats = self._get_list()
+
+        self.assertEqual(queries, 4)
+        self.assertEqual(data["comments"][0]["replies"][0]["text"], "Cached reply")
+        self.assertEqual(data["comments"][1]["replies"], [])
+        self.assertEqual(stats, {"hits": 1, "misses": 5})
+
+    def test_write_from_another_process_invalidates(self):
+        """Test that a reply committed through another app on the same database isn't hidden by the cache."""
+        self._get_list()
+
+        other = create_app()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        payload = {"text": "Reply from elsewhere", "user_id": self.user_id, "parent_id": self.threads[1]}
+        response = other.test_client().post("comments/create", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        data, _, _ = self._get_list()
+        self.assertEqual(data["comments"][1]["replies"][0]["text"], "Reply from elsewhere")
+
+    def test_cascade_delete_invalidates_its_thread(self):
+        """Test that a delete written with core statements is attributed to its thread."""
+        self._post_reply(self.threads[0])
+        data, _, _ = self._get_list()
+        reply_id = data["comments"][0]["replies"][0]["id"]
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.delete(f"comments/delete/{reply_id}?mode=cascade", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        data, _, stats = self._get_list()
+        self.assertEqual(data["comments"][0]["replies"], [])
+        self.assertEqual(stats, {"hits": 1, "misses": 5})
+
+    def test_commit_during_render_is_not_cached(self):
+        """Test that a reply committed right after its thread was rendered isn't hidden by the cache."""
+        from app.utils.changes import get_comments_state
+        from app.utils.comment_utils import get_threads_state, render_comments_threads
+
+        def render_then_reply(root_ids):
+            rendered = dict(render_comments_threads(root_ids, fields=("id", "text")))
+            db.session.add(Comment(text="Late reply", user_id=self.user_id, parent_id=self.threads[0]))
+            db.session.commit()
+            return rendered
+
+        with self.app.app_context():
+            list_state, _ = get_comments_state()
+            stale = json.loads(tree_cache.render_list(list_state, get_threads_state, render_then_reply))
+            db.session.remove()
+
+        self.assertEqual(stale["comments"][0]["replies"], [])
+        data, _, _ = self._get_list()
+        self.assertEqual(data["comments"][0]["replies"][0]["text"], "Late reply")
+
+    def test_redis_backend(self):
+        """Test the shared backend against a fake Redis client."""
+        redis = FakeRedis()
+        self.app.extensions["comments_cache"] = CacheState(RedisCacheBackend(redis))
+
+        self._get_list()
+        self._post_reply(self.threads[1])
+        data, _, stats = self._get_list()
+
+        self.assertEqual(data["comments"][1]["replies"][0]["text"], "Cached reply")
+        self.assertTrue(any(key.startswith(f"comments:thread:{self.threads[0]}:") for key in redis.data))
+        self.assertEqual(stats, {"hits": 1, "misses": 5})
@@ -0,0 +1,196 @@
+import unittest
+import json
+import os
+import tempfile
+from alembic.script import ScriptDirectory
+from app import create_app
+from app.database import db
+from app.models.users import User
+from app.models.comments import Comment
+from app.models.comment_changes import CommentChange
+from sqlalchemy import inspect, text
+from werkzeug.security import generate_password_hash
+
+
+class TestCommentsCli(unittest.TestCase):
+    def setUp(self):
+        """Set up the Flask CLI runner, the database and a small comment tree."""
+        self.app = create_app()
+        self.runner = self.app.test_cli_runner()
+        self.workdir = tempfile.TemporaryDirectory()
+
+        with self.app.app_context():
+            db.create_all()
+
+            hashed_password = generate_password_hash("Password@123")
+            user = User(username="testuser", email="test@example.com", password=hashed_password)
+            db.session.add(user)
+            db.session.commit()
+
+            self.user_id = user.id
+            root = Comment(text="Root comment", user_id=self.user_id)
+            db.session.add(root)
+            db.session.commit()
+            reply = Comment(text="Reply comment", user_id=self.user_id, parent_id=root.id)
+            db.session.add(reply)
+            db.session.commit()
+            self.root_id, self.reply_id = root.id, reply.id
+
+    def tearDown(self):
+        """Tear down the database and the exported files."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.workdir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.workdir.name, name)
+
+    def _invoke(self, *args):
+        result = self.runner.invoke(args=["comments", *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result
+
+    def _reset_database(self):
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def test_export_import_round_trip(self):
+        """Test that exported users and comments are imported back with their hierarchy."""
+        for file_format in ("ndjson", "csv"):
+            with self.subTest(file_format=file_format):
+                users_file, comments_file = self._path(f"users.{file_format}"), self._path(f"comments.{file_format}")
+                self._invoke("export", "user", "-o", users_file)
+                self._invoke("export", "comment", "-o", comments_file)
+                self._reset_database()
+
+                self._invoke("import", "user", users_file)
+                result = self._invoke("import", "comment", comments_file)
+                self.assertIn("Imported 2 comment rows", result.output)
+
+                with self.app.app_context():
+                    reply = db.session.get(Comment, self.reply_id)
+                    self.assertEqual(reply.parent_id, self.root_id)
+                    self.assertEqual(reply.depth, 1)
+                    self.assertEqual(reply.user.username, "testuser")
+                    self.assertEqual(reply.username, "testuser")
+                    changes = db.session.query(CommentChange.comment_id).order_by(CommentChange.seq).all()
+                    self.assertEqual([change.comment_id for change in changes], [self.root_id, self.reply_id])
+
+    def test_import_orders_replies_after_parents(self):
+        """Test that replies listed before their parent are held back and orphans are skipped."""
+        self._reset_database()
+        with self.app.app_context():
+            db.session.add(User(id=self.user_id, username="testuser", email="test@example.com", password="x"))
+            db.session.commit()
+
+        records = [
+            {"id": 3, "text": "Nested reply", "posted_at": "2024-01-01T00:00:03", "user_id": self.user_id, "parent_id": 2},
+            {"id": 2, "text": "Reply", "posted_at": "2024-01-01T00:00:02", "user_id": self.user_id, "parent_id": 1},
+            {"id": 1, "text": "Root", "posted_at": "2024-01-01T00:00:01", "user_id": self.user_id, "parent_id": None},
+            {"id": 4, "text": "Orphan", "posted_at": "2024-01-01T00:00:04", "user_id": self.user_id, "parent_id": 99},
+        ]
+        comments_file = self._path("comments.ndjson")
+        with open(comments_file, "w") as f:
+            f.write("\n".join(json.dumps(record) for record in records))
+
+        result = self._invoke("import", "comment", comments_file, "--batch-size", "2")
+        self.assertIn("Imported 3 comment rows", result.output)
+        self.assertIn("Skipped 1 comments", result.output)
+
+        with self.app.app_context():
+            nested = db.session.get(Comment, 3)
+            self.assertEqual(nested.path, "0000000001/0000000002/0000000003")
+            self.assertIsNone(db.session.get(Comment, 4))
+            root = db.session.get(Comment, 1)
+            self.assertEqual((root.reply_count, root.descendant_count), (1, 2))
+            self.assertEqual(root.last_activity_at, nested.posted_at)
+
+    def test_import_counts_replies_to_existing_comments(self):
+        """Test that imported replies are counted by their existing ancestors, as a recount would."""
+        records = [
+            {"id": 11, "text": "Nested import", "posted_at": "2030-01-01T00:00:02", "user_id": self.user_id, "parent_id": 10},
+            {"id": 10, "text": "Imported reply", "posted_at": "2030-01-01T00:00:01", "user_id": self.user_id, "parent_id": self.root_id},
+            {"id": 12, "text": "Nested reply", "posted_at": "2029-01-01T00:00:00", "user_id": self.user_id, "parent_id": self.reply_id},
+        ]
+        comments_file = self._path("comments.ndjson")
+        with open(comments_file, "w") as f:
+            f.write("\n".join(json.dumps(record) for record in records))
+
+        self._invoke("import", "comment", comments_file)
+
+        def counters():
+            with self.app.app_context():
+                return [
+                    (comment.reply_count, comment.descendant_count, comment.last_activity_at)
+                    for comment in db.session.query(Comment).order_by(Comment.id)
+                ]
+
+        imported = counters()
+        root, reply, imported_reply, nested, nested_reply = imported
+        self.assertEqual(root[:2], (2, 4))
+        self.assertEqual(root[2], nested[2])
+        self.assertEqual(reply, (1, 1, nested_reply[2]))
+        self.assertEqual(imported_reply, (1, 1, nested[2]))
+
+        self._invoke("recount")
+        self.assertEqual(counters(), imported)
+
+    def test_import_logs_comments_reusing_deleted_ids(self):
+        """Test that an imported comment is logged as created even if its id has a tombstone."""
+        with self.app.app_context():
+            db.session.add(CommentChange(comment_id=10, op="deleted"))
+            db.session.commit()
+
+        comments_file = self._path("comments.ndjson")
+        with open(comments_file, "w") as f:
+            f.write(json.dumps({"id": 10, "text": "Imported", "posted_at": "2030-01-01T00:00:00", "user_id": self.user_id, "parent_id": None}))
+
+        self._invoke("import", "comment", comments_file)
+
+        with self.app.app_context():
+            changes = db.session.query(CommentChange.comment_id, CommentChange.op).order_by(CommentChange.seq).all()
+            self.assertEqual(changes[-2:], [(10, "deleted"), (10, "created")])
+            self.assertEqual([change.comment_id for change in changes].count(self.root_id), 1)
+
+    def test_recount_repairs_counters(self):
+        """Test that the recount command recomputes drifted counters."""
+        with self.app.app_context():
+            db.session.query(Comment).update({Comment.reply_count: 7, Comment.descendant_count: 7})
+            db.session.commit()
+
+        self._invoke("recount")
+
+        with self.app.app_context():
+            root, reply = db.session.get(Comment, self.root_id), db.session.get(Comment, self.reply_id)
+            self.assertEqual((root.reply_count, root.descendant_count), (1, 1))
+            self.assertEqual((reply.reply_count, reply.descendant_count), (0, 0))
+            self.assertEqual(root.last_activity_at, reply.posted_at)
+
+    def test_init_db_creates_and_stamps_tables(self):
+        """Test that init-db creates the tables of an empty database only, stamped with the
+        latest migration."""
+        with self.app.app_context():
+            db.drop_all()
+        self.addCleanup(self._drop_alembic_version)
+
+        result = self._invoke("init-db")
+        self.assertIn("Created the tables", result.output)
+
+        with self.app.app_context():
+            self.assertTrue({"user", "comment", "comment_change"} <= set(inspect(db.engine).get_table_names()))
+            revision = db.session.execute(text("SELECT version_num FROM alembic_version")).scalar()
+            self.assertEqual(revision, ScriptDirectory("migrations").get_current_head())
+
+        result = self._invoke("init-db")
+        self.assertIn("already has tables", result.output)
+
+    def _drop_alembic_version(self):
+        with self.app.app_context():
+            db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,20 @@
 import unittest
 import json
+import re
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
 from app import create_app
 from app.database import db
 from app.models.users import User
-from app.models.comments import Comment
+from app.models.comments import Comment, format_path_segment
+from app.models.comment_changes import CommentChange
+from app.utils.hierarchy import rebuild_hierarchy, subtree_query
+from app.utils.comment_utils import SORT_MODES, comment_tree_query, get_comments_tree
+from app.query_log import assert_max_queries
+from app.schemas.comment_schema import CommentSchema, COMMENT_LIST_FIELDS
+from app.utils import deletion, serializers
 from flask_jwt_extended import create_access_token
 from werkzeug.security import generate_password_hash
 
@@ -84,6 +95,69 @@ class TestCommentsRoutes(unittest.TestCase):
         self.assertIn("comments", data)
         self.assertEqual(len(data["comments"]), 1)
 
+    def test_create_comment_parent_not_found(self):
+        """Test that a reply to a non-existent comment is refused by the foreign key."""
+        payload = {"text": "Orphan reply", "user_id": self.user.id, "parent_id": 999}
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        response = self.client.post("comments/create", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)["error"], "Parent comment doesn't exist")
+
+        with self.app.app_context():
+            self.assertEqual(db.session.query(Comment).count(), 0)
+
+    def test_create_comment_parent_deleted(self):
+        """Test that replies to a soft deleted comment are refused by create and bulk create."""
+        self._create_reply_chain(1)
+        root_id, reply_id = self._comment_ids()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.assertEqual(self.client.delete(f"comments/delete/{root_id}?mode=soft", headers=headers).status_code, 200)
+
+        payload = {"text": "Late reply", "user_id": self.user.id, "parent_id": root_id}
+        response = self.client.post("comments/create", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)["error"], "Can't reply to a deleted comment")
+
+        payload = [
+            {"text": "Late reply", "user_id": self.user.id, "parent_id": root_id},
+            {"text": "Nested reply", "user_id": self.user.id, "parent_id": reply_id},
+        ]
+        response = self.client.post("comments/bulk", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data)
+        self.assertEqual(data["errors"], [{"index": 0, "errors": {"parent_id": ["Can't reply to a deleted comment"]}}])
+        self.assertEqual(len(self._comment_ids()), 3)
+
+    def test_create_comment_trusts_token_claims(self):
+        """Test that posting a reply reads neither the user nor the parent comment."""
+        response = self.client.post("users/login", json={"username": "testuser", "password": "Password@123"})
+        headers = {"Authorization": f"Bearer {json.loads(response.data)['access_token']}"}
+        self._create_reply_chain(0)
+        with self.app.app_context():
+            root_id = db.session.query(Comment.id).scalar()
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        payload = {"text": "Reply comment", "user_id": self.user.id, "parent_id": root_id}
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", record_statement)
+            try:
+                response = self.client.post("comments/create", json=payload, headers=headers)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", record_statement)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([s for s in statements if s.lstrip().upper().startswith("SELECT")])
+        self.assertFalse([s for s in statements if re.search(r'(FROM|JOIN) "?user\b', s)])
+
+        with self.app.app_context():
+            reply = db.session.query(Comment).filter_by(text="Reply comment").one()
+            self.assertEqual((reply.username, reply.depth), ("testuser", 1))
+
     def test_delete_comment_success(self):
         """Test deleting a comment successfully."""
         comment = Comment(text="Comment to delete", user_id=self.user.id)
@@ -130,3 +204,922 @@ class TestCommentsRoutes(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn("error", data)
         self.assertEqual(data["error"], "You are not authorized to delete this comment")
+
+    def _create_reply_chain(self, depth):
+        """Create a root comment followed by a chain of nested replies of the given depth."""
+        with self.app.app_context():
+            parent = Comment(text="Root comment", user_id=self.user.id)
+            db.session.add(parent)
+            db.session.commit()
+
+            for level in range(depth):
+                reply = Comment(text=f"Reply level {level + 1}", user_id=self.user.id, parent_id=parent.id)
+                db.session.add(reply)
+                db.session.commit()
+                parent = reply
+
+    def _count_list_queries(self, url="comments/list"):
+        """Request the comments list, or url, and return the response with the number of executed queries."""
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                response = self.client.get(url)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+        return response, len(statements)
+
+    def test_get_comments_nested_replies(self):
+        """Test that nested replies are returned inside their parent comments."""
+        self._create_reply_chain(3)
+
+        response = self.client.get("comments/list")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+
+        node = data["comments"][0]
+        self.assertEqual(node["text"], "Root comment")
+        for level in range(3):
+            self.assertEqual(len(node["replies"]), 1)
+            node = node["replies"][0]
+            self.assertEqual(node["text"], f"Reply level {level + 1}")
+        self.assertEqual(node["replies"], [])
+
+    def test_get_comments_fixed_query_count(self):
+        """Test that the comment tree is loaded with the same number of queries whatever its depth."""
+        self._create_reply_chain(2)
+        _, shallow_queries = self._count_list_queries()
+
+        self._create_reply_chain(25)
+        response, deep_queries = self._count_list_queries()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)["comments"]), 2)
+        # the ETag, the root ids, the thread states and one recursive query for the whole tree
+        self.assertEqual(shallow_queries, 4)
+        self.assertEqual(deep_queries, 4)
+
+    def test_get_comments_keyset_pagination(self):
+        """Test paging through root comments with a keyset cursor."""
+        with self.app.app_context():
+            for index in range(3):
+                db.session.add(Comment(text=f"Root comment {index}", user_id=self.user.id))
+                db.session.commit()
+
+        response = self.client.get("comments/list?limit=2")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([c["text"] for c in data["comments"]], ["Root comment 0", "Root comment 1"])
+        self.assertIsNotNone(data["next_cursor"])
+
+        response = self.client.get(f"comments/list?limit=2&cursor={data['next_cursor']}")
+        data = json.loads(response.data)
+        self.assertEqual([c["text"] for c in data["comments"]], ["Root comment 2"])
+        self.assertIsNone(data["next_cursor"])
+
+    def test_get_comments_truncated_branches(self):
+        """Test that depth and children limits mark truncated comments for lazy loading."""
+        with self.app.app_context():
+            root = Comment(text="Root comment", user_id=self.user.id)
+            db.session.add(root)
+            db.session.commit()
+            root_id = root.id
+
+            for index in range(3):
+                db.session.add(Comment(text=f"Reply {index}", user_id=self.user.id, parent_id=root_id))
+                db.session.commit()
+
+            first_reply_id = db.session.query(Comment.id).filter_by(text="Reply 0").scalar()
+            db.session.add(Comment(text="Nested reply", user_id=self.user.id, parent_id=first_reply_id))
+            db.session.commit()
+
+        response = self.client.get("comments/list?max_depth=1&max_children=2")
+        self.assertEqual(response.status_code, 200)
+        root = json.loads(response.data)["comments"][0]
+        self.assertEqual(root["reply_count"], 3)
+        self.assertTrue(root["has_more"])
+        self.assertEqual([r["text"] for r in root["replies"]], ["Reply 0", "Reply 1"])
+
+        first_reply = root["replies"][0]
+        self.assertEqual(first_reply["replies"], [])
+        self.assertEqual(first_reply["reply_count"], 1)
+        self.assertTrue(first_reply["has_more"])
+
+        response = self.client.get(f"comments/{root_id}/replies?cursor={root['next_cursor']}")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([r["text"] for r in data["comments"]], ["Reply 2"])
+        self.assertIsNone(data["next_cursor"])
+
+    def test_comment_tree_query_fetches_max_children(self):
+        """Test that the tree query only fetches the first max_children replies of each comment."""
+        with self.app.app_context():
+            db.session.execute(insert(Comment), [{"id": 1, "text": "Root", "user_id": self.user.id}] + [
+                {"id": comment_id, "text": f"Reply {comment_id}", "user_id": self.user.id,
+                 "parent_id": 1 if comment_id <= 50 else 2}
+                for comment_id in range(2, 101)
+            ])
+            db.session.commit()
+
+            for sort in SORT_MODES:
+                rows = db.session.execute(comment_tree_query([1], max_depth=2, sort=sort, max_children=3)).all()
+                parent_ids = [row.parent_id for row in rows]
+                self.assertEqual(parent_ids.count(1), 3, sort)
+                self.assertLessEqual(parent_ids.count(2), 3, sort)
+                self.assertLessEqual(len(rows), 1 + 3 + 3, sort)
+
+            ids = [row.id for row in db.session.execute(comment_tree_query([1], max_children=3)).all()]
+            self.assertEqual(ids, [1, 2, 3, 4, 51, 52, 53])
+
+    def _page_through(self, url):
+        """Follow the next_cursor of a paginated endpoint and return the comment texts of every page."""
+        texts, cursor = [], None
+        while True:
+            response = self.client.get(url + (f"&cursor={cursor}" if cursor else ""))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            texts.append([c["text"] for c in data["comments"]])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return texts
+
+    def test_get_comments_sort_modes(self):
+        """Test that every sort mode orders root comments and replies and pages with its own cursor."""
+        with self.app.app_context():
+            roots = [Comment(text=f"Root {index}", user_id=self.user.id) for index in range(3)]
+            for root in roots:
+                db.session.add(root)
+                db.session.commit()
+            # Root 1 gets two replies, then Root 0 one, so Root 0 has the latest activity
+            for index, root in ((0, roots[1]), (1, roots[1]), (2, roots[0])):
+                db.session.add(Comment(text=f"Reply {index}", user_id=self.user.id, parent_id=root.id))
+                db.session.commit()
+
+        expected = {
+            "oldest": ["Root 0", "Root 1", "Root 2"],
+            "newest": ["Root 2", "Root 1", "Root 0"],
+            "replies": ["Root 1", "Root 0", "Root 2"],
+            "activity": ["Root 0", "Root 1", "Root 2"],
+        }
+        for sort, texts in expected.items():
+            with self.subTest(sort=sort):
+                pages = self._page_through(f"comments/list?sort={sort}&limit=1&max_depth=0")
+                self.assertEqual(pages, [[text] for text in texts])
+
+        # replies are sorted too, ties on reply_count going to the newest
+        busiest = json.loads(self.client.get("comments/list?sort=replies&limit=1&max_children=1").data)["comments"][0]
+        self.assertEqual([r["text"] for r in busiest["replies"]], ["Reply 1"])
+
+        pages = self._page_through(f"comments/{busiest['id']}/replies?sort=replies&limit=1&cursor={busiest['next_cursor']}")
+        self.assertEqual(pages, [["Reply 0"]])
+
+    def test_get_comments_activity_sort_of_core_inserts(self):
+        """Test that roots inserted outside the ORM get an activity time and page by activity."""
+        posted_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        with self.app.app_context():
+            db.session.execute(insert(Comment.__table__), [
+                {"text": f"Root {index}", "user_id": self.user.id, "posted_at": posted_at + timedelta(minutes=index)}
+                for index in range(3)
+            ])
+            db.session.commit()
+            self.assertEqual(db.session.query(Comment).filter(Comment.last_activity_at.is_(None)).count(), 0)
+
+        pages = self._page_through("comments/list?sort=activity&limit=1&max_depth=0")
+        self.assertEqual(pages, [["Root 2"], ["Root 1"], ["Root 0"]])
+
+    def test_get_comments_invalid_sort(self):
+        """Test that an unknown sort mode or a cursor of another sort mode is rejected."""
+        response = self.client.get("comments/list?sort=random")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("sort", json.loads(response.data)["errors"])
+
+        self._create_reply_chain(0)
+        self._create_reply_chain(0)
+        cursor = json.loads(self.client.get("comments/list?sort=replies&limit=1").data)["next_cursor"]
+        response = self.client.get(f"comments/list?sort=oldest&cursor={cursor}")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cursor", json.loads(response.data)["errors"])
+
+    def test_comment_reads_use_username_snapshot(self):
+        """Test that the tree, page and change feed reads take the username from the comment rows."""
+        self._create_reply_chain(2)
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.client.post("comments/bulk", headers=headers, json=[{"text": "Bulk comment", "user_id": self.user.id}])
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                page = json.loads(self.client.get("comments/list?limit=5").data)
+                changes = json.loads(self.client.get("comments/changes?since=0").data)
+                trees = get_comments_tree()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+        self.assertEqual({c["username"] for c in page["comments"]}, {"testuser"})
+        self.assertEqual(page["comments"][0]["replies"][0]["username"], "testuser")
+        self.assertEqual({c["comment"]["username"] for c in changes["changes"]}, {"testuser"})
+        self.assertEqual(trees[0]["replies"][0]["replies"][0]["username"], "testuser")
+        self.assertFalse([s for s in statements if re.search(r'(FROM|JOIN) "?user\b', s)])
+
+    def test_get_comments_invalid_cursor(self):
+        """Test that a malformed cursor is rejected."""
+        response = self.client.get("comments/list?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertIn("cursor", data["errors"])
+
+    def test_get_comment_replies_not_found(self):
+        """Test fetching the replies of a non-existent comment."""
+        response = self.client.get("comments/999/replies")
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_comment_tree(self):
+        """Test fetching one thread, or one subtree, with paginated and depth limited replies."""
+        self._create_reply_chain(3)
+        self._create_reply_chain(1)
+        with self.app.app_context():
+            root_id = db.session.query(Comment.id).filter_by(parent_id=None).order_by(Comment.id).first().id
+            for index in range(2):
+                db.session.add(Comment(text=f"Sibling {index}", user_id=self.user.id, parent_id=root_id))
+            db.session.commit()
+
+        response, queries = self._count_list_queries(f"comments/{root_id}/tree?limit=2&max_depth=2")
+        self.assertEqual(response.status_code, 200)
+        # the ETag validators, then the comment, the page of replies and their subtrees
+        self.assertEqual(queries, 5)
+        comment = json.loads(response.data)["comment"]
+        self.assertEqual(comment["id"], root_id)
+        self.assertEqual(comment["descendant_count"], 5)
+        self.assertEqual([r["text"] for r in comment["replies"]], ["Reply level 1", "Sibling 0"])
+        self.assertTrue(comment["has_more"])
+        self.assertEqual([r["text"] for r in comment["replies"][0]["replies"]], ["Reply level 2"])
+        self.assertEqual(comment["replies"][0]["replies"][0]["replies"], [])
+        self.assertTrue(comment["replies"][0]["replies"][0]["has_more"])
+
+        response = self.client.get(f"comments/{root_id}/tree?limit=2&cursor={comment['next_cursor']}")
+        comment = json.loads(response.data)["comment"]
+        self.assertEqual([r["text"] for r in comment["replies"]], ["Sibling 1"])
+        self.assertFalse(comment["has_more"])
+        self.assertIsNone(comment["next_cursor"])
+
+        response = self.client.get(f"comments/{root_id}/tree?max_depth=0")
+        comment = json.loads(response.data)["comment"]
+        self.assertEqual(comment["replies"], [])
+        self.assertTrue(comment["has_more"])
+
+    def test_get_comment_tree_not_found(self):
+        """Test fetching the tree of a non-existent comment or with invalid parameters."""
+        response = self.client.get("comments/999/tree")
+        self.assertEqual(response.status_code, 404)
+
+        self._create_reply_chain(0)
+        with self.app.app_context():
+            root_id = db.session.query(Comment.id).scalar()
+        response = self.client.get(f"comments/{root_id}/tree?max_depth=-1")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("max_depth", json.loads(response.data)["errors"])
+
+    def test_get_comment_ancestors(self):
+        """Test fetching the breadcrumb of a comment with one query."""
+        self._create_reply_chain(3)
+        with self.app.app_context():
+            leaf_id = db.session.query(Comment.id).filter_by(text="Reply level 3").scalar()
+            root_id = db.session.query(Comment.id).filter_by(parent_id=None).scalar()
+
+        response, queries = self._count_list_queries(f"comments/{leaf_id}/ancestors")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 3)
+        data = json.loads(response.data)
+        self.assertEqual([a["text"] for a in data["ancestors"]], ["Root comment", "Reply level 1", "Reply level 2"])
+        self.assertEqual(data["ancestors"][0]["parent_id"], None)
+        self.assertFalse(data["has_more"])
+
+        data = json.loads(self.client.get(f"comments/{leaf_id}/ancestors?max_depth=2").data)
+        self.assertEqual([a["text"] for a in data["ancestors"]], ["Reply level 1", "Reply level 2"])
+        self.assertTrue(data["has_more"])
+
+        data = json.loads(self.client.get(f"comments/{root_id}/ancestors").data)
+        self.assertEqual(data, {"ancestors": [], "has_more": False})
+
+        response = self.client.get("comments/999/ancestors")
+        self.assertEqual(response.status_code, 404)
+
+    def test_read_query_budgets(self):
+        """Test the query budget of every comment read, so a query per comment fails here."""
+        self._create_reply_chain(3)
+        self._create_reply_chain(3)
+        with self.app.app_context():
+            root_id = db.session.query(Comment.id).filter_by(parent_id=None).order_by(Comment.id).first().id
+            leaf_id = db.session.query(Comment.id).order_by(Comment.depth.desc(), Comment.id).first().id
+
+        # url -> (queries, executions of one statement)
+        budgets = {
+            "comments/list": (4, 1),
+            "comments/list?limit=10&max_depth=2&max_children=2": (3, 1),
+            "comments/list?stream=ndjson": (2, 1),
+            f"comments/{root_id}/replies?limit=1": (5, 1),
+            # the comment itself and the subtrees of its replies come from the same tree query
+            f"comments/{root_id}/tree?limit=2&max_depth=2": (5, 2),
+            # the path and thread change count of the comment, then the chain
+            f"comments/{leaf_id}/ancestors": (3, 1),
+            "comments/changes?since=0": (1, 1),
+        }
+        for url, (max_queries, max_repeats) in budgets.items():
+            with self.subTest(url=url), assert_max_queries(max_queries, max_repeats):
+                response = self.client.get(url)
+                response.get_data()
+                self.assertEqual(response.status_code, 200)
+
+    def test_create_comment_sets_hierarchy_path(self):
+        """Test that new comments get their materialized path and depth on insert."""
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.client.post("comments/create", json={"text": "Root comment", "user_id": self.user.id}, headers=headers)
+
+        with self.app.app_context():
+            root = db.session.query(Comment).filter_by(text="Root comment").one()
+            self.assertEqual(root.path, format_path_segment(root.id))
+            self.assertEqual(root.depth, 0)
+            root_id, root_path = root.id, root.path
+
+        payload = {"text": "Reply comment", "user_id": self.user.id, "parent_id": root_id}
+        self.client.post("comments/create", json=payload, headers=headers)
+
+        with self.app.app_context():
+            reply = db.session.query(Comment).filter_by(text="Reply comment").one()
+            self.assertEqual(reply.path, f"{root_path}/{format_path_segment(reply.id)}")
+            self.assertEqual(reply.depth, 1)
+
+    def test_rebuild_hierarchy_and_subtree_query(self):
+        """Test rebuilding the hierarchy index and fetching a subtree in display order."""
+        self._create_reply_chain(2)
+        self._create_reply_chain(1)
+
+        with self.app.app_context():
+            expected = dict(db.session.query(Comment.id, Comment.path).all())
+            db.session.query(Comment).update({"path": None, "depth": None})
+            db.session.commit()
+
+            rebuild_hierarchy(db.session)
+            db.session.commit()
+            self.assertEqual(dict(db.session.query(Comment.id, Comment.path).all()), expected)
+
+            root = db.session.query(Comment).filter_by(parent_id=None).order_by(Comment.id).first()
+            subtree = db.session.scalars(subtree_query(root.path)).all()
+            self.assertEqual([c.text for c in subtree], ["Root comment", "Reply level 1", "Reply level 2"])
+            self.assertEqual([c.depth for c in subtree], [0, 1, 2])
+
+    def test_get_comments_matches_schema_output(self):
+        """Test that the list endpoint writes exactly what CommentSchema would dump."""
+        self._create_reply_chain(3)
+        self._create_reply_chain(150)
+
+        response = self.client.get("comments/list")
+        self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            expected = CommentSchema(many=True).dump(get_comments_tree())
+            self.assertEqual(get_comments_tree(fields=COMMENT_LIST_FIELDS), expected)
+
+        self.assertEqual(json.loads(response.data), {"comments": expected})
+
+    def test_get_comments_writes_raw_utf8(self):
+        """Test that the list response writes non-ASCII text as raw UTF-8 without a trailing newline."""
+        with self.app.app_context():
+            db.session.add(Comment(id=1, text="Ça marche — 👍", user_id=self.user.id))
+            db.session.commit()
+
+        response = self.client.get("comments/list")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data,
+            f'{{"comments":[{{"id":1,"replies":[],"text":"Ça marche — 👍","user_id":{self.user.id}}}]}}'.encode(),
+        )
+
+    def test_get_comments_deep_chain(self):
+        """Test that a reply chain far deeper than the recursion limit is listed in full."""
+        depth = 50000
+        with self.app.app_context():
+            db.session.execute(insert(Comment), [
+                {"id": comment_id, "text": f"Reply {comment_id}", "user_id": self.user.id,
+                 "parent_id": comment_id - 1 if comment_id > 1 else None}
+                for comment_id in range(1, depth + 1)
+            ])
+            db.session.commit()
+
+        # built flat, json.loads would itself recurse on the response
+        opening = "".join(f'{{"id":{comment_id},"replies":[' for comment_id in range(1, depth + 1))
+        closing = "".join(
+            f'],"text":"Reply {comment_id}","user_id":{self.user.id}}}' for comment_id in range(depth, 0, -1)
+        )
+        expected = f'{{"comments":[{opening}{closing}]}}'.encode()
+
+        response = self.client.get("comments/list")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, expected)
+
+        response = self.client.get("comments/list?stream=ndjson")
+        self.assertEqual(response.data, f"{opening}{closing}\n".encode())
+
+    def test_dumps_deep_falls_back_when_orjson_refuses(self):
+        """Test that a subtree under the depth limit that orjson still refuses is written by hand."""
+        depth = 1000
+        payload = {"replies": []}
+        for comment_id in range(depth, 0, -1):
+            payload = {"id": comment_id, "replies": [payload]}
+
+        expected = "".join(f'{{"id":{comment_id},"replies":[' for comment_id in range(1, depth + 1))
+        expected += '{"replies":[]}' + "]}" * depth
+
+        with mock.patch.object(serializers, "ORJSON_MAX_DEPTH", depth * 4):
+            self.assertEqual(serializers.dumps_deep(payload), expected.encode())
+
+    def test_get_comments_streamed(self):
+        """Test that streamed comment lists contain the same trees as the regular list."""
+        self._create_reply_chain(2)
+        self._create_reply_chain(3)
+        expected = json.loads(self.client.get("comments/list").data)
+
+        response = self.client.get("comments/list?stream=json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(json.loads(response.data), expected)
+
+        response = self.client.get("comments/list?stream=ndjson")
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.data.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected["comments"])
+
+    def test_get_comments_invalid_stream_format(self):
+        """Test that unknown stream formats are rejected."""
+        response = self.client.get("comments/list?stream=xml")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("stream", json.loads(response.data)["errors"])
+
+    def test_get_comments_not_modified(self):
+        """Test that a matching If-None-Match is answered with 304 without loading the tree."""
+        self._create_reply_chain(2)
+
+        response = self.client.get("comments/list")
+        etag = response.headers["ETag"]
+        self.assertEqual(response.status_code, 200)
+
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                response = self.client.get("comments/list", headers={"If-None-Match": etag})
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(len(statements), 1)
+
+        paged = self.client.get("comments/list?limit=1", headers={"If-None-Match": etag})
+        self.assertEqual(paged.status_code, 200)
+
+        self._create_reply_chain(0)
+        response = self.client.get("comments/list", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_get_comment_replies_not_modified(self):
+        """Test conditional requests on the replies of one thread."""
+        self._create_reply_chain(2)
+        with self.app.app_context():
+            root_id = db.session.query(Comment.id).filter_by(parent_id=None).scalar()
+
+        response = self.client.get(f"comments/{root_id}/replies")
+        etag = response.headers["ETag"]
+
+        response = self.client.get(f"comments/{root_id}/replies", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self._create_reply_chain(0)
+        response = self.client.get(f"comments/{root_id}/replies", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_comment_ancestors_not_modified(self):
+        """Test conditional requests on the ancestors of a comment, invalidated by a reply in its thread."""
+        self._create_reply_chain(2)
+        self._create_reply_chain(0)
+        with self.app.app_context():
+            root_id, other_root_id = [
+                row.id for row in db.session.query(Comment.id).filter_by(parent_id=None).order_by(Comment.id)
+            ]
+            leaf_id = db.session.query(Comment.id).filter_by(text="Reply level 2").scalar()
+
+        response = self.client.get(f"comments/{leaf_id}/ancestors")
+        etag = response.headers["ETag"]
+
+        response = self.client.get(f"comments/{leaf_id}/ancestors", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        payload = {"text": "Other thread reply", "user_id": self.user.id, "parent_id": other_root_id}
+        self.client.post("comments/create", json=payload, headers=headers)
+        response = self.client.get(f"comments/{leaf_id}/ancestors", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # a reply to the root moves the counters of the first ancestor
+        payload = {"text": "Sibling reply", "user_id": self.user.id, "parent_id": root_id}
+        self.client.post("comments/create", json=payload, headers=headers)
+        response = self.client.get(f"comments/{leaf_id}/ancestors", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["ancestors"][0]["reply_count"], 2)
+
+    def test_comment_changes_feed(self):
+        """Test that the change feed reports creations and deletions after a cursor."""
+        response = self.client.get("comments/changes")
+        self.assertEqual(json.loads(response.data)["next_since"], 0)
+
+        self._create_reply_chain(1)
+        response = self.client.get("comments/changes?since=0")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([c["op"] for c in data["changes"]], ["created", "created"])
+        self.assertEqual(data["changes"][1]["comment"]["text"], "Reply level 1")
+        since = data["next_since"]
+
+        with self.app.app_context():
+            reply_id = db.session.query(Comment.id).filter_by(text="Reply level 1").scalar()
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.client.delete(f"comments/delete/{reply_id}", headers=headers)
+
+        data = json.loads(self.client.get(f"comments/changes?since={since}").data)
+        self.assertEqual(len(data["changes"]), 1)
+        self.assertEqual(data["changes"][0]["op"], "deleted")
+        self.assertEqual(data["changes"][0]["comment_id"], reply_id)
+        self.assertIsNone(data["changes"][0]["comment"])
+        self.assertEqual(data["next_since"], since + 1)
+
+    def test_comment_changes_feed_after_delete_then_create(self):
+        """Test that a deleted comment's id isn't reused nor lends a later row to its changes."""
+        self._create_reply_chain(0)
+        deleted_id = self._comment_ids()[0]
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        self.client.delete(f"comments/delete/{deleted_id}?mode=cascade", headers=headers)
+
+        self._create_reply_chain(0)
+        self.assertNotEqual(self._comment_ids(), [deleted_id])
+
+        # a row given the old id explicitly, as the import does
+        with self.app.app_context():
+            db.session.execute(insert(Comment), [{"id": deleted_id, "text": "Reused id", "user_id": self.user.id}])
+            db.session.commit()
+
+        changes = json.loads(self.client.get("comments/changes?since=0").data)["changes"]
+        self.assertEqual([(c["op"], c["comment_id"]) for c in changes[:2]], [("created", deleted_id), ("deleted", deleted_id)])
+        self.assertEqual([c["comment"] for c in changes[:2]], [None, None])
+        self.assertEqual(changes[2]["comment"]["text"], "Root comment")
+
+    def test_comment_changes_feed_waits_for_recent_gaps(self):
+        """Test that the feed stops before a seq hole that an open transaction may still fill."""
+        self._create_reply_chain(0)
+
+        with self.app.app_context():
+            db.session.add(CommentChange(seq=3, comment_id=42, op="deleted"))
+            db.session.commit()
+
+        data = json.loads(self.client.get("comments/changes?since=0").data)
+        self.assertEqual([c["seq"] for c in data["changes"]], [1])
+        self.assertEqual(data["next_since"], 1)
+
+        with self.app.app_context():
+            change = db.session.get(CommentChange, 3)
+            change.changed_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+            db.session.commit()
+
+        data = json.loads(self.client.get("comments/changes?since=1").data)
+        self.assertEqual([c["seq"] for c in data["changes"]], [3])
+
+    def test_get_comments_last_modified(self):
+        """Test that the list sends Last-Modified and honours If-Modified-Since."""
+        self._create_reply_chain(0)
+
+        response = self.client.get("comments/list")
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get("comments/list", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_get_comments_etag_sees_late_commits(self):
+        """Test that a change committed after a higher seq still changes the list ETag."""
+        self._create_reply_chain(0)
+
+        with self.app.app_context():
+            db.session.add(CommentChange(seq=3, comment_id=42, op="deleted"))
+            db.session.commit()
+
+        response = self.client.get("comments/list")
+        etag = response.headers["ETag"]
+        self.assertNotIn("Last-Modified", response.headers)
+
+        # the transaction holding seq 2 commits last, the latest seq stays 3
+        with self.app.app_context():
+            db.session.add(CommentChange(seq=2, comment_id=43, op="deleted"))
+            db.session.commit()
+
+        response = self.client.get("comments/list", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertIn("Last-Modified", response.headers)
+
+    def test_bulk_create_comments(self):
+        """Test creating a thread in one bulk request with temporary parent ids."""
+        self._create_reply_chain(0)
+        with self.app.app_context():
+            root_id = db.session.query(Comment.id).scalar()
+
+        payload = [
+            {"text": "Bulk root", "user_id": self.user.id, "temp_id": "a"},
+            {"text": "Bulk reply", "user_id": self.user.id, "parent_temp_id": "a", "temp_id": "b"},
+            {"text": "Bulk nested reply", "user_id": self.user.id, "parent_temp_id": "b"},
+            {"text": "Reply to existing", "user_id": self.user.id, "parent_id": root_id},
+        ]
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        response = self.client.post("comments/bulk", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data["created"], 4)
+        self.assertEqual(data["errors"], [])
+        bulk_root, bulk_reply, nested_reply, existing_reply = data["ids"]
+
+        with self.app.app_context():
+            nested = db.session.get(Comment, nested_reply)
+            self.assertEqual(nested.parent_id, bulk_reply)
+            self.assertEqual(nested.depth, 2)
+            self.assertEqual(nested.path, "/".join(map(format_path_segment, data["ids"][:3])))
+            self.assertEqual(db.session.get(Comment, existing_reply).parent_id, root_id)
+            self.assertEqual(db.session.query(CommentChange).count(), 5)
+
+        comments = json.loads(self.client.get("comments/list").data)["comments"]
+        self.assertEqual(comments[0]["replies"][0]["id"], existing_reply)
+        self.assertEqual(comments[1]["replies"][0]["replies"][0]["id"], nested_reply)
+
+    def test_bulk_create_comments_reports_item_errors(self):
+        """Test that invalid comments of a bulk request are reported and skipped."""
+        payload = [
+            {"text": "No", "user_id": self.user.id, "temp_id": "short"},
+            {"text": "Reply to invalid", "user_id": self.user.id, "parent_temp_id": "short"},
+            {"text": "Someone else", "user_id": self.user.id + 1},
+            {"text": "Missing parent", "user_id": self.user.id, "parent_id": 999},
+            {"text": "Unknown temp parent", "user_id": self.user.id, "parent_temp_id": "nope"},
+            {"text": "Valid comment", "user_id": self.user.id},
+        ]
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        response = self.client.post("comments/bulk", json=payload, headers=headers)
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data)
+        self.assertEqual(data["created"], 1)
+        self.assertEqual([error["index"] for error in data["errors"]], [0, 1, 2, 3, 4])
+        self.assertEqual(data["errors"][0]["temp_id"], "short")
+        self.assertIn("parent_temp_id", data["errors"][1]["errors"])
+        self.assertIn("user_id", data["errors"][2]["errors"])
+        self.assertEqual(data["errors"][3]["errors"], {"parent_id": ["Parent comment doesn't exist"]})
+        self.assertEqual(data["ids"][:5], [None] * 5)
+
+        response = self.client.post("comments/bulk", json={"text": "Not a list"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_comments_ndjson_chunks(self):
+        """Test an NDJSON bulk request whose replies point to comments of earlier chunks."""
+        self.app.config["COMMENTS_BULK_CHUNK_SIZE"] = 2
+        lines = [json.dumps({"text": "Streamed root", "user_id": self.user.id, "temp_id": 1}), "not json", ""]
+        lines += [
+            json.dumps({"text": f"Streamed reply {i}", "user_id": self.user.id, "parent_temp_id": 1})
+            for i in range(5)
+        ]
+        with self.app.app_context():
+            access_token = create_access_token(identity=self.user.id, additional_claims={"username": "testuser"})
+        headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/x-ndjson"}
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                response = self.client.post("comments/bulk", data="\n".join(lines), headers=headers)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data)
+        self.assertEqual(data["created"], 6)
+        self.assertEqual(data["errors"], [{"index": 1, "errors": {"_schema": ["Invalid input type."]}}])
+        # the username comes from the token, then per chunk at most a parent lookup and comment, path, counter,
+        # change and thread writes
+        self.assertLessEqual(len(statements), 6 * 4)
+        self.assertFalse([statement for statement in statements if "FROM user" in statement])
+
+        comments = json.loads(self.client.get("comments/list").data)["comments"]
+        self.assertEqual(len(comments), 1)
+        self.assertEqual(len(comments[0]["replies"]), 5)
+
+    def _comment_ids(self):
+        """Return the ids of the comments in the database, by posting order."""
+        with self.app.app_context():
+            return [row.id for row in db.session.query(Comment.id).order_by(Comment.id)]
+
+    def test_delete_comment_with_replies_soft_deletes(self):
+        """Test that deleting a comment with replies keeps them under a placeholder."""
+        self._create_reply_chain(2)
+        root_id, reply_id, _ = self._comment_ids()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        since = json.loads(self.client.get("comments/changes").data)["next_since"]
+
+        response = self.client.delete(f"comments/delete/{reply_id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._comment_ids(), [root_id, reply_id, reply_id + 1])
+
+        root = json.loads(self.client.get("comments/list").data)["comments"][0]
+        reply = root["replies"][0]
+        self.assertEqual((reply["id"], reply["text"], reply["user_id"]), (reply_id, "[deleted]", None))
+        self.assertEqual(reply["replies"][0]["text"], "Reply level 2")
+
+        change = json.loads(self.client.get(f"comments/changes?since={since}").data)["changes"][0]
+        self.assertEqual(change["op"], "updated")
+        self.assertEqual(change["comment"]["text"], "[deleted]")
+        self.assertIsNone(change["comment"]["username"])
+
+    def test_soft_delete_comment_without_path(self):
+        """Test that soft deleting a comment without a path records its change without a thread."""
+        self._create_reply_chain(1)
+        root_id, reply_id = self._comment_ids()
+
+        with self.app.app_context():
+            db.session.query(Comment).update({Comment.path: None, Comment.depth: None})
+            db.session.commit()
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        since = json.loads(self.client.get("comments/changes").data)["next_since"]
+
+        response = self.client.delete(f"comments/delete/{root_id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._comment_ids(), [root_id, reply_id])
+
+        with self.app.app_context():
+            change = db.session.query(CommentChange).filter(CommentChange.seq > since).one()
+            self.assertEqual((change.op, change.comment_id, change.root_id), ("updated", root_id, None))
+
+    def test_delete_comment_cascade(self):
+        """Test that a cascade delete removes the subtree with a fixed number of queries."""
+        self._create_reply_chain(0)
+        self._create_reply_chain(20)
+        other_root_id, root_id, *reply_ids = self._comment_ids()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        since = json.loads(self.client.get("comments/changes").data)["next_since"]
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+            try:
+                response = self.client.delete(f"comments/delete/{reply_ids[0]}?mode=cascade", headers=headers)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_query)
+
+        self.assertEqual(response.status_code, 200)
+        # comment lookup, tombstones guarded by the other authors check, thread count, delete and ancestor counters
+        self.assertEqual(len(statements), 5)
+        self.assertEqual(self._comment_ids(), [other_root_id, root_id])
+
+        data = json.loads(self.client.get(f"comments/changes?since={since}").data)
+        self.assertEqual([(c["op"], c["comment_id"]) for c in data["changes"]], [("deleted", i) for i in reply_ids])
+
+        comments = json.loads(self.client.get("comments/list").data)["comments"]
+        self.assertEqual([(c["id"], c["replies"]) for c in comments], [(other_root_id, []), (root_id, [])])
+
+    def test_delete_comment_cascade_refuses_other_authors(self):
+        """Test that a cascade delete is refused when other users replied in the subtree."""
+        self._create_reply_chain(2)
+        root_id, reply_id, nested_id = self._comment_ids()
+
+        with self.app.app_context():
+            other_user = User(username="otheruser", email="other@example.com", password="password456")
+            db.session.add(other_user)
+            db.session.commit()
+            db.session.get(Comment, nested_id).user_id = other_user.id
+            db.session.commit()
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.delete(f"comments/delete/{root_id}?mode=cascade", headers=headers)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self._comment_ids(), [root_id, reply_id, nested_id])
+
+        # the default mode keeps the other user's reply under a placeholder
+        response = self.client.delete(f"comments/delete/{reply_id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._comment_ids(), [root_id, reply_id, nested_id])
+
+    def test_delete_comment_cascade_refuses_concurrent_replies(self):
+        """Test that a reply of another user committed right before a cascade delete is never deleted."""
+        self._create_reply_chain(1)
+        root_id, reply_id = self._comment_ids()
+
+        with self.app.app_context():
+            other_user = User(username="otheruser", email="other@example.com", password="password456")
+            db.session.add(other_user)
+            db.session.commit()
+            other_user_id = other_user.id
+
+        filter_subtree = deletion.subtree_filter
+
+        def reply_then_filter(comment_id, path):
+            # committed by another session once the view has checked the comment
+            with Session(db.engine) as session:
+                session.add(Comment(text="Concurrent reply", user_id=other_user_id, parent_id=comment_id))
+                session.commit()
+            return filter_subtree(comment_id, path)
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        with mock.patch.object(deletion, "subtree_filter", side_effect=reply_then_filter):
+            response = self.client.delete(f"comments/delete/{root_id}?mode=cascade", headers=headers)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self._comment_ids()), 3)
+
+        # a leaf in the default mode is soft deleted instead
+        with mock.patch.object(deletion, "subtree_filter", side_effect=reply_then_filter):
+            response = self.client.delete(f"comments/delete/{reply_id}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self._comment_ids()), 4)
+        with self.app.app_context():
+            self.assertIsNotNone(db.session.get(Comment, reply_id).deleted_at)
+
+    def test_delete_comment_cascade_without_path(self):
+        """Test that a cascade delete falls back to parent links for comments without a path."""
+        self._create_reply_chain(3)
+        root_id = self._comment_ids()[0]
+
+        with self.app.app_context():
+            db.session.query(Comment).update({Comment.path: None, Comment.depth: None})
+            db.session.commit()
+
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        response = self.client.delete(f"comments/delete/{root_id}?mode=cascade", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._comment_ids(), [])
+
+    def _counters(self, comment_id):
+        """Return the reply count, descendant count and last activity of a comment."""
+        with self.app.app_context():
+            comment = db.session.get(Comment, comment_id)
+            return comment.reply_count, comment.descendant_count, comment.last_activity_at
+
+    def test_comment_counters_follow_inserts_and_deletes(self):
+        """Test that the ancestors' counters are kept up to date by create, bulk create and delete."""
+        self._create_reply_chain(2)
+        root_id, reply_id, nested_id = self._comment_ids()
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        with self.app.app_context():
+            nested_posted_at = db.session.get(Comment, nested_id).posted_at
+        self.assertEqual(self._counters(root_id), (1, 2, nested_posted_at))
+        self.assertEqual(self._counters(reply_id), (1, 1, nested_posted_at))
+        self.assertEqual(self._counters(nested_id), (0, 0, nested_posted_at))
+
+        response = self.client.post("comments/bulk", headers=headers, json=[
+            {"text": "Bulk reply", "user_id": self.user.id, "parent_id": root_id, "temp_id": "a"},
+            {"text": "Bulk nested", "user_id": self.user.id, "parent_temp_id": "a"},
+        ])
+        bulk_reply_id, bulk_nested_id = json.loads(response.data)["ids"]
+        self.assertEqual(self._counters(root_id)[:2], (2, 4))
+        self.assertEqual(self._counters(bulk_reply_id)[:2], (1, 1))
+        self.assertEqual(self._counters(root_id)[2], self._counters(bulk_nested_id)[2])
+
+        self.client.delete(f"comments/delete/{reply_id}?mode=cascade", headers=headers)
+        self.assertEqual(self._counters(root_id)[:2], (1, 2))
+
+        page = json.loads(self.client.get("comments/list?max_depth=0").data)["comments"][0]
+        self.assertEqual((page["reply_count"], page["descendant_count"]), (1, 2))
+        self.assertEqual(page["replies"], [])
+        self.assertTrue(page["has_more"])
+
+    def test_delete_comment_invalid_mode(self):
+        """Test that an unknown delete mode is rejected."""
+        self._create_reply_chain(0)
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+
+        response = self.client.delete(f"comments/delete/{self._comment_ids()[0]}?mode=purge", headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("mode", json.loads(response.data)["errors"])
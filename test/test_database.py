@@ -0,0 +1,134 @@
+import unittest
+import json
+import os
+import tempfile
+from app import create_app
+from app.database import db, REPLICA
+from app.models.users import User
+from app.models.comments import Comment
+from app.models.comment_changes import CommentChange, CommentThread
+from config import Config
+from flask_jwt_extended import create_access_token
+from sqlalchemy import delete, insert, select, text
+from werkzeug.security import generate_password_hash
+
+
+class TestDatabaseConfig(unittest.TestCase):
+    def setUp(self):
+        """Set up the Flask app."""
+        self.app = create_app()
+
+    def tearDown(self):
+        """Tear down the database."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_sqlite_pragmas(self):
+        """Test that new SQLite connections get the configured pragmas."""
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+            # NORMAL
+            self.assertEqual(db.session.execute(text("PRAGMA synchronous")).scalar(), 1)
+            self.assertEqual(db.session.execute(text("PRAGMA busy_timeout")).scalar(), 5000)
+            self.assertEqual(db.session.execute(text("PRAGMA foreign_keys")).scalar(), 1)
+
+    def test_engine_options(self):
+        """Test that the pool settings of the config reach the engine."""
+        with self.app.app_context():
+            self.assertEqual(db.engine.pool.size(), self.app.config["DATABASE_POOL_SIZE"])
+            self.assertTrue(db.engine.pool._pre_ping)
+            self.assertNotIn(REPLICA, db.engines)
+
+
+class TestReplicaRouting(unittest.TestCase):
+    def setUp(self):
+        """Set up an app with a primary and a replica SQLite file, a user in both, with
+        another password on the replica, and a comment only on the replica."""
+        self.directory = tempfile.TemporaryDirectory()
+
+        class ReplicaConfig(Config):
+            SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(self.directory.name, "primary.db")
+            DATABASE_REPLICA_URI = "sqlite:///" + os.path.join(self.directory.name, "replica.db")
+
+        self.app = create_app(ReplicaConfig)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.engines[REPLICA])
+
+            user = {"id": 1, "username": "testuser", "email": "test@example.com",
+                    "password": generate_password_hash("Password@123")}
+            with db.engine.begin() as connection:
+                connection.execute(insert(User), [user])
+            with db.engines[REPLICA].begin() as connection:
+                connection.execute(insert(User), [{**user, "password": generate_password_hash("Replica@123")}])
+                connection.execute(insert(Comment), [{"text": "Replicated comment", "user_id": 1}])
+
+            self.access_token = create_access_token(identity=1, additional_claims={"username": "testuser"})
+
+    def tearDown(self):
+        """Tear down both databases."""
+        with self.app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+        # db is shared by the apps of all tests and keeps a metadata per bind key it saw
+        db.metadatas.pop(REPLICA, None)
+        self.directory.cleanup()
+
+    def test_reads_go_to_replica(self):
+        """Test that the comment reads and the login lookup query the replica."""
+        response = self.client.get("/comments/list")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c["text"] for c in response.json["comments"]], ["Replicated comment"])
+
+        response = self.client.get("/comments/1/tree")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(
+            "/users/login", data=json.dumps({"username": "testuser", "password": "Replica@123"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_go_to_primary(self):
+        """Test that a new comment is written to the primary database only."""
+        response = self.client.post(
+            "/comments/create", data=json.dumps({"text": "New comment", "user_id": 1}),
+            content_type="application/json", headers={"Authorization": f"Bearer {self.access_token}"},
+        )
+        self.assertEqual(response.status_code, 201)
+
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(select(Comment.text)).scalars().all(), ["New comment"])
+            with db.engines[REPLICA].connect() as connection:
+                self.assertEqual(connection.execute(select(Comment.text)).scalars().all(), ["Replicated comment"])
+
+
+    def test_lagging_replica_is_not_cached_as_current(self):
+        """Test that a list rendered from a lagging replica is replaced once it catches up."""
+        self.assertEqual([c["text"] for c in self.client.get("/comments/list").json["comments"]], ["Replicated comment"])
+
+        response = self.client.post(
+            "/comments/create", data=json.dumps({"text": "New comment", "user_id": 1}),
+            content_type="application/json", headers={"Authorization": f"Bearer {self.access_token}"},
+        )
+        self.assertEqual(response.status_code, 201)
+
+        # the replica hasn't applied the write yet
+        self.assertEqual([c["text"] for c in self.client.get("/comments/list").json["comments"]], ["Replicated comment"])
+
+        with self.app.app_context():
+            with db.engine.connect() as primary, db.engines[REPLICA].begin() as replica:
+                for model in (Comment, CommentChange, CommentThread):
+                    replica.execute(delete(model))
+                    replica.execute(insert(model), [row._asdict() for row in primary.execute(select(model.__table__))])
+
+        self.assertEqual([c["text"] for c in self.client.get("/comments/list").json["comments"]], ["New comment"])
+
+if __name__ == "__main__":
+    unittest.main()
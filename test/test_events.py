@@ -0,0 +1,156 @@
+import unittest
+import json
+import threading
+import time
+from app import create_app
+from app.database import db
+from app.models.users import User
+from app.models.comments import Comment
+from app.models.comment_changes import CommentChange
+from config import Config
+from werkzeug.security import generate_password_hash
+
+
+class PollingConfig(Config):
+    COMMENTS_EVENTS_BACKEND = "poll"
+    COMMENTS_EVENTS_POLL_INTERVAL = 0.05
+
+
+class TestCommentEvents(unittest.TestCase):
+    config_class = Config
+
+    def setUp(self):
+        """Set up the Flask test client, the database and two comments."""
+        self.app = create_app(self.config_class)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            hashed_password = generate_password_hash("Password@123")
+            user = User(username="testuser", email="test@example.com", password=hashed_password)
+            db.session.add(user)
+            db.session.commit()
+
+            self.user_id = user.id
+            for text in ("First comment", "Second comment"):
+                db.session.add(Comment(text=text, user_id=self.user_id))
+                db.session.commit()
+
+    def tearDown(self):
+        """Tear down the database."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _read_events(self, url, headers=None):
+        """Read a server-sent events stream and return its events as (id, event, data) tuples."""
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+
+        return self._parse_events(response.get_data(as_text=True))
+
+    def _parse_events(self, data):
+        """Parse server-sent events into (id, event, data) tuples."""
+        events = []
+        for block in data.split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if "id" in fields:
+                events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+        return events
+
+    def _add_comment_later(self, text, delay=0.2, after=None):
+        """Commit a comment from another thread after a delay, or once the after event is set."""
+        def add_comment():
+            if after is None:
+                time.sleep(delay)
+            else:
+                after.wait()
+            with self.app.app_context():
+                db.session.add(Comment(text=text, user_id=self.user_id))
+                db.session.commit()
+
+        thread = threading.Thread(target=add_comment)
+        thread.start()
+        return thread
+
+    def test_stream_events_since(self):
+        """Test streaming the changes after a seq as server-sent events."""
+        events = self._read_events("comments/events?since=0&timeout=0")
+
+        self.assertEqual([(seq, op) for seq, op, _ in events], [(1, "created"), (2, "created")])
+        self.assertEqual(events[1][2]["comment"]["text"], "Second comment")
+
+    def test_stream_resumes_after_last_event_id(self):
+        """Test that a reconnecting client only receives the events after its Last-Event-ID."""
+        events = self._read_events("comments/events?timeout=0", headers={"Last-Event-ID": "1"})
+        self.assertEqual([seq for seq, _, _ in events], [2])
+
+        response = self.client.get("comments/events", headers={"Last-Event-ID": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stream_pushes_new_comments(self):
+        """Test that an open stream receives a comment committed while it waits."""
+        stream_open = threading.Event()
+        thread = self._add_comment_later("Pushed comment", after=stream_open)
+        response = self.client.get("comments/events?timeout=30")
+        chunks = iter(response.response)
+
+        # the stream starts after the latest change once it sends its retry line
+        self.assertEqual(next(chunks), b"retry: 1000\n\n")
+        stream_open.set()
+        events = self._parse_events(next(chunks).decode())
+        response.close()
+        thread.join()
+
+        self.assertEqual([(seq, op) for seq, op, _ in events], [(3, "created")])
+        self.assertEqual(events[0][2]["comment"]["text"], "Pushed comment")
+
+    def test_long_poll_returns_on_commit(self):
+        """Test that a long-poll request returns as soon as a change is committed."""
+        thread = self._add_comment_later("Long polled comment")
+        started = time.monotonic()
+        response = self.client.get("comments/changes?since=2&wait=10")
+        thread.join()
+
+        self.assertLess(time.monotonic() - started, 5)
+        data = json.loads(response.data)
+        self.assertEqual([change["seq"] for change in data["changes"]], [3])
+        self.assertEqual(data["next_since"], 3)
+
+    def test_long_poll_timeout(self):
+        """Test that a long-poll request without changes returns empty after wait seconds."""
+        response = self.client.get("comments/changes?since=2&wait=0.1")
+        data = json.loads(response.data)
+
+        self.assertEqual(data["changes"], [])
+        self.assertEqual(data["next_since"], 2)
+
+
+class TestPollingCommentEvents(TestCommentEvents):
+    config_class = PollingConfig
+
+    def test_long_poll_sees_other_processes(self):
+        """Test that the polling broker picks up changes committed without the session events."""
+        def record_change():
+            time.sleep(0.2)
+            with self.app.app_context(), db.engine.begin() as connection:
+                comment_id = connection.execute(
+                    Comment.__table__.insert().values(text="Foreign comment", user_id=self.user_id)
+                ).inserted_primary_key[0]
+                connection.execute(
+                    CommentChange.__table__.insert().values(comment_id=comment_id, op="created")
+                )
+
+        thread = threading.Thread(target=record_change)
+        thread.start()
+        response = self.client.get("comments/changes?since=2&wait=10")
+        thread.join()
+
+        data = json.loads(response.data)
+        self.assertEqual([change["comment"]["text"] for change in data["changes"]], ["Foreign comment"])
+
+
+if __name__ == "__main__":
+    unittest.main()
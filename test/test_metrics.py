@@ -0,0 +1,106 @@
+import unittest
+import re
+from app import create_app
+from app.database import db
+from app.metrics import before_cursor_execute
+from app.models.users import User
+from app.models.comments import Comment
+from config import Config
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+
+class MetricsConfig(Config):
+    METRICS_ENABLED = True
+    SERVER_TIMING_ENABLED = True
+
+
+class TestRequestMetrics(unittest.TestCase):
+    config_class = MetricsConfig
+
+    def setUp(self):
+        """Set up the Flask test client, the database and a short thread."""
+        self.app = create_app(self.config_class)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+            user = User(username="testuser", email="test@example.com", password=generate_password_hash("x"))
+            db.session.add(user)
+            db.session.commit()
+
+            root = Comment(text="Root comment", user_id=user.id)
+            db.session.add(root)
+            db.session.commit()
+            db.session.add(Comment(text="Reply comment", user_id=user.id, parent_id=root.id))
+            db.session.commit()
+
+    def tearDown(self):
+        """Tear down the database."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def _count_queries(self, url):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                response = self.client.get(url)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+
+        return response, len(statements)
+
+    def test_server_timing_header(self):
+        """Test that the Server-Timing header reports the queries and stage durations."""
+        response, queries = self._count_queries("/comments/list?limit=10")
+        self.assertEqual(response.status_code, 200)
+
+        server_timing = response.headers["Server-Timing"]
+        self.assertIn('sql;dur=', server_timing)
+        self.assertIn(f'desc="{queries} queries"', server_timing)
+        for stage in ("tree", "serialize", "total"):
+            self.assertRegex(server_timing, rf"{stage};dur=\d+\.\d+")
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics serves per endpoint latency histograms and query counts."""
+        for _ in range(3):
+            self.client.get("/comments/list")
+        self.client.get("/comments/999/tree")
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+
+        text = response.get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="comments.get_comments",method="GET"} 3', text
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{endpoint="comments.get_comments",method="GET",le="+Inf"} 3', text
+        )
+        self.assertIn('http_requests_total{endpoint="comments.get_comment_tree",method="GET",status="404"} 1', text)
+        queries = re.search(r'db_queries_total\{endpoint="comments.get_comments"\} (\d+)', text)
+        self.assertGreater(int(queries.group(1)), 0)
+        self.assertIn('request_stage_seconds_total{endpoint="comments.get_comments",stage="tree"}', text)
+
+    def test_disabled_by_default(self):
+        """Test that without the settings nothing is instrumented."""
+        app = create_app()
+
+        with app.app_context():
+            self.assertFalse(event.contains(db.engine, "before_cursor_execute", before_cursor_execute))
+
+        client = app.test_client()
+        self.assertNotIn("Server-Timing", client.get("/comments/list").headers)
+        self.assertEqual(client.get("/metrics").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
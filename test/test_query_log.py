@@ -0,0 +1,84 @@
+import unittest
+from app import create_app
+from app.database import db
+from app.models.comments import Comment
+from app.query_log import assert_max_queries, normalize_statement
+from config import Config
+from sqlalchemy import select
+
+
+class QueryLogConfig(Config):
+    QUERY_LOG_ENABLED = True
+    QUERY_LOG_REPEAT_THRESHOLD = 2
+    QUERY_LOG_SLOW_SECONDS = 60
+
+
+class TestQueryLog(unittest.TestCase):
+    config_class = QueryLogConfig
+
+    def setUp(self):
+        """Set up the Flask test client, the database and a view running one query per id."""
+        self.app = create_app(self.config_class)
+
+        @self.app.route("/test/comments")
+        def comments_one_by_one():
+            for comment_id in range(1, 5):
+                db.session.execute(select(Comment.text).where(Comment.id == comment_id)).first()
+            return {}
+
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """Tear down the database."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_normalize_statement(self):
+        """Test that statements differing only by their values are grouped together."""
+        self.assertEqual(
+            normalize_statement("SELECT *\n  FROM comment WHERE id IN (?, ?, ?) AND text = 'it''s' LIMIT 10"),
+            "SELECT * FROM comment WHERE id IN (?) AND text = ? LIMIT ?",
+        )
+        self.assertEqual(
+            normalize_statement("SELECT anon_1.id FROM t1 WHERE id = %(id_1)s OR id = $2"),
+            "SELECT anon_1.id FROM t1 WHERE id = ? OR id = ?",
+        )
+
+    def test_repeated_statement_is_logged(self):
+        """Test that a request running one statement more than the threshold logs a warning with its stack."""
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            self.assertEqual(self.client.get("/test/comments").status_code, 200)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Possible N+1 query in GET /test/comments", logs.output[0])
+        self.assertIn("in comments_one_by_one", logs.output[0])
+
+    def test_slow_statement_is_logged(self):
+        """Test that a statement slower than QUERY_LOG_SLOW_SECONDS logs a warning."""
+        self.app.extensions["query_log"]["slow_seconds"] = 0
+
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            self.client.get("/comments/changes")
+
+        self.assertIn("Slow query in GET /comments/changes", logs.output[0])
+
+    def test_assert_max_queries(self):
+        """Test that the assertion helper fails on too many queries or repeated statements."""
+        with assert_max_queries(4, max_repeats=4):
+            self.client.get("/test/comments")
+
+        with self.assertRaisesRegex(AssertionError, "4 queries executed, 3 allowed"):
+            with assert_max_queries(3):
+                self.client.get("/test/comments")
+
+        with self.assertRaisesRegex(AssertionError, "4 executions of a statement, 1 allowed"):
+            with assert_max_queries(10, max_repeats=1):
+                self.client.get("/test/comments")
+
+
+if __name__ == "__main__":
+    unittest.main()
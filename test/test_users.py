@@ -3,9 +3,12 @@ from flask_jwt_extended import create_refresh_token
 
 import unittest
 import json
+from unittest import mock
 from app import create_app
 from app.database import db
 from app.models.users import User
+from app.passwords import password_hasher
+from config import Config
 from werkzeug.security import generate_password_hash
 
 
@@ -51,6 +54,29 @@ class TestUserRoutes(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn("error", data)
 
+    def test_signup_user_failure_concurrent_signup(self):
+        """Test signup endpoint when the same user is created between the lookup and the insert"""
+        payload = {
+            "username": "raceuser",
+            "email": "race@example.com",
+            "password": "Password@12345"
+        }
+        hash_password = password_hasher.hash
+
+        def hash_after_concurrent_signup(password):
+            with db.engine.begin() as connection:
+                connection.execute(User.__table__.insert().values(
+                    username="raceuser", email="other@example.com", password=generate_password_hash(password)
+                ))
+            return hash_password(password)
+
+        with mock.patch.object(password_hasher, "hash", side_effect=hash_after_concurrent_signup):
+            response = self.client.post("users/signup", json=payload)
+
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertIn("error", data)
+
     def test_login_user_success(self):
         """Test login endpoint with valid credentials"""
         payload = {
@@ -102,3 +128,76 @@ class TestUserRoutes(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn("access_token", data)
 
+    def test_signup_user_failure_existing_email(self):
+        """Test signup endpoint with a new username but a taken email"""
+        payload = {
+            "username": "otheruser",
+            "email": "test@example.com",
+            "password": "Password@12345"
+        }
+        response = self.client.post("users/signup", json=payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.data)["error"], "Username or email already exists")
+
+        with self.app.app_context():
+            self.assertEqual(db.session.query(User).count(), 1)
+
+    def test_login_rehashes_outdated_password(self):
+        """Test that a successful login replaces a hash made with other parameters"""
+        with self.app.app_context():
+            user = db.session.query(User).filter_by(username="testuser").one()
+            user.password = generate_password_hash("Password@12345", "pbkdf2:sha256:1000")
+            db.session.commit()
+
+        payload = {"username": "testuser", "password": "Password@12345"}
+        response = self.client.post("users/login", json=payload)
+        self.assertEqual(response.status_code, 200)
+
+        with self.app.app_context():
+            password = db.session.query(User.password).filter_by(username="testuser").scalar()
+            self.assertTrue(password.startswith("scrypt:"))
+
+        response = self.client.post("users/login", json=payload)
+        self.assertEqual(response.status_code, 200)
+
+    def test_bcrypt_password_hashes(self):
+        """Test signup and login with bcrypt, rehashing the existing werkzeug hashes"""
+        class BcryptConfig(Config):
+            PASSWORD_HASH_METHOD = "bcrypt"
+            BCRYPT_LOG_ROUNDS = 4
+
+        app = create_app(BcryptConfig)
+        client = app.test_client()
+
+        payload = {"username": "testuser", "password": "Password@12345"}
+        self.assertEqual(client.post("users/login", json=payload).status_code, 200)
+
+        payload = {"username": "newuser", "email": "new@example.com", "password": "Success@12345"}
+        self.assertEqual(client.post("users/signup", json=payload).status_code, 200)
+        self.assertEqual(client.post("users/login", json=payload).status_code, 200)
+
+        with app.app_context():
+            passwords = [password for password, in db.session.query(User.password)]
+            self.assertTrue(all(password.startswith("$2b$04$") for password in passwords))
+
+    def test_login_refused_when_hashing_pool_is_full(self):
+        """Test that logins are refused with 503 instead of queueing without bound"""
+        class BusyConfig(Config):
+            PASSWORD_HASH_WORKERS = 1
+            PASSWORD_HASH_MAX_PENDING = 0
+
+        app = create_app(BusyConfig)
+        client = app.test_client()
+        slots = app.extensions["password_hasher"].slots
+
+        payload = {"username": "testuser", "password": "Password@12345"}
+
+        slots.acquire()
+        try:
+            response = client.post("users/login", json=payload)
+        finally:
+            slots.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(client.post("users/login", json=payload).status_code, 200)